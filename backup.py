@@ -0,0 +1,211 @@
+"""Library export and import as a gzipped stream of title records (NDJSON or msgpack).
+
+An export starts with a header record, followed by one record per movie and show in the
+embedded shape (seasons and episodes inside the show), whatever STORAGE_LAYOUT the library
+uses. Both directions work chunk by chunk, so memory use doesn't grow with the library.
+"""
+import importlib.util
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List
+
+from pydantic import ValidationError
+
+from database import db
+from modal import MovieSchema, TVShowSchema
+
+LOGGER = logging.getLogger(__name__)
+
+# format="msgpack" needs the optional `msgpack` package (pip install msgpack)
+MSGPACK_AVAILABLE = importlib.util.find_spec("msgpack") is not None
+
+FORMATS = ("ndjson", "msgpack")
+HEADER = "ddl-stremio-export"
+VERSION = 1
+DEFAULT_BATCH_SIZE = 1000
+# Uncompressed bytes gathered before a compressed chunk is emitted
+CHUNK_SIZE = 256 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+# Invalid records listed in an import summary; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _json_object_hook(obj: Dict[str, Any]):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def _msgpack_default(value: Any):
+    import msgpack
+    if isinstance(value, datetime):
+        return msgpack.ExtType(1, value.isoformat().encode())
+    raise TypeError(f"{type(value).__name__} is not msgpack serializable")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    import msgpack
+    return datetime.fromisoformat(data.decode()) if code == 1 else msgpack.ExtType(code, data)
+
+
+def _packer(fmt: str):
+    if fmt == "msgpack":
+        import msgpack
+        packer = msgpack.Packer(default=_msgpack_default)
+        return packer.pack
+    return lambda record: json.dumps(record, default=_json_default, separators=(",", ":")).encode() + b"\n"
+
+
+def check_format(fmt: str):
+    """Raises ValueError for formats that can't be written here."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {', '.join(FORMATS)}")
+    if fmt == "msgpack" and not MSGPACK_AVAILABLE:
+        raise ValueError("The msgpack format needs the `msgpack` package (pip install msgpack)")
+
+
+async def export_library(fmt: str = "ndjson", media_types: Iterable[str] = ("movie", "tv")) -> AsyncIterator[bytes]:
+    """Yields the gzipped export of the library chunk by chunk."""
+    check_format(fmt)
+    pack = _packer(fmt)
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = [pack({"format": HEADER, "version": VERSION, "encoding": fmt, "exported_at": datetime.utcnow()})]
+    size = 0
+    for media_type in media_types:
+        async for doc in db.iter_titles(media_type):
+            record = pack(doc)
+            pending.append(record)
+            size += len(record)
+            if size >= CHUNK_SIZE:
+                chunk = gzip.compress(b"".join(pending))
+                pending, size = [], 0
+                if chunk:
+                    yield chunk
+    yield gzip.compress(b"".join(pending)) + gzip.flush()
+
+
+class _Decoder:
+    """Turns chunks of an export (gzipped or not, NDJSON or msgpack) back into records."""
+
+    def __init__(self):
+        self._gunzip = None
+        self._started = False
+        self._unpacker = None
+        self._partial = b""
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        if not self._started:
+            self._started = True
+            if chunk.startswith(GZIP_MAGIC):
+                self._gunzip = zlib.decompressobj(31)
+        if self._gunzip is not None:
+            chunk = self._inflate(chunk)
+        if not chunk:
+            return []
+        if self._unpacker is None and not self._partial:
+            stripped = chunk.lstrip()
+            if not stripped:
+                return []
+            if not stripped.startswith(b"{"):
+                if not MSGPACK_AVAILABLE:
+                    raise ValueError("This looks like a msgpack export, which needs the `msgpack` package")
+                import msgpack
+                self._unpacker = msgpack.Unpacker(ext_hook=_msgpack_ext_hook, raw=False,
+                                                  max_buffer_size=64 * 1024 * 1024)
+        if self._unpacker is not None:
+            self._unpacker.feed(chunk)
+            return list(self._unpacker)
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        return [json.loads(line, object_hook=_json_object_hook) for line in lines if line.strip()]
+
+    def _inflate(self, chunk: bytes) -> bytes:
+        out = self._gunzip.decompress(chunk)
+        # `gzip -c a b > c` style files hold several members back to back
+        while self._gunzip.eof and self._gunzip.unused_data:
+            rest = self._gunzip.unused_data
+            self._gunzip = zlib.decompressobj(31)
+            out += self._gunzip.decompress(rest)
+        return out
+
+    def close(self) -> List[Dict[str, Any]]:
+        if self._gunzip is not None and not self._gunzip.eof:
+            raise ValueError("The export is truncated")
+        if self._unpacker is None and self._partial.strip():
+            record, self._partial = self._partial, b""
+            return [json.loads(record, object_hook=_json_object_hook)]
+        return []
+
+
+def _problem(record: Any) -> str:
+    if not isinstance(record, dict):
+        return "not an object"
+    if record.get("media_type") not in ("movie", "tv"):
+        return "media_type must be movie or tv"
+    if not isinstance(record.get("tmdb_id"), int) or isinstance(record.get("tmdb_id"), bool):
+        return "tmdb_id must be an integer"
+    # Records are written as they are, so check them against the schemas first: a title, season or
+    # stream missing a field would otherwise fail while its Stremio responses are rebuilt
+    try:
+        (MovieSchema if record["media_type"] == "movie" else TVShowSchema)(**record)
+    except ValidationError as e:
+        err = e.errors()[0]
+        return f"{'.'.join(map(str, err['loc']))}: {err['msg']}"
+    return ""
+
+
+async def import_library(chunks: AsyncIterator[bytes], batch_size: int = DEFAULT_BATCH_SIZE,
+                         dry_run: bool = False) -> Dict[str, Any]:
+    """Upserts the titles of an export in batches of `batch_size` and returns a summary.
+
+    Stored titles with the same tmdb_id are replaced; invalid records are skipped and reported.
+    Raises ValueError for data that isn't an export at all.
+    """
+    decoder = _Decoder()
+    summary = {"titles": 0, "inserted": 0, "replaced": 0, "invalid": 0, "errors": [], "dry_run": dry_run}
+    batch, position = [], 0
+
+    async def flush():
+        if batch:
+            counts = await db.import_titles(batch, dry_run=dry_run)
+            summary["inserted"] += counts["inserted"]
+            summary["replaced"] += counts["replaced"]
+            batch.clear()
+
+    async def take(records: List[Any]):
+        nonlocal position
+        for record in records:
+            position += 1
+            if isinstance(record, dict) and "format" in record and "tmdb_id" not in record:
+                if record["format"] != HEADER or record.get("version", 0) > VERSION:
+                    raise ValueError(f"Unsupported export: {record.get('format')} v{record.get('version')}")
+                continue
+            problem = _problem(record)
+            if problem:
+                summary["invalid"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append(f"record {position}: {problem}")
+                continue
+            summary["titles"] += 1
+            batch.append(record)
+            if len(batch) >= batch_size:
+                await flush()
+
+    try:
+        async for chunk in chunks:
+            await take(decoder.feed(chunk))
+        await take(decoder.close())
+    except (zlib.error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Could not read the export after record {position}: {e}") from e
+    await flush()
+    LOGGER.info(f"Imported {summary['titles']} titles ({summary['inserted']} new, {summary['replaced']} replaced, "
+                f"{summary['invalid']} invalid){' as a dry run' if dry_run else ''}")
+    return summary
@@ -0,0 +1,101 @@
+"""Local stand-ins for TMDb and DDL file hosts, served with aiohttp on 127.0.0.1."""
+import asyncio
+import zlib
+
+from aiohttp import web
+
+GENRES = [{"id": 28, "name": "Action"}, {"id": 18, "name": "Drama"}, {"id": 35, "name": "Comedy"},
+          {"id": 878, "name": "Science Fiction"}, {"id": 53, "name": "Thriller"}]
+
+
+def fake_id(text: str) -> int:
+    # Stable TMDb ID for a search query, kept clear of the IDs used by the seeded library
+    return 10_000_000 + zlib.crc32(text.lower().encode()) % 10_000_000
+
+
+def _details(tmdb_id: int, media_type: str) -> dict:
+    doc = {"id": tmdb_id, "vote_average": 7.5, "overview": f"Synthetic {media_type} {tmdb_id}.",
+           "poster_path": f"/p{tmdb_id}.jpg", "backdrop_path": f"/b{tmdb_id}.jpg",
+           "genres": [GENRES[tmdb_id % len(GENRES)]]}
+    if media_type == "tv":
+        doc.update(name=f"Show {tmdb_id}", first_air_date="2020-01-01")
+    else:
+        doc.update(title=f"Movie {tmdb_id}", release_date="2020-01-01")
+    return doc
+
+
+class FakeTMDb:
+    """Answers the TMDb v3 endpoints the addon uses, after an optional simulated latency."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.app = web.Application(middlewares=[self._delay])
+        self.app.router.add_get("/3/search/tv", self.search)
+        self.app.router.add_get("/3/search/movie", self.search)
+        self.app.router.add_get("/3/find/{external_id}", self.find)
+        self.app.router.add_get("/3/{media_type}/{tmdb_id}", self.details)
+        self.app.router.add_get("/3/{media_type}/{tmdb_id}/images", self.images)
+        self.app.router.add_get("/3/tv/{tmdb_id}/season/{season}/episode/{episode}", self.episode)
+
+    @web.middleware
+    async def _delay(self, request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def search(self, request):
+        query = request.query.get("query", "")
+        media_type = "tv" if request.path.endswith("/tv") else "movie"
+        result = _details(fake_id(query), media_type)
+        return web.json_response({"page": 1, "results": [result], "total_pages": 1, "total_results": 1})
+
+    async def find(self, request):
+        tmdb_id = fake_id(request.match_info["external_id"])
+        return web.json_response({"movie_results": [_details(tmdb_id, "movie")], "tv_results": [],
+                                  "person_results": [], "tv_episode_results": [], "tv_season_results": []})
+
+    async def details(self, request):
+        return web.json_response(_details(int(request.match_info["tmdb_id"]), request.match_info["media_type"]))
+
+    async def images(self, request):
+        tmdb_id = int(request.match_info["tmdb_id"])
+        logo = {"file_path": f"/l{tmdb_id}.png", "iso_639_1": "en", "aspect_ratio": 2.0, "height": 100,
+                "width": 200, "vote_average": 5.0, "vote_count": 1}
+        return web.json_response({"id": tmdb_id, "posters": [], "backdrops": [], "logos": [logo]})
+
+    async def episode(self, request):
+        season, episode = int(request.match_info["season"]), int(request.match_info["episode"])
+        return web.json_response({"id": season * 1000 + episode, "name": f"Episode {episode}",
+                                  "season_number": season, "episode_number": episode, "still_path": None})
+
+
+class FakeFileHost:
+    """Serves HEAD/GET for any /files/<name> with a fixed Content-Length, like a DDL host."""
+
+    def __init__(self, size: int = 2 * 1024 ** 3, latency: float = 0.0):
+        self.size, self.latency = size, latency
+        self.app = web.Application()
+        self.app.router.add_get("/files/{name}", self.get)  # also answers HEAD
+
+    async def get(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.method == "HEAD":
+            response = web.StreamResponse(headers={"Accept-Ranges": "bytes"})
+            response.content_length = self.size
+            await response.prepare(request)
+            return response
+        # Ranged probe: one byte plus the full size in Content-Range
+        return web.Response(status=206, body=b"\0", headers={"Content-Range": f"bytes 0-0/{self.size}"})
+
+
+async def serve(app: web.Application) -> tuple:
+    """Starts `app` on a free local port; returns (runner, base_url)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
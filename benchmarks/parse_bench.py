@@ -0,0 +1,78 @@
+"""Filename parsing benchmark and parity check.
+
+    python benchmarks/parse_bench.py                 # time PTN vs the fast path (cold and memoized)
+    python benchmarks/parse_bench.py --check         # exit 1 if `parser.parse` disagrees with PTN anywhere
+    python benchmarks/parse_bench.py --corpus names.txt
+
+The corpus is one filename per line (default: benchmarks/filenames.txt).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filenames.txt")
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def reset():
+    parser._parse.cache_clear()
+    parser._is_reserved.cache_clear()
+    for key in parser.PARSE_STATS:
+        parser.PARSE_STATS[key] = 0
+
+
+def timed(fn, names: list) -> float:
+    start = time.perf_counter()
+    for name in names:
+        fn(name)
+    return time.perf_counter() - start
+
+
+def check(names: list) -> int:
+    reset()
+    mismatches = 0
+    for name in names:
+        ours, ptn = parser.parse(name), parser.parse_ptn(name)
+        if ours != ptn:
+            mismatches += 1
+            print(f"MISMATCH {name}\n  fast: {ours}\n  ptn:  {ptn}")
+    stats = parser.get_parse_stats()
+    print(f"{len(names)} names, {stats['fast_path']} via fast path, {stats['ptn']} via PTN, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+def bench(names: list):
+    ptn = timed(parser.parse_ptn, names)
+    reset()
+    cold = timed(parser.parse, names)
+    stats = parser.get_parse_stats()
+    warm = timed(parser.parse, names)
+    per_name = lambda seconds: f"{seconds / len(names) * 1e6:8.1f} us/name"
+    print(f"{len(names)} names ({stats['fast_path']} fast path, {stats['ptn']} PTN fallback)")
+    print(f"  PTN only        {per_name(ptn)}")
+    print(f"  fast path, cold {per_name(cold)}  ({ptn / cold:.1f}x)")
+    print(f"  memoized        {per_name(warm)}  ({ptn / warm:.0f}x)")
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    args.add_argument("--corpus", default=DEFAULT_CORPUS)
+    args.add_argument("--check", action="store_true", help="compare every name against PTN instead of timing")
+    args = args.parse_args()
+    names = load_corpus(args.corpus)
+    if args.check:
+        sys.exit(check(names))
+    bench(names)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Synthetic libraries for the benchmarks, written straight into the app's collections."""
+from datetime import datetime, timedelta
+
+import stremio
+from database import db
+
+GENRES = ["Action", "Drama", "Comedy", "Science Fiction", "Thriller", "Animation"]
+QUALITIES = ["720p", "1080p", "2160p"]
+
+SHOW_ID_OFFSET = 1_000_000
+# One in DEEP_EVERY shows is a long-running series with DEEP_SEASONS x DEEP_EPISODES episodes
+DEEP_EVERY, DEEP_SEASONS, DEEP_EPISODES = 500, 20, 25
+REGULAR_SEASONS, REGULAR_EPISODES = 1, 4
+
+
+def _streams(prefix: str, count: int = 2) -> list:
+    return [{"quality": QUALITIES[i % len(QUALITIES)], "url": f"https://files.example/{prefix}-{i}.mkv",
+             "name": f"{prefix}-{i}.mkv", "size": "2.1 GB"} for i in range(count)]
+
+
+def _title(tmdb_id: int, media_type: str, title: str, updated_on: datetime) -> dict:
+    return {"tmdb_id": tmdb_id, "media_type": media_type, "title": title, "release_year": 1990 + tmdb_id % 35,
+            "rating": round(5 + tmdb_id % 50 / 10, 1), "genres": [GENRES[tmdb_id % len(GENRES)]],
+            "poster": f"https://image.tmdb.org/t/p/w500/p{tmdb_id}.jpg",
+            "backdrop": f"https://image.tmdb.org/t/p/original/b{tmdb_id}.jpg", "logo": None,
+            "description": f"Synthetic {media_type} number {tmdb_id}.", "updated_on": updated_on}
+
+
+def movie(i: int, updated_on: datetime) -> dict:
+    doc = _title(i, "movie", f"Movie {i}", updated_on)
+    doc["streams"] = _streams(f"movie-{i}")
+    return doc
+
+
+def show(j: int, updated_on: datetime) -> dict:
+    tmdb_id = SHOW_ID_OFFSET + j
+    deep = j % DEEP_EVERY == 0
+    seasons, episodes = (DEEP_SEASONS, DEEP_EPISODES) if deep else (REGULAR_SEASONS, REGULAR_EPISODES)
+    doc = _title(tmdb_id, "tv", f"Show {j}", updated_on)
+    doc["seasons"] = [{"season_number": s, "episodes": [
+        {"episode_number": e, "title": f"Episode {e}", "episode_backdrop": None,
+         "streams": _streams(f"show-{j}-s{s}e{e}", 1)} for e in range(1, episodes + 1)]}
+        for s in range(1, seasons + 1)]
+    return doc
+
+
+def deep_show_ids(size: int) -> list:
+    return [SHOW_ID_OFFSET + j for j in range(size - size // 2) if j % DEEP_EVERY == 0]
+
+
+async def _flush(collection, docs: list):
+    if docs:
+        await collection.insert_many(docs, ordered=False)
+        docs.clear()
+
+
+async def seed(size: int, batch_size: int = 1000) -> dict:
+    """Clears the (scratch) database and fills it with `size` titles, half movies and half shows,
+    with their materialized Stremio responses. Returns the number of documents written per collection."""
+    for collection in (db.movie_collection, db.tv_collection, db.episodes_collection, db.responses_collection):
+        await collection.delete_many({})
+
+    now = datetime.utcnow()
+    counts = {"movies": 0, "tv_shows": 0, "episodes": 0, "responses": 0}
+    titles, episodes, responses = [], [], []
+
+    async def flush(collection, force=False):
+        for buffer, target in ((titles, collection), (episodes, db.episodes_collection),
+                               (responses, db.responses_collection)):
+            if force or len(buffer) >= batch_size:
+                await _flush(target, buffer)
+
+    movies = size // 2
+    for i in range(movies):
+        doc = movie(i + 1, now - timedelta(seconds=i))
+        doc["catalog_json"] = stremio.dumps(stremio.build_catalog_entry(doc))
+        responses.extend(stremio.materialize(doc))
+        titles.append(doc)
+        await flush(db.movie_collection)
+    await flush(db.movie_collection, force=True)
+    counts["movies"] = movies
+
+    for j in range(size - movies):
+        doc = show(j, now - timedelta(seconds=j))
+        doc["catalog_json"] = stremio.dumps(stremio.build_catalog_entry(doc))
+        responses.extend(stremio.materialize(doc))
+        if db.normalized:
+            for s in doc.pop("seasons"):
+                for e in s["episodes"]:
+                    episodes.append({"tmdb_id": doc["tmdb_id"], "season_number": s["season_number"],
+                                     "updated_on": now, **e})
+                    counts["episodes"] += 1
+        else:
+            counts["episodes"] += sum(len(s["episodes"]) for s in doc["seasons"])
+        titles.append(doc)
+        await flush(db.tv_collection)
+    await flush(db.tv_collection, force=True)
+    counts["tv_shows"] = size - movies
+    counts["responses"] = await db.responses_collection.count_documents({})
+    return counts
@@ -0,0 +1,120 @@
+"""Per-request CPU of the serialization paths, before (stdlib json, sanitize_document, Pydantic) and after.
+
+    python benchmarks/serialization_bench.py                         # a 20 x 25 episode series
+    python benchmarks/serialization_bench.py --seasons 40 --episodes 50 --iterations 200
+
+Everything runs in process on a synthetic series (see seed.py); no database is needed. CPU time is
+measured with `time.process_time`, so other load on the machine barely affects it.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import warnings
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:27017")
+# The "before" code uses Pydantic's v1-style `.dict()`, as the repo does
+warnings.simplefilter("ignore", DeprecationWarning)
+
+import bson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import seed  # noqa: E402
+import serialization  # noqa: E402
+import stremio  # noqa: E402
+from database import _title_fields, sanitize_document  # noqa: E402
+from modal import StreamInfo, TVShowSchema  # noqa: E402
+
+
+def stdlib_dumps(obj) -> str:
+    # stremio.dumps before this change
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def large_series(seasons: int, episodes: int) -> dict:
+    seed.DEEP_SEASONS, seed.DEEP_EPISODES = seasons, episodes
+    doc = seed.show(0, datetime.utcnow())
+    doc["_id"] = bson.ObjectId()
+    for s in doc["seasons"]:
+        for e in s["episodes"]:
+            for stream in e["streams"]:
+                stream.update(status="live", checked_at=datetime.utcnow(), size_bytes=2 * 1024 ** 3)
+    return doc
+
+
+def cpu_per_call(fn, iterations: int) -> float:
+    fn()  # warm up
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+
+def scenarios(doc: dict) -> dict:
+    """name -> (before, after) callables."""
+    meta = stremio.materialize_meta(doc)
+    stored = bson.encode({"_id": meta["_id"], "body": meta["body"], "etag": meta["etag"]})
+    raw_doc = bson.encode(doc)
+    metadata = {k: v for k, v in doc.items() if k not in ("_id", "seasons", "streams", "catalog_json")}
+    metadata.update(seasons=[{"season_number": 1, "episodes": [{"episode_number": 1, "title": "E1"}]}],
+                    quality="1080p", url="https://files.example/x.mkv")
+    now = datetime.utcnow()
+
+    def serve_stored():
+        # get_meta on a materialized title: decode the stored response and substitute the requested ID
+        stored_doc = bson.decode(stored)
+        body, _ = stremio.render(stored_doc["body"], stored_doc["etag"], "tt1234567")
+        body.encode()
+
+    def build_meta(dumps):
+        # get_meta before the title is materialized, and every rematerialization after a write
+        return lambda: dumps({"meta": stremio.build_meta(doc)})
+
+    def admin_read_before():
+        # GET /api/media-style read: sanitize, then FastAPI's jsonable_encoder and json rendering
+        json.dumps(jsonable_encoder(sanitize_document(bson.decode(raw_doc))))
+
+    def admin_read_after():
+        serialization.dumpb(bson.decode(raw_doc))
+
+    def insert_before():
+        StreamInfo(quality="1080p", url=metadata["url"], name="x.mkv", size="2 GB", status="live",
+                   checked_at=now).dict(exclude_none=True)
+        TVShowSchema(**copy.deepcopy(metadata)).dict(exclude={"tmdb_id", "seasons", "updated_on"})
+
+    def insert_after():
+        {"quality": "1080p", "url": metadata["url"], "name": "x.mkv", "size": "2 GB", "status": "live",
+         "checked_at": now}
+        _title_fields(copy.deepcopy(metadata))
+
+    return {
+        "get_meta (stored body)": (serve_stored, serve_stored),
+        "get_meta (build + serialize)": (build_meta(stdlib_dumps), build_meta(serialization.dumps)),
+        "admin read of the full show": (admin_read_before, admin_read_after),
+        "insert_media document build": (insert_before, insert_after),
+    }
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    args.add_argument("--seasons", type=int, default=20)
+    args.add_argument("--episodes", type=int, default=25, help="episodes per season")
+    args.add_argument("--iterations", type=int, default=100)
+    args = args.parse_args()
+
+    doc = large_series(args.seasons, args.episodes)
+    print(f"Series with {args.seasons} x {args.episodes} episodes, "
+          f"{len(bson.encode(doc)) / 1024:.0f} KiB as BSON; CPU per call:")
+    for name, (before, after) in scenarios(doc).items():
+        b, a = cpu_per_call(before, args.iterations), cpu_per_call(after, args.iterations)
+        print(f"  {name:30} before {b * 1e6:9.1f} us   after {a * 1e6:9.1f} us   ({b / a:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Offline load test and micro-benchmarks for the addon.
+
+Seeds a scratch database with synthetic libraries, serves fake TMDb and file-host endpoints on
+localhost, and measures throughput and p50/p99 latency of the Stremio routes, `insert_media` and
+bulk ingestion. Results are printed (or written) as JSON so runs can be diffed between commits.
+
+    python benchmarks/suite.py --mongo-uri mongodb://localhost:27017      # a local mongod (recommended)
+    python benchmarks/suite.py --sizes 1000 --output before.json          # mongomock-motor, in memory
+
+A local mongod gives representative numbers; mongomock-motor (`pip install mongomock-motor`) needs no
+server but is far slower and lacks some operators, so the affected scenarios report an error instead.
+The scratch database (`ddl_bench`) is dropped when the run ends; the app's own database is never used.
+Bulk ingestion goes through the real TMDb rate limiter, so it is bounded by TMDB_RATE_LIMIT (set it in
+the environment to measure the pipeline itself).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("TMDB_API_KEY", "benchmark")
+
+import httpx  # noqa: E402
+from themoviedb.routes_async._base import Base as TMDbRoute  # noqa: E402
+
+import main  # noqa: E402
+import seed  # noqa: E402
+from config import settings  # noqa: E402
+from database import db  # noqa: E402
+from fakes import FakeFileHost, FakeTMDb, serve  # noqa: E402
+from http_client import http  # noqa: E402
+from ingest import IngestPipeline  # noqa: E402
+
+BENCH_DB = "ddl_bench"
+
+
+def summarize(latencies: list, wall: float, errors: int) -> dict:
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"requests": len(latencies), "errors": errors, "throughput_rps": round(len(latencies) / wall, 1),
+            "p50_ms": round(pick(0.50) * 1000, 3), "p99_ms": round(pick(0.99) * 1000, 3),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 3), "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+async def measure(make_call, requests: int, concurrency: int) -> dict:
+    """Runs `requests` calls of `make_call(i)` with at most `concurrency` in flight."""
+    slots = asyncio.Semaphore(concurrency)
+    latencies, errors, first_error = [], 0, None
+
+    async def one(i):
+        nonlocal errors, first_error
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await make_call(i)
+            except Exception as e:
+                errors += 1
+                first_error = first_error or f"{type(e).__name__}: {e}"
+                return
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    result = summarize(latencies, time.perf_counter() - started, errors)
+    if first_error:
+        result["first_error"] = first_error[:300]
+    return result
+
+
+def http_scenario(client: httpx.AsyncClient, paths):
+    async def call(i):
+        response = await client.get(paths(i))
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code} for {response.request.url.path}")
+    return call
+
+
+def insert_scenario(size: int, kind: str):
+    deep = seed.deep_show_ids(size)
+
+    async def call(i):
+        if kind == "movie":
+            metadata = {**seed.movie(1 + i % (size // 2), None), "quality": "1080p",
+                        "url": f"https://files.example/new-movie-{i}-{random.random()}.mkv"}
+        else:
+            tmdb_id = deep[i % len(deep)]
+            metadata = {**seed.show(tmdb_id - seed.SHOW_ID_OFFSET, None), "quality": "1080p",
+                        "url": f"https://files.example/new-ep-{i}-{random.random()}.mkv",
+                        "seasons": [{"season_number": seed.DEEP_SEASONS + 1 + i // 50,
+                                     "episodes": [{"episode_number": i % 50 + 1, "title": "New",
+                                                   "episode_backdrop": None}]}]}
+        for key in ("streams", "updated_on", "catalog_json"):
+            metadata.pop(key, None)
+        await db.insert_media(metadata, size="2.1 GB", name=metadata["url"].rsplit("/", 1)[-1])
+    return call
+
+
+async def ingest_scenario(file_host: str, links: int, concurrency: int) -> dict:
+    urls = [f"{file_host}/files/Bench.Movie.{i}.2020.1080p.WEB.mkv" for i in range(links // 2)]
+    urls += [f"{file_host}/files/Bench.Show.{i % 10}.S01E{i // 10 + 1:02d}.1080p.WEB.mkv"
+             for i in range(links - links // 2)]
+    pipeline = IngestPipeline(probe_concurrency=concurrency, metadata_concurrency=concurrency,
+                              write_concurrency=concurrency)
+    latencies, errors, first_error = [], 0, None
+    started = time.perf_counter()
+    async for result in pipeline.run(urls):
+        # All links start together, so a link's latency is how long until its result came back
+        if result["ok"]:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+            first_error = first_error or result["message"]
+    wall = time.perf_counter() - started
+    summary = summarize(latencies, wall, errors)
+    summary.update(links=links, links_per_second=round(links / wall, 1))
+    if first_error:
+        summary["first_error"] = first_error
+    return summary
+
+
+async def run_size(size: int, client: httpx.AsyncClient, file_host: str, args) -> dict:
+    print(f"Seeding {size} titles...", file=sys.stderr)
+    started = time.perf_counter()
+    counts = await seed.seed(size)
+    await db.ensure_indexes()
+    result = {"seed": {**counts, "seconds": round(time.perf_counter() - started, 1)}, "scenarios": {}}
+    main._catalog_cursors.clear()
+    main._genre_cache.clear()
+
+    movies, shows = size // 2, size - size // 2
+    deep = seed.deep_show_ids(size)
+    rand = random.Random(size)
+    deep_skip = (size // 4) // main.CATALOG_PAGE_SIZE * main.CATALOG_PAGE_SIZE
+    scenarios = {
+        "get_catalog": lambda i: "/stremio/catalog/movie/ddl_movies.json",
+        "get_catalog_deep_skip": lambda i: f"/stremio/catalog/movie/ddl_movies/skip={deep_skip}.json",
+        "get_catalog_genre": lambda i: "/stremio/catalog/series/ddl_series/genre=Drama.json",
+        "get_meta_movie": lambda i: f"/stremio/meta/movie/ddl-{rand.randint(1, movies)}.json",
+        "get_meta_deep_series": lambda i: f"/stremio/meta/series/ddl-{deep[i % len(deep)]}.json",
+        "get_streams_movie": lambda i: f"/stremio/stream/movie/ddl-{rand.randint(1, movies)}.json",
+        "get_streams_episode":
+            lambda i: f"/stremio/stream/series/ddl-{seed.SHOW_ID_OFFSET + rand.randrange(shows)}:1:1.json",
+        "get_streams_deep_episode": lambda i: f"/stremio/stream/series/ddl-{deep[i % len(deep)]}:"
+                                              f"{rand.randint(1, seed.DEEP_SEASONS)}:"
+                                              f"{rand.randint(1, seed.DEEP_EPISODES)}.json",
+    }
+    for name, paths in scenarios.items():
+        print(f"  {name}", file=sys.stderr)
+        result["scenarios"][name] = await measure(http_scenario(client, paths), args.requests, args.concurrency)
+    for kind in ("movie", "episode"):
+        print(f"  insert_media_{kind}", file=sys.stderr)
+        result["scenarios"][f"insert_media_{kind}"] = await measure(insert_scenario(size, kind),
+                                                                    args.write_requests, args.concurrency)
+    print("  bulk_ingest", file=sys.stderr)
+    result["scenarios"]["bulk_ingest"] = await ingest_scenario(file_host, args.ingest_links, args.concurrency)
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    if args.mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client, backend = AsyncIOMotorClient(args.mongo_uri), "mongod"
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("Pass --mongo-uri for a local mongod, or `pip install mongomock-motor` to run in memory.")
+        client, backend = AsyncMongoMockClient(), "mongomock"
+    db.bind(client, BENCH_DB)
+
+    fake_tmdb, fake_files = FakeTMDb(latency=args.tmdb_latency / 1000), FakeFileHost(latency=args.host_latency / 1000)
+    tmdb_runner, tmdb_url = await serve(fake_tmdb.app)
+    TMDbRoute.TMDB_URL = tmdb_url  # every themoviedb route object now talks to the fake
+    files_runner, file_host = await serve(fake_files.app)
+    await http.start()
+    report = {"commit": git_commit(), "python": platform.python_version(), "backend": backend,
+              "storage_layout": "normalized" if db.normalized else "embedded",
+              "requests": args.requests, "concurrency": args.concurrency,
+              "tmdb_latency_ms": args.tmdb_latency, "host_latency_ms": args.host_latency,
+              "tmdb_rate_limit": settings.TMDB_RATE_LIMIT, "sizes": {}}
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as asgi:
+            for size in args.sizes:
+                report["sizes"][str(size)] = await run_size(size, asgi, file_host, args)
+        report["tmdb_requests"] = fake_tmdb.requests
+    finally:
+        await http.close()
+        await tmdb_runner.cleanup()
+        await files_runner.cleanup()
+        if backend == "mongod":
+            await client.drop_database(BENCH_DB)
+    return report
+
+
+def main_cli():
+    args = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    args.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", ""),
+                      help="local mongod to benchmark against (default: mongomock-motor in memory)")
+    args.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1000, 10000, 100000],
+                      help="comma-separated library sizes (default: 1000,10000,100000)")
+    args.add_argument("--requests", type=int, default=500, help="requests per read scenario")
+    args.add_argument("--write-requests", type=int, default=200, help="calls per insert_media scenario")
+    args.add_argument("--ingest-links", type=int, default=200, help="links in the bulk ingestion scenario")
+    args.add_argument("--concurrency", type=int, default=16)
+    args.add_argument("--tmdb-latency", type=float, default=0, help="simulated TMDb latency (ms)")
+    args.add_argument("--host-latency", type=float, default=0, help="simulated file host latency (ms)")
+    args.add_argument("--seed", type=int, default=1)
+    args.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = args.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
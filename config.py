@@ -1,9 +1,40 @@
+import os
 from os import getenv
 from dotenv import load_dotenv
 import hashlib
+import logging
+import secrets
 
 load_dotenv("config.env")
 
+
+def _generated_secret(path: str) -> str:
+    # Made once per machine and kept in `path`, so every worker process of it signs with the same key
+    for _ in range(3):
+        try:
+            with open(path) as f:
+                secret = f.read().strip()
+            if secret:
+                return secret
+        except FileNotFoundError:
+            pass
+        secret = secrets.token_hex(32)
+        try:
+            with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+                f.write(secret)
+        except FileExistsError:
+            continue  # Another worker is writing it; read theirs
+        except OSError:
+            logging.getLogger(__name__).warning(f"SESSION_SECRET is not set and {path} can't be written: sessions and "
+                                                f"/play links of this process won't survive a restart")
+            return secret
+        logging.getLogger(__name__).warning(
+            f"SESSION_SECRET is not set: generated one in {path}. Set SESSION_SECRET when running several "
+            f"replicas, or sessions and /play links only work on the machine that made them")
+        return secret
+    return secret
+
+
 class Settings:
     # Server configuration
     BASE_URL = getenv("BASE_URL", "http://127.0.0.1:8000").rstrip('/')
@@ -12,6 +43,15 @@ class Settings:
     # Database connection
     MONGO_URI = getenv("MONGO_URI", "")
     DB_NAME = "ddl_stremio_premium"
+    # Connection pool of each worker process; by default 100 connections are split across the WEB_CONCURRENCY
+    # uvicorn workers of a replica (total connections = pool size x workers x replicas)
+    WEB_CONCURRENCY = max(1, int(getenv("WEB_CONCURRENCY", "1")))
+    MONGO_MAX_POOL_SIZE = int(getenv("MONGO_MAX_POOL_SIZE", str(max(10, 100 // WEB_CONCURRENCY))))
+    MONGO_MIN_POOL_SIZE = int(getenv("MONGO_MIN_POOL_SIZE", "0"))
+    # "embedded" keeps seasons/episodes/streams inside each show document; "normalized" stores
+    # episodes in their own collection. Switch every process to "normalized" first, then run
+    # `python manage.py migrate-episodes`: normalized mode still serves shows not migrated yet, embedded mode doesn't
+    STORAGE_LAYOUT = getenv("STORAGE_LAYOUT", "embedded").lower()
 
     # API Keys
     TMDB_API_KEY = getenv("TMDB_API_KEY", "")
@@ -20,5 +60,105 @@ class Settings:
     ADMIN_USERNAME = getenv("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD = getenv("ADMIN_PASSWORD", "admin")
     ADMIN_PASSWORD_HASH = hashlib.sha256(ADMIN_PASSWORD.encode()).hexdigest()
+    # Signs session cookies and /play links; every worker and replica must share it. When unset, a random
+    # one is generated and kept in SESSION_SECRET_FILE, which only the workers of one machine share
+    SESSION_SECRET_FILE = getenv("SESSION_SECRET_FILE", ".session_secret")
+    SESSION_SECRET = getenv("SESSION_SECRET", "") or _generated_secret(SESSION_SECRET_FILE)
+
+    # Scale-out: second cache tier shared by all processes ("mongo" for a TTL collection, "redis" for any
+    # Redis-compatible server at REDIS_URL; empty = per-process, optionally TMDB_CACHE_SQLITE_PATH), and the
+    # lease TTL (seconds) that lets only one process run each background service
+    CACHE_BACKEND = getenv("CACHE_BACKEND", "").lower()
+    REDIS_URL = getenv("REDIS_URL", "redis://localhost:6379/0")
+    LEASE_TTL = int(getenv("LEASE_TTL", "60"))
+
+    # Cache-Control max-age (seconds) for Stremio catalog/meta/stream responses
+    STREMIO_CACHE_MAX_AGE = int(getenv("STREMIO_CACHE_MAX_AGE", "300"))
+
+    # TMDb response cache: entries kept in memory, TTLs (seconds) per endpoint type, optional SQLite file
+    TMDB_CACHE_SIZE = int(getenv("TMDB_CACHE_SIZE", "5000"))
+    TMDB_CACHE_TTL_SEARCH = int(getenv("TMDB_CACHE_TTL_SEARCH", str(6 * 3600)))
+    TMDB_CACHE_TTL_DETAILS = int(getenv("TMDB_CACHE_TTL_DETAILS", str(24 * 3600)))
+    TMDB_CACHE_TTL_IMAGES = int(getenv("TMDB_CACHE_TTL_IMAGES", str(7 * 24 * 3600)))
+    TMDB_CACHE_TTL_FIND = int(getenv("TMDB_CACHE_TTL_FIND", str(7 * 24 * 3600)))
+    TMDB_CACHE_SQLITE_PATH = getenv("TMDB_CACHE_SQLITE_PATH", "")
+
+    # TMDb client-side rate limit: sustained requests/second, burst, max concurrent calls, retries on 429/5xx
+    TMDB_RATE_LIMIT = float(getenv("TMDB_RATE_LIMIT", "40"))
+    TMDB_RATE_BURST = int(getenv("TMDB_RATE_BURST", "20"))
+    TMDB_MAX_CONCURRENCY = int(getenv("TMDB_MAX_CONCURRENCY", "16"))
+    TMDB_MAX_RETRIES = int(getenv("TMDB_MAX_RETRIES", "4"))
+
+    # Outgoing HTTP to file hosts (timeouts and backoff in seconds)
+    HTTP_TIMEOUT = float(getenv("HTTP_TIMEOUT", "10"))
+    HTTP_CONNECT_TIMEOUT = float(getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_MAX_CONNECTIONS = int(getenv("HTTP_MAX_CONNECTIONS", "100"))
+    HTTP_MAX_PER_HOST = int(getenv("HTTP_MAX_PER_HOST", "8"))
+    HTTP_RETRIES = int(getenv("HTTP_RETRIES", "2"))
+    HTTP_RETRY_BACKOFF = float(getenv("HTTP_RETRY_BACKOFF", "0.5"))
+    HTTP_MAX_BACKOFF = float(getenv("HTTP_MAX_BACKOFF", "10"))
+    HTTP2 = getenv("HTTP2", "true").lower() == "true"
+
+    # Bulk ingestion: concurrent HEAD probes, TMDb lookups and DB writes, and links accepted per request
+    INGEST_PROBE_CONCURRENCY = int(getenv("INGEST_PROBE_CONCURRENCY", "16"))
+    INGEST_METADATA_CONCURRENCY = int(getenv("INGEST_METADATA_CONCURRENCY", "4"))
+    INGEST_WRITE_CONCURRENCY = int(getenv("INGEST_WRITE_CONCURRENCY", "4"))
+    INGEST_MAX_LINKS = int(getenv("INGEST_MAX_LINKS", "5000"))
+
+    # Background ingest jobs: worker pool size, attempts per link, retry delay and idle poll interval
+    # (seconds), and how long finished jobs are kept
+    JOB_WORKERS = int(getenv("JOB_WORKERS", "4"))
+    JOB_MAX_ATTEMPTS = int(getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_DELAY = float(getenv("JOB_RETRY_DELAY", "30"))
+    JOB_POLL_INTERVAL = float(getenv("JOB_POLL_INTERVAL", "5"))
+    JOB_RETENTION = int(getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+
+    # Stream link health checks: revalidation interval and retry delay for failing links (seconds), concurrent
+    # checks overall and per host, minimum gap between checks of one host (seconds), consecutive failures before
+    # a link counts as dead, and how often stored streams are re-scanned for untracked URLs (seconds)
+    LINK_CHECK_ENABLED = getenv("LINK_CHECK_ENABLED", "true").lower() == "true"
+    LINK_CHECK_INTERVAL = int(getenv("LINK_CHECK_INTERVAL", str(24 * 3600)))
+    LINK_CHECK_RETRY_DELAY = int(getenv("LINK_CHECK_RETRY_DELAY", "3600"))
+    LINK_CHECK_CONCURRENCY = int(getenv("LINK_CHECK_CONCURRENCY", "8"))
+    LINK_CHECK_PER_HOST = int(getenv("LINK_CHECK_PER_HOST", "2"))
+    LINK_CHECK_HOST_INTERVAL = float(getenv("LINK_CHECK_HOST_INTERVAL", "0.5"))
+    LINK_CHECK_DEAD_AFTER = int(getenv("LINK_CHECK_DEAD_AFTER", "3"))
+    LINK_CHECK_SYNC_INTERVAL = int(getenv("LINK_CHECK_SYNC_INTERVAL", str(24 * 3600)))
+
+    # Metadata refresh from TMDb's change feeds: how often they are polled (seconds), titles refreshed at once, how
+    # far back the very first poll looks (days), and which stored fields a refresh may overwrite ("episodes" covers
+    # episode titles and stills; drop e.g. poster/logo to keep artwork picked in the editor)
+    REFRESH_ENABLED = getenv("REFRESH_ENABLED", "true").lower() == "true"
+    REFRESH_INTERVAL = int(getenv("REFRESH_INTERVAL", str(6 * 3600)))
+    REFRESH_CONCURRENCY = int(getenv("REFRESH_CONCURRENCY", "4"))
+    REFRESH_LOOKBACK_DAYS = int(getenv("REFRESH_LOOKBACK_DAYS", "1"))
+    REFRESH_FIELDS = [f.strip() for f in getenv(
+        "REFRESH_FIELDS", "title,rating,genres,description,release_year,poster,backdrop,logo,episodes").split(",")
+        if f.strip()]
+
+    # Playback URLs in stream responses: "direct" hands out the stored URL (or where it permanently redirects to),
+    # "play" hands out BASE_URL/play/<token>, which redirects to the link's current final URL. Redirect chains
+    # without expiry hints are trusted for RESOLVE_TTL seconds; resolutions kept in memory
+    PLAYBACK_MODE = getenv("PLAYBACK_MODE", "direct").lower()
+    RESOLVE_TTL = int(getenv("RESOLVE_TTL", "900"))
+    RESOLVE_CACHE_SIZE = int(getenv("RESOLVE_CACHE_SIZE", "10000"))
+
+    # Image proxy: Stremio responses point TMDb images at BASE_URL/img/..., served resized and as WebP (with Pillow,
+    # which the app installs) from a disk cache that drops least recently used files beyond IMAGE_CACHE_MAX_BYTES
+    IMAGE_PROXY = getenv("IMAGE_PROXY", "false").lower() == "true"
+    IMAGE_CACHE_DIR = getenv("IMAGE_CACHE_DIR", "image_cache")
+    IMAGE_CACHE_MAX_BYTES = int(getenv("IMAGE_CACHE_MAX_BYTES", str(1024 ** 3)))
+    IMAGE_WEBP_QUALITY = int(getenv("IMAGE_WEBP_QUALITY", "80"))
+
+    # Bearer token required to scrape /metrics (empty = open)
+    METRICS_TOKEN = getenv("METRICS_TOKEN", "")
+
+    # Parsed filenames kept in memory
+    PARSE_CACHE_SIZE = int(getenv("PARSE_CACHE_SIZE", "10000"))
+
+    # IMDb -> TMDb ID mapping cache (TTLs in seconds)
+    ID_MAP_CACHE_SIZE = int(getenv("ID_MAP_CACHE_SIZE", "10000"))
+    ID_MAP_TTL = int(getenv("ID_MAP_TTL", str(30 * 24 * 3600)))
+    ID_MAP_NEGATIVE_TTL = int(getenv("ID_MAP_NEGATIVE_TTL", str(24 * 3600)))
 
 settings = Settings()
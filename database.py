@@ -1,115 +1,1058 @@
+import asyncio
+import logging
+import random
 import motor.motor_asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import stremio
 
 from config import settings
-from modal import MovieSchema, TVShowSchema, StreamInfo
+from metrics import MONGO_ERRORS, MONGO_LATENCY, instrument
+from modal import MediaBase
+
+LOGGER = logging.getLogger(__name__)
+
+# Longest search string accepted; $text queries are token lookups, so this only bounds the work per query
+MAX_SEARCH_LENGTH = 100
+
+# Named read views: the fields each kind of caller needs (None = the whole document)
+VIEWS = {
+    # Stremio catalog tiles (catalog_json is pre-serialized; the rest rebuilds it for older titles)
+    "catalog": {"catalog_json": 1, "tmdb_id": 1, "title": 1, "poster": 1, "release_year": 1, "logo": 1,
+                "media_type": 1, "updated_on": 1},
+    # Admin grid and dashboard
+    "list": {"tmdb_id": 1, "title": 1, "poster": 1, "release_year": 1, "rating": 1, "media_type": 1,
+             "updated_on": 1},
+    # Streams of a movie
+    "stream": {"tmdb_id": 1, "media_type": 1, "streams": 1},
+    # Editor and materialization
+    "full": None,
+}
+
+# Title fields written by ingestion. metadata.py builds them from TMDb, so they are copied as they are
+# instead of going through the Pydantic models (those validate admin edits)
+TITLE_FIELDS = {name: field for name, field in MediaBase.model_fields.items() if name not in ("tmdb_id", "updated_on")}
+
+
+def _title_fields(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    # A missing required field raises KeyError; optional ones get the schema's default
+    return {name: metadata[name] if name in metadata or field.is_required()
+            else field.get_default(call_default_factory=True) for name, field in TITLE_FIELDS.items()}
 
-# Helper function to sanitize MongoDB's special data types for JSON conversion
+
+# Helper function to sanitize MongoDB's special data types for JSON conversion (templates and cold paths;
+# API responses render them directly, see serialization.py)
 def sanitize_document(doc: Dict[str, Any]) -> Dict[str, Any]:
     if not doc:
         return None
     for key, value in list(doc.items()):
-        if isinstance(value, ObjectId):
-            doc[key] = str(value)
-        elif isinstance(value, datetime):
-            doc[key] = value.isoformat()
+        doc[key] = _sanitize_value(value)
     return doc
 
+
+def _sanitize_value(value: Any) -> Any:
+    # Nested too: streams carry their own `checked_at`
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _sanitize_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_sanitize_value(v) for v in value]
+    return value
+
+class EditConflict(Exception):
+    """The title changed after the editor loaded it (see Database.patch_media)."""
+
+    def __init__(self, updated_on: Optional[datetime]):
+        super().__init__(f"The title was modified at {updated_on}")
+        self.updated_on = updated_on
+
+
+@instrument(MONGO_LATENCY, MONGO_ERRORS, "operation")
 class Database:
     def __init__(self, uri: str, db_name: str):
-        self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
-        self.db = self._client[db_name]
+        client = motor.motor_asyncio.AsyncIOMotorClient(uri, maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                                                        minPoolSize=settings.MONGO_MIN_POOL_SIZE)
+        self.bind(client, db_name)
+        self.normalized = settings.STORAGE_LAYOUT == "normalized"
+        self._pending_materializations = set()
+
+    def bind(self, client, db_name: str):
+        """Points every collection at `client[db_name]` (e.g. a scratch database for the benchmarks)."""
+        self._client = client
+        self.db = client[db_name]
         self.movie_collection = self.db.movies
         self.tv_collection = self.db.tv_shows
+        self.id_map_collection = self.db.id_map
+        self.responses_collection = self.db.stremio_responses
+        self.episodes_collection = self.db.episodes
+        self.jobs_collection = self.db.ingest_jobs
+        self.link_health_collection = self.db.link_health
+        self.leases_collection = self.db.leases
+        self.kv_collection = self.db.kv_cache
+        self.checkpoints_collection = self.db.checkpoints
+
+    def _collection(self, media_type: str):
+        return self.movie_collection if media_type == 'movie' else self.tv_collection
+
+    async def ensure_indexes(self):
+        """Creates the indexes the app relies on. Safe to run on every startup."""
+        specs = []
+        for collection in (self.movie_collection, self.tv_collection):
+            specs += [
+                (collection, [("tmdb_id", ASCENDING)], {"name": "tmdb_id_unique", "unique": True}),
+                (collection, [("updated_on", DESCENDING), ("_id", DESCENDING)], {"name": "updated_on"}),
+                (collection, [("genres", ASCENDING), ("updated_on", DESCENDING), ("_id", DESCENDING)],
+                 {"name": "genres_updated_on"}),
+                (collection, [("title", TEXT)], {"name": "title_text", "default_language": "none"}),
+            ]
+        specs += [
+            (self.id_map_collection, [("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+            (self.responses_collection, [("media_type", ASCENDING), ("tmdb_id", ASCENDING)], {"name": "media"}),
+            (self.episodes_collection, [("tmdb_id", ASCENDING), ("season_number", ASCENDING),
+                                        ("episode_number", ASCENDING)], {"name": "episode_unique", "unique": True}),
+            (self.jobs_collection, [("status", ASCENDING), ("run_after", ASCENDING), ("_id", ASCENDING)],
+             {"name": "claim"}),
+            (self.jobs_collection, [("batch_id", ASCENDING), ("updated_on", ASCENDING)], {"name": "batch"}),
+            (self.jobs_collection, [("finished_at", ASCENDING)],
+             {"name": "finished_at_ttl", "expireAfterSeconds": settings.JOB_RETENTION}),
+            (self.link_health_collection, [("next_check_at", ASCENDING)], {"name": "next_check"}),
+            (self.link_health_collection, [("media_type", ASCENDING), ("tmdb_id", ASCENDING)], {"name": "media"}),
+            (self.kv_collection, [("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+        ]
+        missing = []
+        for collection, keys, options in specs:
+            try:
+                await collection.create_index(keys, **options)
+            except PyMongoError as e:
+                LOGGER.error(f"Could not create index {options['name']} on {collection.name}: {e}")
+                if options.get("unique"):
+                    missing.append(f"{collection.name}.{options['name']}")
+        if missing:
+            # Upserts (ingest, import, episode writes) only stay single thanks to these; without them every
+            # write would quietly add another copy, so refuse to start instead. The usual cause is an old
+            # library that already holds duplicate tmdb_ids: remove the extra copies, then start again
+            raise RuntimeError(f"Unique indexes missing: {', '.join(missing)}. Remove the duplicate documents "
+                               f"(see the errors above) and restart.")
 
     async def get_stats(self):
-        movie_count = await self.movie_collection.count_documents({})
-        tv_count = await self.tv_collection.count_documents({})
+        # Collection metadata counts; exact enough for a dashboard and O(1) instead of a scan
+        movie_count = await self.movie_collection.estimated_document_count()
+        tv_count = await self.tv_collection.estimated_document_count()
         return {"movies": movie_count, "tv_shows": tv_count}
 
-    async def insert_media(self, metadata: dict, size: str, name: str):
+    async def get_recent_media(self, limit: int, view: str = "list") -> List[Dict[str, Any]]:
+        """Most recently updated movies and shows, merged server-side in one round trip."""
+        newest = [{"$sort": {"updated_on": -1}}, {"$limit": limit}]
+        if VIEWS[view]:
+            newest.append({"$project": VIEWS[view]})
+        pipeline = newest + [{"$unionWith": {"coll": self.tv_collection.name, "pipeline": newest}},
+                             {"$sort": {"updated_on": -1}}, {"$limit": limit}]
+        return await self.movie_collection.aggregate(pipeline).to_list(length=limit)
+
+    async def insert_media(self, metadata: dict, size: str, name: str,
+                           resolution: Optional[Dict[str, Any]] = None) -> bool:
+        """Adds one stream for a movie or episode, creating the title, season or episode as needed.
+
+        `resolution` holds where the URL redirected to when it was probed (see resolver.py). Every step is a single atomic update keyed on `tmdb_id` (relying on its unique index), so
+        the cost doesn't grow with the show and concurrent ingests of one title can't lose writes.
+        Returns False if the exact same URL was already stored.
+        """
+        tmdb_id, now = metadata['tmdb_id'], datetime.utcnow()
+        # Ingestion only stores links that just answered a probe
+        stream_info = {"quality": metadata['quality'], "url": metadata['url'], "name": name, "size": size,
+                       "status": "live", "checked_at": now,
+                       **{k: v for k, v in (resolution or {}).items() if v is not None}}
+        next_check_at = now + timedelta(seconds=settings.LINK_CHECK_INTERVAL)
+
         if metadata['media_type'] == "movie":
-            existing = await self.movie_collection.find_one({"tmdb_id": metadata['tmdb_id']})
-            stream_info = {"quality": metadata['quality'], "url": metadata['url'], "name": name, "size": size}
-            
-            if existing:
-                streams = existing.get("streams", [])
+            base = _title_fields(metadata)
+            try:
                 # Prevent adding if the exact same URL already exists
-                if not any(s['url'] == stream_info['url'] for s in streams):
-                    streams.append(stream_info)
-                    await self.movie_collection.update_one(
-                        {"_id": existing["_id"]},
-                        {"$set": {"streams": streams, "updated_on": datetime.utcnow()}}
-                    )
-            else:
-                await self.movie_collection.insert_one(MovieSchema(**metadata, streams=[stream_info]).dict())
-        
-        else: # TV Show logic
-            existing = await self.tv_collection.find_one({"tmdb_id": metadata['tmdb_id']})
-            stream_info = StreamInfo(quality=metadata['quality'], url=metadata['url'], name=name, size=size)
-            
-            new_season_data = metadata['seasons'][0]
-            new_episode_data = new_season_data['episodes'][0]
-
-            if existing:
-                season_found = False
-                for s in existing.get("seasons", []):
-                    if s['season_number'] == new_season_data['season_number']:
-                        season_found = True
-                        episode_found = False
-                        for e in s.get("episodes", []):
-                            if e['episode_number'] == new_episode_data['episode_number']:
-                                episode_found = True
-                                # IMPROVED: Prevent adding if the exact same URL already exists
-                                if not any(q['url'] == stream_info.url for q in e.get("streams", [])):
-                                    e['streams'].append(stream_info.dict())
-                                break
-                        if not episode_found:
-                            new_episode_data['streams'] = [stream_info.dict()]
-                            s['episodes'].append(new_episode_data)
-                        break
-                if not season_found:
-                    new_season_data['episodes'][0]['streams'] = [stream_info.dict()]
-                    existing.setdefault('seasons', []).append(new_season_data)
-                
-                await self.tv_collection.update_one(
-                    {"_id": existing["_id"]}, 
-                    {"$set": {"seasons": existing['seasons'], "updated_on": datetime.utcnow()}}
+                await self.movie_collection.update_one(
+                    {"tmdb_id": tmdb_id, "streams.url": {"$ne": stream_info['url']}},
+                    {"$push": {"streams": stream_info}, "$set": {"updated_on": now}, "$setOnInsert": base},
+                    upsert=True
                 )
-            else:
-                tv_data = TVShowSchema(**metadata)
-                tv_data.seasons[0].episodes[0].streams = [stream_info]
-                await self.tv_collection.insert_one(tv_data.dict())
+            except DuplicateKeyError:
+                # The title exists and already has this URL, so the filter didn't match and the upsert collided
+                return False
+            await self.track_links([self._link_entry(stream_info['url'], "movie", tmdb_id, status="live",
+                                                     next_check_at=next_check_at, resolution=resolution)])
+            await self.materialize_media("movie", tmdb_id)
+            return True
+
+        # TV Show logic
+        new_season_data = metadata['seasons'][0]
+        new_episode_data = new_season_data['episodes'][0]
+        season_number, episode_number = new_season_data['season_number'], new_episode_data['episode_number']
+
+        base = _title_fields(metadata)
+        link = self._link_entry(stream_info['url'], "tv", tmdb_id, season_number, episode_number, status="live",
+                                next_check_at=next_check_at, resolution=resolution)
+        # Shows not migrated to the normalized layout yet keep taking episodes in their own document,
+        # where _load_title reads them
+        if self.normalized and not await self.tv_collection.find_one(
+                {"tmdb_id": tmdb_id, "seasons.0": {"$exists": True}}, {"_id": 1}):
+            added = await self._insert_episode_stream(tmdb_id, base, new_episode_data, season_number, stream_info, now)
+            if added:
+                await self.track_links([link])
+                await self.materialize_media("tv", tmdb_id, episode=(season_number, episode_number))
+            return added
+        try:
+            # updated_on from the start: catalog paging and editor saves key on it
+            await self.tv_collection.update_one({"tmdb_id": tmdb_id},
+                                                {"$setOnInsert": {**base, "seasons": [], "updated_on": now}},
+                                                upsert=True)
+        except DuplicateKeyError:
+            pass  # Created concurrently by another ingest
+        await self.tv_collection.update_one(
+            {"tmdb_id": tmdb_id, "seasons.season_number": {"$ne": season_number}},
+            {"$push": {"seasons": {"season_number": season_number, "episodes": []}}}
+        )
+        episode = {**new_episode_data, "streams": [stream_info]}
+        result = await self.tv_collection.update_one(
+            {"tmdb_id": tmdb_id, "seasons": {"$elemMatch": {"season_number": season_number,
+                                                            "episodes.episode_number": {"$ne": episode_number}}}},
+            {"$push": {"seasons.$[s].episodes": episode}, "$set": {"updated_on": now}},
+            array_filters=[{"s.season_number": season_number}]
+        )
+        if not result.modified_count:
+            # The episode exists; add the stream unless the exact same URL is already there
+            result = await self.tv_collection.update_one(
+                {"tmdb_id": tmdb_id, "seasons": {"$elemMatch": {"season_number": season_number, "episodes": {
+                    "$elemMatch": {"episode_number": episode_number, "streams.url": {"$ne": stream_info['url']}}}}}},
+                {"$push": {"seasons.$[s].episodes.$[e].streams": stream_info}, "$set": {"updated_on": now}},
+                array_filters=[{"s.season_number": season_number}, {"e.episode_number": episode_number}]
+            )
+            if not result.modified_count:
+                return False
+        await self.track_links([link])
+        await self.materialize_media("tv", tmdb_id, episode=(season_number, episode_number))
+        return True
+
+    async def _insert_episode_stream(self, tmdb_id: int, base: dict, episode_data: dict, season_number: int,
+                                     stream_info: dict, now: datetime) -> bool:
+        # Normalized layout: the show document only holds title metadata, each episode is its own document
+        try:
+            await self.tv_collection.update_one({"tmdb_id": tmdb_id}, {"$setOnInsert": {**base, "updated_on": now}},
+                                                upsert=True)
+        except DuplicateKeyError:
+            pass  # Created concurrently by another ingest
+        episode_key = {"tmdb_id": tmdb_id, "season_number": season_number,
+                       "episode_number": episode_data['episode_number']}
+        try:
+            await self.episodes_collection.update_one(
+                {**episode_key, "streams.url": {"$ne": stream_info['url']}},
+                {"$push": {"streams": stream_info}, "$set": {"updated_on": now},
+                 "$setOnInsert": {"title": episode_data['title'],
+                                  "episode_backdrop": episode_data.get('episode_backdrop')}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False  # The episode already has this URL
+        await self.tv_collection.update_one({"tmdb_id": tmdb_id}, {"$set": {"updated_on": now}})
+        return True
 
-    async def get_media_list(self, media_type: str, page: int, page_size: int, search: Optional[str] = None):
-        collection = self.movie_collection if media_type == 'movie' else self.tv_collection
+    @staticmethod
+    def _group_seasons(episodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        seasons = {}
+        for ep in episodes:
+            season = seasons.setdefault(ep['season_number'], {"season_number": ep['season_number'], "episodes": []})
+            season['episodes'].append({k: v for k, v in ep.items()
+                                       if k not in ("_id", "tmdb_id", "season_number", "updated_on")})
+        return list(seasons.values())
+
+    async def _load_title(self, media_type: str, tmdb_id: int, streams: Any = True) -> Optional[Dict[str, Any]]:
+        """Loads a title in the embedded shape, whatever the storage layout.
+
+        `streams` is True for every stream, False for none, or a (season, episode) pair to only
+        include that episode's streams.
+        """
+        projection = {"streams": 0, "seasons.episodes.streams": 0} if streams is False else None
+        doc = await self._collection(media_type).find_one({"tmdb_id": tmdb_id}, projection)
+        if not doc or media_type == 'movie' or not self.normalized or doc.get("seasons"):
+            return doc
+
+        episodes = await self.episodes_collection.find({"tmdb_id": tmdb_id}, None if streams is True else {"streams": 0}) \
+            .sort([("season_number", 1), ("episode_number", 1)]).to_list(length=None)
+        if isinstance(streams, tuple):
+            target = await self.get_stream_source(media_type, tmdb_id, *streams)
+            for ep in episodes:
+                if (ep['season_number'], ep['episode_number']) == tuple(streams):
+                    ep['streams'] = target or []
+        doc['seasons'] = self._group_seasons(episodes)
+        return doc
+
+    async def get_stream_source(self, media_type: str, tmdb_id: int, season: Optional[int] = None,
+                                episode: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Fetches only the stored streams of a movie or one episode, or None if it doesn't exist."""
+        if media_type == 'movie':
+            doc = await self.movie_collection.find_one({"tmdb_id": tmdb_id}, VIEWS["stream"])
+            return doc.get("streams", []) if doc else None
+        if self.normalized:
+            doc = await self.episodes_collection.find_one(
+                {"tmdb_id": tmdb_id, "season_number": season, "episode_number": episode}, {"streams": 1})
+            if doc:
+                return doc.get("streams", [])
+        # Embedded layout (or a show not migrated yet): let the server pick out the one episode
+        docs = await self.tv_collection.aggregate([
+            {"$match": {"tmdb_id": tmdb_id}},
+            {"$unwind": "$seasons"}, {"$match": {"seasons.season_number": season}},
+            {"$unwind": "$seasons.episodes"}, {"$match": {"seasons.episodes.episode_number": episode}},
+            {"$project": {"_id": 0, "streams": "$seasons.episodes.streams"}},
+        ]).to_list(length=1)
+        return docs[0].get("streams", []) if docs else None
+
+    @staticmethod
+    def _list_query(search: Optional[str] = None, genre: Optional[str] = None) -> Dict[str, Any]:
         query = {}
         if search:
-            query = {"title": {"$regex": search, "$options": "i"}}
-        
-        total_count = await collection.count_documents(query)
-        cursor = collection.find(query).sort("updated_on", -1).skip((page - 1) * page_size).limit(page_size)
-        items = await cursor.to_list(length=page_size)
-
-        sanitized_items = [sanitize_document(item) for item in items]
-        return sanitized_items, total_count
-
-    async def get_media_by_tmdb_id(self, media_type: str, tmdb_id: int):
-        collection = self.movie_collection if media_type == 'movie' else self.tv_collection
-        doc = await collection.find_one({"tmdb_id": tmdb_id})
+            query["$text"] = {"$search": search[:MAX_SEARCH_LENGTH]}
+        if genre:
+            query["genres"] = genre
+        return query
+
+    async def get_media_list(self, media_type: str, page: int, page_size: int, search: Optional[str] = None,
+                             genre: Optional[str] = None, after: Optional[tuple] = None, count: bool = True,
+                             view: str = "list"):
+        """Lists titles newest first, or by relevance when searching, with the fields of `view`.
+
+        `after` is an (updated_on, _id) keyset cursor (see `list_cursor`); when given, the page
+        starts right after that item and `page` is ignored, so deep pages cost the same as the first.
+        Searches use the title text index and are ranked by score, so they page by offset.
+        Items come back as stored (ObjectId, datetime); render them with serialization.FastJSONResponse.
+        """
+        collection = self._collection(media_type)
+        query = self._list_query(search, genre)
+        projection = VIEWS[view]
+        total_count = await collection.count_documents(query) if count else None
+
+        if search:
+            cursor = collection.find(query, {**(projection or {}), "score": {"$meta": "textScore"}}) \
+                .sort([("score", {"$meta": "textScore"}), ("updated_on", -1)]) \
+                .skip((page - 1) * page_size).limit(page_size)
+            return await cursor.to_list(length=page_size), total_count
+
+        if after:
+            updated_on, last_id = after
+            query = {"$and": [query, {"$or": [{"updated_on": {"$lt": updated_on}},
+                                              {"updated_on": updated_on, "_id": {"$lt": last_id}}]}]}
+            cursor = collection.find(query, projection)
+        else:
+            cursor = collection.find(query, projection).skip((page - 1) * page_size)
+        cursor = cursor.sort([("updated_on", -1), ("_id", -1)]).limit(page_size)
+        return await cursor.to_list(length=page_size), total_count
+
+    async def get_list_cursor_at(self, media_type: str, offset: int, genre: Optional[str] = None) -> Optional[tuple]:
+        """Finds the keyset cursor of the item just before `offset`, for clients that only know offsets."""
+        if offset <= 0:
+            return None
+        cursor = self._collection(media_type).find(self._list_query(genre=genre), {"updated_on": 1}) \
+            .sort([("updated_on", -1), ("_id", -1)]).skip(offset - 1).limit(1)
+        items = await cursor.to_list(length=1)
+        return (items[0]["updated_on"], items[0]["_id"]) if items else None
+
+    # Keyset cursors of served catalog pages, shared by every process (see main.catalog_page)
+    async def get_catalog_cursor(self, media_type: str, genre: Optional[str], offset: int) -> Optional[tuple]:
+        doc = await self.kv_collection.find_one({"_id": f"catalog-cursor:{media_type}:{genre or ''}:{offset}",
+                                                 "expires_at": {"$gt": datetime.utcnow()}}, {"cursor": 1})
+        return tuple(doc["cursor"]) if doc else None
+
+    async def set_catalog_cursor(self, media_type: str, genre: Optional[str], offset: int, cursor: tuple,
+                                 ttl: float):
+        await self.kv_collection.update_one(
+            {"_id": f"catalog-cursor:{media_type}:{genre or ''}:{offset}"},
+            {"$set": {"cursor": list(cursor), "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    @staticmethod
+    def list_cursor(item: Dict[str, Any]) -> tuple:
+        """Keyset cursor of an item returned by `get_media_list`."""
+        return item["updated_on"], item["_id"]
+
+    async def get_genres(self, media_type: str) -> List[str]:
+        return sorted(g for g in await self._collection(media_type).distinct("genres") if g)
+
+    async def get_media_by_tmdb_id(self, media_type: str, tmdb_id: int, view: str = "full"):
+        if VIEWS[view] is None:
+            doc = await self._load_title(media_type, tmdb_id)
+        else:
+            doc = await self._collection(media_type).find_one({"tmdb_id": tmdb_id}, VIEWS[view])
         return sanitize_document(doc)
 
     async def update_media_details(self, media_type: str, tmdb_id: int, data: Dict[str, Any]):
         data.pop("_id", None)
-        collection = self.movie_collection if media_type == 'movie' else self.tv_collection
+        data.pop("catalog_json", None)
+        await self._apply_link_health(media_type, tmdb_id, data)
+        collection = self._collection(media_type)
+        seasons = data.pop("seasons", None) if media_type == 'tv' and self.normalized else None
         result = await collection.update_one({"tmdb_id": tmdb_id}, {"$set": data})
-        return result.modified_count > 0
+        modified = result.modified_count > 0
+        if seasons is not None and result.matched_count:
+            modified = await self._replace_episodes(tmdb_id, seasons) or modified
+        if modified:
+            await self.materialize_media(media_type, tmdb_id)
+        return modified
+
+    async def _replace_episodes(self, tmdb_id: int, seasons: List[Dict[str, Any]]) -> bool:
+        ops, keep = [], []
+        for s in seasons:
+            for e in s.get("episodes", []):
+                key = {"tmdb_id": tmdb_id, "season_number": s['season_number'], "episode_number": e['episode_number']}
+                keep.append({"season_number": s['season_number'], "episode_number": e['episode_number']})
+                ops.append(ReplaceOne(key, {**key, **{k: v for k, v in e.items() if k != "_id"},
+                                            "updated_on": datetime.utcnow()}, upsert=True))
+        removed = await self.episodes_collection.delete_many(
+            {"tmdb_id": tmdb_id, "$nor": keep} if keep else {"tmdb_id": tmdb_id})
+        if ops:
+            await self.episodes_collection.bulk_write(ops, ordered=False)
+        return bool(ops) or removed.deleted_count > 0
+
+    async def patch_media(self, media_type: str, tmdb_id: int, expected: datetime, fields: Dict[str, Any],
+                          ops: List[Dict[str, Any]]) -> Optional[datetime]:
+        """Applies an editor's changes as targeted updates instead of rewriting the whole title.
+
+        `expected` is the `updated_on` the editor loaded. The title fields are set, and `updated_on`
+        bumped, only if it still holds; otherwise EditConflict is raised, so a save can't undo a stream
+        an ingest added meanwhile. `ops` (validated by main.validate_patch) then run in order, each a
+        single update of one season, episode or stream. Returns the new `updated_on`, or None if the
+        title doesn't exist.
+        """
+        collection, now = self._collection(media_type), datetime.utcnow()
+        # Mongo keeps milliseconds, and the editor sends this value back as its next `expected`
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        doc = await collection.find_one_and_update({"tmdb_id": tmdb_id, "updated_on": expected},
+                                                   {"$set": {**fields, "updated_on": now}},
+                                                   projection={"seasons.season_number": 1})
+        if not doc:
+            current = await collection.find_one({"tmdb_id": tmdb_id}, {"updated_on": 1})
+            if not current:
+                return None
+            raise EditConflict(current.get("updated_on"))
+        # Shows not migrated to the normalized layout yet still hold their seasons
+        embedded = media_type == 'tv' and (not self.normalized or bool(doc.get("seasons")))
+        added = self._added_streams(media_type, ops)
+        await self._apply_link_health(media_type, tmdb_id, added)
+        # A known URL added elsewhere (an episode renumbered, say) is checked where it now is
+        relocated = [UpdateOne({"_id": stream["url"]}, {"$set": {"media_type": media_type, "tmdb_id": tmdb_id,
+                                                                 "season": season, "episode": episode}})
+                     for stream, season, episode in self._located_streams(media_type, added)]
+        if relocated:
+            await self.link_health_collection.bulk_write(relocated, ordered=False)
+        for op in ops:
+            await self._apply_patch_op(media_type, tmdb_id, op, embedded)
+        await self.materialize_media(media_type, tmdb_id)
+        return now
+
+    @staticmethod
+    def _added_streams(media_type: str, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # The streams that add_stream and add_episode ops bring, as a title in the embedded shape; the
+        # stream dicts are the ops' own, so link health put on them is written with the op
+        if media_type == 'movie':
+            return {"streams": [op["value"] for op in ops if op["op"] == "add_stream"]}
+        seasons = []
+        for op in ops:
+            if op["op"] == "add_stream":
+                episode = {"episode_number": op["episode"], "streams": [op["value"]]}
+            elif op["op"] == "add_episode":
+                episode = op["value"]
+            else:
+                continue
+            seasons.append({"season_number": op["season"], "episodes": [episode]})
+        return {"seasons": seasons}
+
+    def _stream_target(self, media_type: str, tmdb_id: int, season: Optional[int], episode: Optional[int],
+                       embedded: bool, match: Optional[Dict[str, Any]] = None) -> tuple:
+        # (collection, filter, path of the streams array, array filters) for the streams of a movie or
+        # episode; `match` adds conditions on that movie or episode
+        match = match or {}
+        if media_type == 'movie':
+            return self.movie_collection, {"tmdb_id": tmdb_id, **match}, "streams", []
+        if not embedded:
+            query = {"tmdb_id": tmdb_id, "season_number": season, "episode_number": episode, **match}
+            return self.episodes_collection, query, "streams", []
+        return (self.tv_collection,
+                {"tmdb_id": tmdb_id, "seasons": {"$elemMatch": {"season_number": season, "episodes": {
+                    "$elemMatch": {"episode_number": episode, **match}}}}},
+                "seasons.$[s].episodes.$[e].streams", [{"s.season_number": season}, {"e.episode_number": episode}])
+
+    async def _apply_patch_op(self, media_type: str, tmdb_id: int, op: Dict[str, Any], embedded: bool):
+        kind, season, episode, value = op["op"], op.get("season"), op.get("episode"), op.get("value")
+        if kind.endswith("_stream"):
+            match = {"streams.url": {"$ne": value["url"]}} if kind == "add_stream" else None
+            collection, query, path, array_filters = self._stream_target(media_type, tmdb_id, season, episode,
+                                                                         embedded, match)
+            if kind == "add_stream":
+                update = {"$push": {path: value}}
+            elif kind == "update_stream":
+                update = {"$set": {f"{path}.$[stream].{k}": v for k, v in value.items()}}
+                array_filters = array_filters + [{"stream.url": op["url"]}]
+            else:
+                update = {"$pull": {path: {"url": op["url"]}}}
+            await collection.update_one(query, update, array_filters=array_filters or None)
+        elif not embedded:
+            # Normalized layout: seasons only exist through their episodes
+            key = {"tmdb_id": tmdb_id, "season_number": season}
+            if kind == "remove_season":
+                await self.episodes_collection.delete_many(key)
+            elif kind == "add_episode":
+                key["episode_number"] = value["episode_number"]
+                await self.episodes_collection.update_one(
+                    key, {"$setOnInsert": {**{k: v for k, v in value.items() if k != "episode_number"},
+                                           "updated_on": datetime.utcnow()}}, upsert=True)
+            elif kind == "remove_episode":
+                await self.episodes_collection.delete_one({**key, "episode_number": episode})
+            elif kind == "set_episode":
+                await self.episodes_collection.update_one({**key, "episode_number": episode}, {"$set": value})
+        elif kind == "remove_season":
+            await self.tv_collection.update_one({"tmdb_id": tmdb_id},
+                                                {"$pull": {"seasons": {"season_number": season}}})
+        elif kind == "remove_episode":
+            await self.tv_collection.update_one({"tmdb_id": tmdb_id},
+                                                {"$pull": {"seasons.$[s].episodes": {"episode_number": episode}}},
+                                                array_filters=[{"s.season_number": season}])
+        elif kind == "set_episode":
+            await self.tv_collection.update_one(
+                {"tmdb_id": tmdb_id}, {"$set": {f"seasons.$[s].episodes.$[e].{k}": v for k, v in value.items()}},
+                array_filters=[{"s.season_number": season}, {"e.episode_number": episode}])
+        else:
+            # add_season, and add_episode into a season that may be new
+            await self.tv_collection.update_one(
+                {"tmdb_id": tmdb_id, "seasons.season_number": {"$ne": season}},
+                {"$push": {"seasons": {"season_number": season, "episodes": []}}})
+            if kind == "add_episode":
+                await self.tv_collection.update_one(
+                    {"tmdb_id": tmdb_id, "seasons": {"$elemMatch": {
+                        "season_number": season, "episodes.episode_number": {"$ne": value["episode_number"]}}}},
+                    {"$push": {"seasons.$[s].episodes": value}}, array_filters=[{"s.season_number": season}])
 
     async def delete_media(self, media_type: str, tmdb_id: int) -> bool:
-        collection = self.movie_collection if media_type == 'movie' else self.tv_collection
+        collection = self._collection(media_type)
         result = await collection.delete_one({"tmdb_id": tmdb_id})
+        if media_type == 'tv':
+            await self.episodes_collection.delete_many({"tmdb_id": tmdb_id})
+        await self.responses_collection.delete_many({"media_type": media_type, "tmdb_id": tmdb_id})
+        await self.link_health_collection.delete_many({"media_type": media_type, "tmdb_id": tmdb_id})
         return result.deleted_count > 0
 
+    async def migrate_to_episodes(self, batch_size: int = 500) -> Dict[str, int]:
+        """Moves embedded seasons of every show into the episodes collection. Safe to re-run."""
+        shows = episodes = 0
+        cursor = self.tv_collection.find({"seasons.0": {"$exists": True}}, {"tmdb_id": 1, "seasons": 1})
+        async for show in cursor:
+            while show and show.get("seasons"):
+                ops = []
+                for s in show["seasons"]:
+                    for e in s.get("episodes", []):
+                        key = {"tmdb_id": show['tmdb_id'], "season_number": s['season_number'],
+                               "episode_number": e['episode_number']}
+                        streams = e.get('streams', [])
+                        # Streams are replaced by URL, so copying a show again after a retry doesn't duplicate
+                        # the ones whose health changed in between
+                        ops += [UpdateOne(key, {"$pull": {"streams": {"url": {"$in": [x['url'] for x in streams]}}}}),
+                                UpdateOne(key, {
+                                    "$setOnInsert": {"title": e.get('title'),
+                                                     "episode_backdrop": e.get('episode_backdrop')},
+                                    "$push": {"streams": {"$each": streams}},
+                                    "$set": {"updated_on": datetime.utcnow()},
+                                }, upsert=True)]
+                for i in range(0, len(ops), batch_size):
+                    # Ordered: each episode's $pull runs before its $push
+                    await self.episodes_collection.bulk_write(ops[i:i + batch_size])
+                # Only drop the seasons that were copied; an ingest, edit or link check in between means the
+                # show is read and copied again
+                result = await self.tv_collection.update_one({"_id": show["_id"], "seasons": show["seasons"]},
+                                                             {"$unset": {"seasons": ""}})
+                if result.modified_count:
+                    shows, episodes = shows + 1, episodes + len(ops) // 2
+                    break
+                show = await self.tv_collection.find_one({"_id": show["_id"]}, {"tmdb_id": 1, "seasons": 1})
+        return {"shows": shows, "episodes": episodes}
+
+    # --- Metadata refresh ---
+    async def filter_stored_ids(self, media_type: str, tmdb_ids: List[int], batch_size: int = 1000) -> List[int]:
+        """The subset of `tmdb_ids` stored in the library, looked up in batches on the tmdb_id index."""
+        ids, stored = list(tmdb_ids), []
+        for i in range(0, len(ids), batch_size):
+            cursor = self._collection(media_type).find({"tmdb_id": {"$in": ids[i:i + batch_size]}}, {"tmdb_id": 1})
+            stored += [doc["tmdb_id"] async for doc in cursor]
+        return stored
+
+    async def get_title_outline(self, media_type: str, tmdb_id: int) -> Optional[Dict[str, Any]]:
+        """A title without its streams, in the embedded shape."""
+        return await self._load_title(media_type, tmdb_id, streams=False)
+
+    async def update_title_metadata(self, media_type: str, tmdb_id: int, fields: Dict[str, Any],
+                                    episodes: Dict[tuple, Dict[str, Any]]) -> bool:
+        """Writes refreshed TMDb metadata and rebuilds the title's Stremio responses.
+
+        `fields` are set on the title and `episodes` maps (season, episode) to the fields to set on
+        that episode. Streams and `updated_on` are left alone, so a refresh doesn't reorder catalogs.
+        Returns False if the title no longer exists.
+        """
+        now = datetime.utcnow()
+        show = await self._collection(media_type).find_one_and_update(
+            {"tmdb_id": tmdb_id}, {"$set": {**fields, "metadata_refreshed_at": now}},
+            projection={"seasons.season_number": 1})
+        if not show:
+            return False
+        # Shows not migrated to the normalized layout yet still hold their seasons
+        if episodes and self.normalized and not show.get("seasons"):
+            await self.episodes_collection.bulk_write([
+                UpdateOne({"tmdb_id": tmdb_id, "season_number": season, "episode_number": episode}, {"$set": changes})
+                for (season, episode), changes in episodes.items()], ordered=False)
+        elif episodes:
+            # One update for every changed episode: each gets its own pair of array filters
+            update, array_filters = {}, []
+            for i, ((season, episode), changes) in enumerate(episodes.items()):
+                update.update({f"seasons.$[s{i}].episodes.$[e{i}].{k}": v for k, v in changes.items()})
+                array_filters += [{f"s{i}.season_number": season}, {f"e{i}.episode_number": episode}]
+            await self.tv_collection.update_one({"tmdb_id": tmdb_id}, {"$set": update}, array_filters=array_filters)
+        await self.materialize_media(media_type, tmdb_id)
+        return True
+
+    # --- Export / import ---
+    async def iter_titles(self, media_type: str, batch_size: int = 500):
+        """Yields every title of `media_type` in the embedded shape, in tmdb_id order.
+
+        Normalized shows are joined with their episodes by walking both collections in tmdb_id order,
+        so memory stays bounded by one show whatever the library size.
+        """
+        cursor = self._collection(media_type).find({}, {"_id": 0, "catalog_json": 0}, batch_size=batch_size) \
+            .sort("tmdb_id", ASCENDING)
+        if media_type == 'movie' or not self.normalized:
+            async for doc in cursor:
+                yield doc
+            return
+
+        episodes = self.episodes_collection.find({}, batch_size=batch_size) \
+            .sort([("tmdb_id", ASCENDING), ("season_number", ASCENDING), ("episode_number", ASCENDING)])
+        pending = await anext(episodes, None)
+        async for doc in cursor:
+            own = []
+            while pending is not None and pending["tmdb_id"] <= doc["tmdb_id"]:
+                if pending["tmdb_id"] == doc["tmdb_id"]:
+                    own.append(pending)
+                pending = await anext(episodes, None)
+            if own and not doc.get("seasons"):
+                doc["seasons"] = self._group_seasons(own)
+            yield doc
+
+    async def import_titles(self, docs: List[Dict[str, Any]], dry_run: bool = False) -> Dict[str, int]:
+        """Upserts a batch of titles in the embedded shape on tmdb_id, replacing stored ones.
+
+        Their Stremio responses are rebuilt and their stream URLs tracked in the same batch. With
+        `dry_run` nothing is written and the counts say what would have happened.
+        """
+        counts = {"inserted": 0, "replaced": 0}
+        now = datetime.utcnow()
+        for media_type in ("movie", "tv"):
+            # The last copy of a title wins, as it would when importing one at a time
+            batch = list({d["tmdb_id"]: d for d in docs if d["media_type"] == media_type}.values())
+            if not batch:
+                continue
+            collection = self._collection(media_type)
+            ids = [d["tmdb_id"] for d in batch]
+            if dry_run:
+                existing = await collection.count_documents({"tmdb_id": {"$in": ids}})
+                counts["inserted"] += len(ids) - existing
+                counts["replaced"] += existing
+                continue
+
+            titles, episodes, responses, links = [], [], [], []
+            for doc in batch:
+                doc.pop("_id", None)
+                if not doc.get("updated_on"):
+                    doc["updated_on"] = now  # Catalog paging and editor saves key on it
+                responses += stremio.materialize(doc)
+                doc["catalog_json"] = stremio.dumps(stremio.build_catalog_entry(doc))
+                for stream, season, episode in self._located_streams(media_type, doc):
+                    if stream.get("url"):
+                        due = now + timedelta(seconds=random.uniform(0, settings.LINK_CHECK_INTERVAL))
+                        links.append(self._link_entry(stream["url"], media_type, doc["tmdb_id"], season, episode,
+                                                      stream.get("status", "unknown"), due))
+                if media_type == 'tv' and self.normalized:
+                    for s in doc.pop("seasons", None) or []:
+                        for e in s.get("episodes", []):
+                            key = {"tmdb_id": doc["tmdb_id"], "season_number": s["season_number"],
+                                   "episode_number": e["episode_number"]}
+                            episodes.append(ReplaceOne(key, {**e, **key, "updated_on": now}, upsert=True))
+                titles.append(ReplaceOne({"tmdb_id": doc["tmdb_id"]}, doc, upsert=True))
+
+            result = await collection.bulk_write(titles, ordered=False)
+            counts["inserted"] += result.upserted_count
+            counts["replaced"] += result.matched_count
+            if media_type == 'tv' and self.normalized:
+                await self.episodes_collection.delete_many({"tmdb_id": {"$in": ids}})
+                if episodes:
+                    await self.episodes_collection.bulk_write(episodes, ordered=False)
+            await self.responses_collection.delete_many(
+                {"media_type": media_type, "tmdb_id": {"$in": ids}, "_id": {"$nin": [r["_id"] for r in responses]}})
+            await self.responses_collection.bulk_write([ReplaceOne({"_id": r["_id"]}, r, upsert=True)
+                                                        for r in responses], ordered=False)
+            await self.track_links(links)
+        return counts
+
+    # --- Materialized Stremio responses ---
+    async def materialize_media(self, media_type: str, tmdb_id: int, episode: Optional[tuple] = None):
+        """Rebuilds the stored Stremio responses of a title after it was written.
+
+        Pass `episode` as (season, episode) to only refresh the meta and that episode's streams.
+        """
+        collection = self._collection(media_type)
+        item = await self._load_title(media_type, tmdb_id, streams=episode or True)
+        if not item:
+            await self.responses_collection.delete_many({"media_type": media_type, "tmdb_id": tmdb_id})
+            return []
+        docs = stremio.materialize(item, episode=episode)
+        await collection.update_one({"_id": item["_id"]},
+                                    {"$set": {"catalog_json": stremio.dumps(stremio.build_catalog_entry(item))}})
+        if episode is None:
+            # Drop responses of episodes/streams that no longer exist
+            await self.responses_collection.delete_many(
+                {"media_type": media_type, "tmdb_id": tmdb_id, "_id": {"$nin": [d["_id"] for d in docs]}}
+            )
+        await self.responses_collection.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs],
+                                                   ordered=False)
+        return docs
+
+    async def get_stremio_response(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self.responses_collection.find_one({"_id": key}, {"body": 1, "etag": 1})
+
+    async def has_stremio_response(self, key: str) -> bool:
+        return await self.responses_collection.find_one({"_id": key}, {"_id": 1}) is not None
+
+    async def get_meta_response(self, media_type: str, tmdb_id: int) -> Optional[Dict[str, Any]]:
+        doc = await self.get_stremio_response(stremio.meta_key(media_type, tmdb_id))
+        if doc:
+            return doc
+        # Not materialized yet (e.g. written before materialization existed): build it from a lean read
+        item = await self._load_title(media_type, tmdb_id, streams=False)
+        if not item:
+            return None
+        self._materialize_later(media_type, tmdb_id)
+        return stremio.materialize_meta(item)
+
+    async def get_stream_response(self, media_type: str, tmdb_id: int, season: Optional[int] = None,
+                                  episode: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        doc = await self.get_stremio_response(stremio.stream_key(media_type, tmdb_id, season, episode))
+        if doc or await self.has_stremio_response(stremio.meta_key(media_type, tmdb_id)):
+            # Materialized titles have a stored response for every existing movie/episode
+            return doc
+        streams = await self.get_stream_source(media_type, tmdb_id, season, episode)
+        if streams is None:
+            return None
+        self._materialize_later(media_type, tmdb_id)
+        return stremio.materialize_streams(media_type, tmdb_id, streams, season, episode)
+
+    def _materialize_later(self, media_type: str, tmdb_id: int):
+        key = (media_type, tmdb_id)
+        if key in self._pending_materializations:
+            return
+        self._pending_materializations.add(key)
+
+        def done(task: asyncio.Task):
+            self._pending_materializations.discard(key)
+            if not task.cancelled() and task.exception():
+                LOGGER.error(f"Could not materialize {media_type} {tmdb_id}: {task.exception()}")
+        asyncio.create_task(self.materialize_media(media_type, tmdb_id)).add_done_callback(done)
+
+    async def get_id_mapping(self, imdb_id: str, media_type: str) -> Optional[Dict[str, Any]]:
+        # Expired entries are ignored here; they are overwritten on the next lookup
+        return await self.id_map_collection.find_one(
+            {"_id": f"{media_type}:{imdb_id}", "expires_at": {"$gt": datetime.utcnow()}}
+        )
+
+    async def set_id_mapping(self, imdb_id: str, media_type: str, tmdb_id: Optional[int], ttl: int):
+        now = datetime.utcnow()
+        await self.id_map_collection.update_one(
+            {"_id": f"{media_type}:{imdb_id}"},
+            {"$set": {"imdb_id": imdb_id, "media_type": media_type, "tmdb_id": tmdb_id,
+                      "updated_on": now, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    # --- Stream link health ---
+    @staticmethod
+    def _link_entry(url: str, media_type: str, tmdb_id: int, season: Optional[int] = None,
+                    episode: Optional[int] = None, status: str = "unknown", next_check_at: Optional[datetime] = None,
+                    resolution: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # One entry per URL; a URL stored on several titles is tracked (and updated) on the first one found
+        return {"_id": url, "media_type": media_type, "tmdb_id": tmdb_id, "season": season, "episode": episode,
+                "status": status, "failures": 0, "next_check_at": next_check_at or datetime.utcnow(),
+                **(resolution or {})}
+
+    async def track_links(self, entries: List[Dict[str, Any]]) -> int:
+        """Registers stream URLs with the link checker; URLs it already tracks keep their state."""
+        if not entries:
+            return 0
+        ops = [UpdateOne({"_id": e["_id"]}, {"$setOnInsert": {k: v for k, v in e.items() if k != "_id"}},
+                         upsert=True) for e in entries]
+        result = await self.link_health_collection.bulk_write(ops, ordered=False)
+        return result.upserted_count
+
+    async def sync_link_health(self, spread: float, batch_size: int = 1000) -> int:
+        """Tracks every stored stream URL the link checker doesn't know yet and returns how many were added.
+
+        New entries get their first check at a random time within `spread` seconds, so a backfill of a
+        large library is checked gradually instead of all at once.
+        """
+        now, entries, added = datetime.utcnow(), [], 0
+
+        def track(url: Optional[str], *location):
+            if url:
+                due = now + timedelta(seconds=random.uniform(0, spread))
+                entries.append(self._link_entry(url, *location, next_check_at=due))
+
+        async def flush(force: bool = False):
+            nonlocal added
+            if entries and (force or len(entries) >= batch_size):
+                added += await self.track_links(entries)
+                entries.clear()
+
+        async for doc in self.movie_collection.find({"streams.url": {"$exists": True}},
+                                                    {"tmdb_id": 1, "streams.url": 1}):
+            for stream in doc["streams"]:
+                track(stream.get("url"), "movie", doc["tmdb_id"])
+            await flush()
+        async for doc in self.tv_collection.find(
+                {"seasons.episodes.streams.url": {"$exists": True}},
+                {"tmdb_id": 1, "seasons.season_number": 1, "seasons.episodes.episode_number": 1,
+                 "seasons.episodes.streams.url": 1}):
+            for s in doc["seasons"]:
+                for e in s.get("episodes", []):
+                    for stream in e.get("streams", []):
+                        track(stream.get("url"), "tv", doc["tmdb_id"], s["season_number"], e["episode_number"])
+            await flush()
+        async for doc in self.episodes_collection.find(
+                {"streams.url": {"$exists": True}},
+                {"tmdb_id": 1, "season_number": 1, "episode_number": 1, "streams.url": 1}):
+            for stream in doc["streams"]:
+                track(stream.get("url"), "tv", doc["tmdb_id"], doc["season_number"], doc["episode_number"])
+            await flush()
+        await flush(force=True)
+        return added
+
+    @staticmethod
+    def _located_streams(media_type: str, doc: Dict[str, Any]) -> List[tuple]:
+        """(stream, season, episode) for every stream of a title in the embedded shape."""
+        if media_type == 'movie':
+            return [(stream, None, None) for stream in doc.get("streams") or []]
+        return [(stream, s.get("season_number"), e.get("episode_number"))
+                for s in doc.get("seasons") or [] for e in s.get("episodes", [])
+                for stream in e.get("streams", [])]
+
+    async def _apply_link_health(self, media_type: str, tmdb_id: int, data: Dict[str, Any]):
+        # The editor only sends quality/name/url/size per stream: put the recorded health back on each
+        # stream and track the URLs that were just added
+        located = self._located_streams(media_type, data)
+        urls = [stream["url"] for stream, _, _ in located if stream.get("url")]
+        if not urls:
+            return
+        carried = ("status", "size_bytes", "checked_at", "resolved_url", "resolved_until")
+        known = {doc["_id"]: doc async for doc in self.link_health_collection.find(
+            {"_id": {"$in": urls}}, {k: 1 for k in carried})}
+        new = []
+        for stream, season, episode in located:
+            health = known.get(stream.get("url"))
+            if health:
+                stream.update({k: health[k] for k in carried if health.get(k) is not None})
+            elif stream.get("url"):
+                new.append(self._link_entry(stream["url"], media_type, tmdb_id, season, episode))
+        await self.track_links(new)
+
+    async def claim_due_links(self, limit: int, lease: float) -> List[Dict[str, Any]]:
+        """Takes up to `limit` links due for a check, most overdue first.
+
+        Their next check is pushed `lease` seconds out so other workers skip them meanwhile; recording
+        the result sets the real next check.
+        """
+        now = datetime.utcnow()
+        links = await self.link_health_collection.find({"next_check_at": {"$lte": now}}) \
+            .sort("next_check_at", ASCENDING).limit(limit).to_list(length=limit)
+        if links:
+            await self.link_health_collection.update_many(
+                {"_id": {"$in": [link["_id"] for link in links]}},
+                {"$set": {"next_check_at": now + timedelta(seconds=lease)}}
+            )
+        return links
+
+    async def record_link_check(self, link: Dict[str, Any], check: Dict[str, Any], next_check_at: datetime) -> bool:
+        """Stores the outcome of a check on the link and on the stream itself.
+
+        The title's Stremio response is rebuilt only when the stream's status, size or playback URL
+        changed. Returns False, and stops tracking the link, when the stream no longer exists.
+        """
+        fields = {k: check[k] for k in ("status", "checked_at", "size_bytes", "size", "resolved_url", "resolved_until")
+                  if k in check}
+        if not await self._set_stream_fields(link, fields):
+            await self.link_health_collection.delete_one({"_id": link["_id"]})
+            return False
+        await self.link_health_collection.update_one({"_id": link["_id"]},
+                                                     {"$set": {**check, "next_check_at": next_check_at}})
+        resized = check.get("size_bytes") and check["size_bytes"] != link.get("size_bytes")
+        url = link["_id"]
+        moved = stremio.playback_url({**link, "url": url}) != stremio.playback_url({**link, **check, "url": url})
+        if check["status"] != link.get("status") or resized or moved:
+            episode = (link["season"], link["episode"]) if link["media_type"] == "tv" else None
+            await self.materialize_media(link["media_type"], link["tmdb_id"], episode=episode)
+        return True
+
+    async def _set_stream_fields(self, link: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+        # Targets the one stream with arrayFilters; False when its title/episode no longer has that URL
+        url, tmdb_id = link["_id"], link["tmdb_id"]
+        if link["media_type"] == "movie":
+            result = await self.movie_collection.update_one(
+                {"tmdb_id": tmdb_id, "streams.url": url},
+                {"$set": {f"streams.$[stream].{k}": v for k, v in fields.items()}},
+                array_filters=[{"stream.url": url}]
+            )
+            return result.matched_count > 0
+        season, episode = link["season"], link["episode"]
+        found = False
+        if self.normalized:
+            result = await self.episodes_collection.update_one(
+                {"tmdb_id": tmdb_id, "season_number": season, "episode_number": episode, "streams.url": url},
+                {"$set": {f"streams.$[stream].{k}": v for k, v in fields.items()}},
+                array_filters=[{"stream.url": url}]
+            )
+            found = result.matched_count > 0
+        # Embedded layout, or a show not (fully) migrated yet: while migrate_to_episodes copies a show both
+        # hold the stream, and the embedded one is what the copy is checked against
+        result = await self.tv_collection.update_one(
+            {"tmdb_id": tmdb_id, "seasons": {"$elemMatch": {"season_number": season, "episodes": {
+                "$elemMatch": {"episode_number": episode, "streams.url": url}}}}},
+            {"$set": {f"seasons.$[s].episodes.$[e].streams.$[stream].{k}": v for k, v in fields.items()}},
+            array_filters=[{"s.season_number": season}, {"e.episode_number": episode}, {"stream.url": url}]
+        )
+        return found or result.matched_count > 0
+
+    async def get_link_resolution(self, url: str) -> Optional[Dict[str, Any]]:
+        return await self.link_health_collection.find_one({"_id": url}, {"resolved_url": 1, "resolved_until": 1})
+
+    async def save_link_resolution(self, url: str, resolution: Dict[str, Any]):
+        # Only for tracked links; the stream itself is updated by the next health check
+        await self.link_health_collection.update_one({"_id": url}, {"$set": resolution})
+
+    async def get_link_health_stats(self) -> Dict[str, Any]:
+        counts = {"live": 0, "dead": 0, "unknown": 0}
+        async for row in self.link_health_collection.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["n"]
+        due = await self.link_health_collection.count_documents({"next_check_at": {"$lte": datetime.utcnow()}})
+        return {"counts": counts, "due": due}
+
+    # --- Leases (one process runs each background service) ---
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Takes or renews the named lease for `owner`; False while another owner holds an unexpired one."""
+        now = datetime.utcnow()
+        try:
+            await self.leases_collection.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Held by someone else, so the filter didn't match and the upsert collided
+            return False
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        await self.leases_collection.delete_one({"_id": name, "owner": owner})
+
+    # --- Checkpoints of background services ---
+    async def get_checkpoint(self, name: str) -> Optional[datetime]:
+        doc = await self.checkpoints_collection.find_one({"_id": name}, {"value": 1})
+        return doc["value"] if doc else None
+
+    async def set_checkpoint(self, name: str, value: datetime):
+        await self.checkpoints_collection.update_one({"_id": name}, {"$set": {"value": value}}, upsert=True)
+
+    # --- Shared cache (CACHE_BACKEND=mongo) ---
+    async def cache_get(self, key: str) -> Optional[bytes]:
+        # Expired entries are ignored here; the TTL index removes them eventually
+        doc = await self.kv_collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}}, {"value": 1})
+        return doc["value"] if doc else None
+
+    async def cache_set(self, key: str, value: bytes, ttl: float):
+        await self.kv_collection.update_one(
+            {"_id": key}, {"$set": {"value": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    # --- Ingest jobs ---
+    async def enqueue_jobs(self, batch_id: str, urls: List[str]) -> int:
+        now = datetime.utcnow()
+        jobs = [{"batch_id": batch_id, "url": url, "status": "queued", "attempts": 0, "result": None,
+                 "run_after": now, "created_at": now, "updated_on": now} for url in urls]
+        if jobs:
+            await self.jobs_collection.insert_many(jobs, ordered=False)
+        return len(jobs)
+
+    async def claim_job(self) -> Optional[Dict[str, Any]]:
+        """Atomically takes the oldest runnable queued job and marks it running."""
+        now = datetime.utcnow()
+        return await self.jobs_collection.find_one_and_update(
+            {"status": "queued", "run_after": {"$lte": now}},
+            {"$set": {"status": "running", "started_at": now, "updated_on": now}, "$inc": {"attempts": 1}},
+            sort=[("run_after", ASCENDING), ("_id", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def finish_job(self, job_id: ObjectId, status: str, result: Optional[Dict[str, Any]],
+                         retry_in: Optional[float] = None):
+        """Records a job's outcome; `status` "queued" with `retry_in` seconds schedules another attempt."""
+        now = datetime.utcnow()
+        update = {"status": status, "result": result, "updated_on": now}
+        if status == "queued":
+            update["run_after"] = now + timedelta(seconds=retry_in or 0)
+        else:
+            update["finished_at"] = now
+        await self.jobs_collection.update_one({"_id": job_id}, {"$set": update})
+
+    async def release_job(self, job_id: ObjectId):
+        # Interrupted (e.g. shutdown) before it finished: put it back without spending an attempt
+        await self.jobs_collection.update_one(
+            {"_id": job_id, "status": "running"},
+            {"$set": {"status": "queued", "updated_on": datetime.utcnow()}, "$inc": {"attempts": -1}}
+        )
+
+    async def requeue_running_jobs(self) -> int:
+        """Puts jobs left running by a previous process back in the queue."""
+        result = await self.jobs_collection.update_many(
+            {"status": "running"}, {"$set": {"status": "queued", "updated_on": datetime.utcnow()}}
+        )
+        return result.modified_count
+
+    async def get_job_batch(self, batch_id: str, since: Optional[datetime] = None,
+                            after: Optional[str] = None) -> Dict[str, Any]:
+        """Status counts of a batch and its jobs, only those updated at or after `since` if given.
+
+        With `after`, the `id` of the last job seen (the one updated at `since`), only jobs strictly
+        after it in (updated_on, id) order are listed, so nothing already seen comes back.
+        """
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        async for row in self.jobs_collection.aggregate([{"$match": {"batch_id": batch_id}},
+                                                          {"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["n"]
+        query = {"batch_id": batch_id}
+        if since and after:
+            query["$or"] = [{"updated_on": {"$gt": since}}, {"updated_on": since, "_id": {"$gt": ObjectId(after)}}]
+        elif since:
+            query["updated_on"] = {"$gte": since}
+        jobs = await self.jobs_collection.find(
+            query, {"url": 1, "status": 1, "attempts": 1, "result": 1, "updated_on": 1}
+        ).sort([("updated_on", ASCENDING), ("_id", ASCENDING)]).to_list(length=None)
+        total = sum(counts.values())
+        return {"batch_id": batch_id, "total": total, "counts": counts,
+                "finished": total > 0 and counts["queued"] + counts["running"] == 0,
+                "jobs": [sanitize_document({"id": job.pop("_id"), **job}) for job in jobs]}
+
 db = Database(settings.MONGO_URI, settings.DB_NAME)
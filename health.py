@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from config import settings
+from database import db
+from http_client import ProbeResult, http
+from ingest import format_size
+from metrics import LINK_CHECK_LATENCY, LINK_CHECKS
+from ratelimit import TokenBucket
+from resolver import resolution_from_probe
+
+LOGGER = logging.getLogger(__name__)
+
+# Answers that mean the file is gone for good, not just temporarily unreachable
+DEAD_STATUS_CODES = {404, 410}
+# Links claimed per round, and how long a claim keeps other workers away (seconds)
+BATCH_SIZE = 200
+CLAIM_LEASE = 600
+# Pause when nothing is due (seconds)
+IDLE_SLEEP = 60
+
+
+class _HostGate:
+    """Politeness towards one file host: a few concurrent checks, spaced at least `interval` seconds apart."""
+
+    def __init__(self, concurrency: int, interval: float):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.pace = TokenBucket(rate=1 / interval, burst=1) if interval > 0 else None
+
+    async def __aenter__(self):
+        await self.slots.acquire()
+        if self.pace:
+            await self.pace.acquire()
+
+    async def __aexit__(self, *exc):
+        self.slots.release()
+
+
+class LinkChecker:
+    """Background revalidation of stored stream URLs.
+
+    Every URL is tracked in the `link_health` collection with the time of its next check. A single
+    loop claims due links in batches and probes them with bounded concurrency, per-host limits and a
+    minimum gap between checks of one host, so it stays in the background next to request handling
+    no matter how large the library is. Each result is written onto the stream (status, size,
+    checked_at); Stremio responses only change when a stream's status or size does.
+    """
+
+    def __init__(self, interval: int = settings.LINK_CHECK_INTERVAL,
+                 retry_delay: int = settings.LINK_CHECK_RETRY_DELAY,
+                 concurrency: int = settings.LINK_CHECK_CONCURRENCY,
+                 per_host: int = settings.LINK_CHECK_PER_HOST,
+                 host_interval: float = settings.LINK_CHECK_HOST_INTERVAL,
+                 dead_after: int = settings.LINK_CHECK_DEAD_AFTER,
+                 sync_interval: int = settings.LINK_CHECK_SYNC_INTERVAL):
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.per_host = per_host
+        self.host_interval = host_interval
+        self.dead_after = dead_after
+        self.sync_interval = sync_interval
+        self._slots = asyncio.Semaphore(concurrency)
+        self._hosts: Dict[str, _HostGate] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"checked": 0, "live": 0, "dead": 0, "failing": 0, "removed": 0}
+
+    def stats(self) -> dict:
+        return {**self.counters, "running": self._task is not None and not self._task.done(),
+                "hosts": len(self._hosts)}
+
+    async def start(self):
+        if settings.LINK_CHECK_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        next_sync = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_sync:
+                    # Pick up streams stored before link checks existed or added outside insert_media
+                    added = await db.sync_link_health(spread=self.interval)
+                    if added:
+                        LOGGER.info(f"Tracking {added} more stream links for health checks")
+                    next_sync = time.monotonic() + self.sync_interval
+                links = await db.claim_due_links(BATCH_SIZE, CLAIM_LEASE)
+                if links:
+                    await self.check_many(links)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f"Link checker error: {e}", exc_info=True)
+            await asyncio.sleep(IDLE_SLEEP)
+
+    async def check_many(self, links: List[dict]):
+        await asyncio.gather(*(self.check(link) for link in links))
+
+    def _host(self, url: str) -> _HostGate:
+        host = urlparse(url).netloc.lower()
+        if host not in self._hosts:
+            self._hosts[host] = _HostGate(self.per_host, self.host_interval)
+        return self._hosts[host]
+
+    async def check(self, link: dict):
+        """Probes one tracked link and records the outcome; never raises (except cancellation)."""
+        url = link["_id"]
+        status_code, result = None, None
+        try:
+            # The host gate first: checks waiting on a slow or paced host mustn't hold global slots
+            async with self._host(url), self._slots:
+                with LINK_CHECK_LATENCY.time():
+                    result = await http.probe(url)
+            status_code = result.status_code
+        except httpx.HTTPStatusError as e:
+            status_code = e.response.status_code
+        except httpx.RequestError:
+            pass  # Timeout or connection failure: counts as a failed check
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.warning(f"Unexpected error checking {url}: {e}")
+
+        check, next_check_at = self._assess(link, status_code, result)
+        outcome = check["status"] if check["status"] == "dead" or not check["failures"] else "failing"
+        LINK_CHECKS.inc(result=outcome)
+        try:
+            if not await db.record_link_check(link, check, next_check_at):
+                self.counters["removed"] += 1
+                return
+        except Exception as e:
+            LOGGER.error(f"Could not record link check of {url}: {e}")
+            return
+        self.counters["checked"] += 1
+        self.counters[outcome] += 1
+
+    def _assess(self, link: dict, status_code: Optional[int], result: Optional[ProbeResult]) -> tuple:
+        """Turns a probe outcome into the link's new state and the time of its next check."""
+        now = datetime.utcnow()
+        check = {"status_code": status_code, "checked_at": now}
+        if result is not None and status_code < 400:
+            check.update(status="live", failures=0, **resolution_from_probe(result))
+            if result.size_bytes > 0:
+                check.update(size_bytes=result.size_bytes, size=format_size(result.size_bytes))
+            delay = self.interval
+        else:
+            failures = link.get("failures", 0) + 1
+            dead = status_code in DEAD_STATUS_CODES or failures >= self.dead_after
+            # A transient failure keeps the previous status until the link fails often enough to count as dead
+            check.update(status="dead" if dead else link.get("status", "unknown"), failures=failures)
+            delay = self.interval if dead else min(self.retry_delay * failures, self.interval)
+        # Jitter keeps links imported together from coming due together forever
+        return check, now + timedelta(seconds=delay * random.uniform(0.9, 1.1))
+
+
+checker = LinkChecker()
@@ -0,0 +1,130 @@
+import asyncio
+import importlib.util
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from config import settings
+
+LOGGER = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+RETRY_STATUSES = {429, 502, 503, 504}
+# Statuses some file hosts send for HEAD although a GET would work
+HEAD_REJECTED_STATUSES = {400, 403, 405, 501}
+
+
+@dataclass
+class ProbeResult:
+    url: str
+    final_url: str
+    status_code: int
+    size_bytes: int = 0
+    headers: Dict[str, str] = field(default_factory=dict)
+    redirects: int = 0
+    # (status code, headers) of every redirect followed, in order
+    history: List[Tuple[int, Dict[str, str]]] = field(default_factory=list)
+
+
+class HTTPPool:
+    """App-lifetime pooled HTTP client for talking to file hosts.
+
+    Connections (and TLS sessions) are reused across requests, each host gets a bounded number
+    of concurrent requests, and transient failures are retried with exponential backoff.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=settings.HTTP2 and HTTP2_AVAILABLE,
+                follow_redirects=True,
+                timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=settings.HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("HTTP pool is not started")
+        return self._client
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc.lower()
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(settings.HTTP_MAX_PER_HOST)
+        return self._host_slots[host]
+
+    async def request(self, method: str, url: str, *, stream: bool = False, **kwargs) -> httpx.Response:
+        """Sends a request, retrying connection errors and 429/502/503/504 responses with backoff.
+
+        With `stream=True` the body is not read and the caller must `aclose()` the response.
+        """
+        await self.start()
+        for attempt in range(settings.HTTP_RETRIES + 1):
+            last_attempt = attempt == settings.HTTP_RETRIES
+            try:
+                async with self._host_slot(url):
+                    request = self.client.build_request(method, url, **kwargs)
+                    response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError):
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+            await response.aclose()
+            await asyncio.sleep(self._backoff(attempt, response.headers.get("retry-after")))
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), settings.HTTP_MAX_BACKOFF)
+        delay = settings.HTTP_RETRY_BACKOFF * (2 ** attempt)
+        return min(delay + random.uniform(0, delay / 2), settings.HTTP_MAX_BACKOFF)
+
+    async def probe(self, url: str) -> ProbeResult:
+        """Finds out whether a link is reachable and how large it is, without downloading it.
+
+        Tries HEAD first and falls back to a one-byte ranged GET when the host rejects HEAD or
+        doesn't report a content-length. Raises httpx.HTTPStatusError for error responses.
+        """
+        response = await self.request("HEAD", url)
+        size = int(response.headers.get("content-length") or 0)
+        if response.status_code in HEAD_REJECTED_STATUSES or (response.is_success and size <= 0):
+            response = await self.request("GET", url, headers={"Range": "bytes=0-0"}, stream=True)
+            await response.aclose()
+            size = self._size_from_ranged_response(response)
+        response.raise_for_status()
+        return ProbeResult(url=url, final_url=str(response.url), status_code=response.status_code,
+                           size_bytes=size, headers=dict(response.headers), redirects=len(response.history),
+                           history=[(r.status_code, dict(r.headers)) for r in response.history])
+
+    @staticmethod
+    def _size_from_ranged_response(response: httpx.Response) -> int:
+        # "Content-Range: bytes 0-0/1234567" carries the full size; a 200 means the host ignored the range
+        content_range = response.headers.get("content-range", "")
+        total = content_range.rpartition("/")[2]
+        if response.status_code == 206 and total.isdigit():
+            return int(total)
+        return int(response.headers.get("content-length") or 0)
+
+
+http = HTTPPool()
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import aiofiles
+
+from config import settings
+from http_client import http
+from stremio import TMDB_IMAGE_BASE
+
+LOGGER = logging.getLogger(__name__)
+
+# Resizing and WebP transcoding use Pillow (a dependency of the app); an install without it caches images as TMDb
+# sends them, and says so in the logs
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+# What Stremio renders each kind of image at: the TMDb rendition fetched and the width it is resized to
+VARIANTS = {
+    "poster": ("w342", 342),
+    "backdrop": ("w1280", 1280),
+    "logo": ("w500", 500),
+    "still": ("w300", 300),
+}
+FILENAME = re.compile(r"^[A-Za-z0-9_-]+\.(jpe?g|png|svg|webp)$")
+MEDIA_TYPES = {".webp": "image/webp", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+               ".svg": "image/svg+xml"}
+# Larger upstream answers aren't images we want to cache
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Temp files older than this (seconds) were left by a process that died mid-write; younger ones may be another
+# worker's download in progress
+STALE_TMP_AGE = 600
+
+
+class ImageNotFound(Exception):
+    """TMDb has no such image."""
+
+
+def _transcode(data: bytes, width: int, quality: int) -> bytes:
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((width, width * 4))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+        out = io.BytesIO()
+        image.save(out, "WEBP", quality=quality, method=4)
+        return out.getvalue()
+
+
+class ImageCache:
+    """Content-addressed disk cache of resized TMDb images with least-recently-used eviction.
+
+    A file is named after a hash of the TMDb image and variant it was made from. TMDb never changes
+    the image behind a path, so cached files are never stale and can be served as immutable. When
+    the files outgrow `max_bytes`, the least recently served ones are deleted. Processes sharing
+    the directory pick up each other's files, and concurrent misses for one image share a single
+    download.
+    """
+
+    def __init__(self, directory: str = settings.IMAGE_CACHE_DIR, max_bytes: int = settings.IMAGE_CACHE_MAX_BYTES,
+                 quality: int = settings.IMAGE_WEBP_QUALITY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # file path -> size, least recently used first
+        self._total = 0
+        self._loaded = False
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+
+    def stats(self) -> dict:
+        return {**self.counters, "files": len(self._index), "bytes": self._total, "max_bytes": self.max_bytes,
+                "webp": PILLOW_AVAILABLE}
+
+    def _load(self):
+        # Rebuild the LRU order from modification times, which every hit refreshes
+        if not PILLOW_AVAILABLE:
+            LOGGER.warning("Pillow is not installed: the image proxy caches TMDb images without resizing them "
+                           "or converting them to WebP (pip install Pillow)")
+        files, stale = [], time.time() - STALE_TMP_AGE
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(".tmp"):
+                        if stat.st_mtime < stale:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue  # Renamed or evicted by another process meanwhile
+                files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._index[path] = size
+            self._total += size
+        self._loaded = True
+
+    def _path(self, variant: str, filename: str) -> str:
+        key = hashlib.sha256(f"{variant}:{filename}".encode()).hexdigest()
+        suffix = ".webp" if PILLOW_AVAILABLE and not filename.endswith(".svg") else os.path.splitext(filename)[1]
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    async def get(self, variant: str, filename: str) -> Tuple[str, str]:
+        """Returns (file path, media type) of the cached rendition, downloading and resizing it on a miss."""
+        if not self._loaded:
+            await asyncio.to_thread(self._load)
+        path = self._path(variant, filename)
+        media_type = MEDIA_TYPES[os.path.splitext(path)[1]]
+        if path in self._index or os.path.exists(path):
+            self._touch(path)
+            self.counters["hits"] += 1
+            return path, media_type
+        if path not in self._inflight:
+            future = asyncio.ensure_future(self._fetch(variant, filename, path))
+            self._inflight[path] = future
+            future.add_done_callback(lambda _: self._inflight.pop(path, None))
+        await asyncio.shield(self._inflight[path])
+        return path, media_type
+
+    def _touch(self, path: str):
+        if path not in self._index:
+            # Written by another process sharing the directory
+            self._add(path, os.path.getsize(path))
+            return
+        self._index.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._total -= self._index.pop(path)
+
+    async def _fetch(self, variant: str, filename: str, path: str):
+        self.counters["misses"] += 1
+        size, width = VARIANTS[variant]
+        response = await http.request("GET", f"{TMDB_IMAGE_BASE}{size}/{filename}", stream=True)
+        try:
+            if response.status_code == 404:
+                raise ImageNotFound(filename)
+            response.raise_for_status()
+            # Bounded before and while reading, so an oversized answer is never held in memory
+            declared = response.headers.get("content-length", "")
+            if declared.isdigit() and int(declared) > MAX_SOURCE_BYTES:
+                raise ValueError(f"{filename} is {declared} bytes")
+            chunks, received = [], 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received > MAX_SOURCE_BYTES:
+                    raise ValueError(f"{filename} is over {MAX_SOURCE_BYTES} bytes")
+                chunks.append(chunk)
+            data = b"".join(chunks)
+        finally:
+            await response.aclose()
+        if path.endswith(".webp") and not filename.endswith(".webp"):
+            data = await asyncio.to_thread(_transcode, data, width, self.quality)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        async with aiofiles.open(tmp, "wb") as f:
+            await f.write(data)
+        os.replace(tmp, path)
+        self._add(path, len(data))
+
+    def _add(self, path: str, size: int):
+        self._total += size - self._index.pop(path, 0)
+        self._index[path] = size
+        while self._total > self.max_bytes and len(self._index) > 1:
+            oldest, oldest_size = self._index.popitem(last=False)
+            self._total -= oldest_size
+            self.counters["evictions"] += 1
+            try:
+                os.remove(oldest)
+            except FileNotFoundError:
+                pass
+
+
+image_cache = ImageCache()
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Iterable
+from urllib.parse import urlparse, unquote
+
+import httpx
+
+from config import settings
+from database import db
+from http_client import http
+from metadata import get_metadata
+from metrics import INGEST_STAGE_LATENCY
+from ratelimit import RateLimitExceeded
+from resolver import resolution_from_probe
+
+LOGGER = logging.getLogger(__name__)
+
+
+def filename_from_url(url: str) -> str:
+    return os.path.basename(unquote(urlparse(url).path))
+
+
+def format_size(size_bytes: int) -> str:
+    return f"{round(size_bytes / (1024 ** 3), 2)} GB" if size_bytes > 0 else "N/A"
+
+
+async def probe_link(url: str) -> str:
+    """Probes a DDL and returns its human readable size. Raises httpx errors for dead links."""
+    result = await http.probe(url)
+    return format_size(result.size_bytes)
+
+
+class IngestPipeline:
+    """Adds DDLs to the library with bounded concurrency per stage (HEAD probes, TMDb lookups, DB writes).
+
+    One pipeline shares a metadata memo across all of its links, so a show or movie is only
+    resolved on TMDb once no matter how many of its files are imported together.
+    """
+
+    def __init__(self, probe_concurrency: int = settings.INGEST_PROBE_CONCURRENCY,
+                 metadata_concurrency: int = settings.INGEST_METADATA_CONCURRENCY,
+                 write_concurrency: int = settings.INGEST_WRITE_CONCURRENCY):
+        self._probe_slots = asyncio.Semaphore(probe_concurrency)
+        self._metadata_slots = asyncio.Semaphore(metadata_concurrency)
+        self._write_slots = asyncio.Semaphore(write_concurrency)
+        self._memo = {}
+
+    async def ingest(self, url: str) -> dict:
+        """Runs one link through the pipeline and returns {"url", "ok", "message", "status_code"}."""
+        filename = filename_from_url(url)
+        try:
+            async with self._probe_slots:
+                with INGEST_STAGE_LATENCY.time(stage="probe"):
+                    probe = await http.probe(url)
+            async with self._metadata_slots:
+                with INGEST_STAGE_LATENCY.time(stage="metadata"):
+                    metadata_info = await get_metadata(filename, url, memo=self._memo)
+            if not metadata_info:
+                return self._result(url, False, 400, f"Failed to get metadata for '{filename}'. "
+                                                     f"Check filename format or TMDb availability.")
+            async with self._write_slots:
+                with INGEST_STAGE_LATENCY.time(stage="write"):
+                    await db.insert_media(metadata_info, size=format_size(probe.size_bytes), name=filename,
+                                          resolution=resolution_from_probe(probe))
+            result = self._result(url, True, 200, f"Successfully added '{metadata_info['title']}'")
+            result["timings"] = metadata_info.get("timings", {})
+            return result
+        except RateLimitExceeded:
+            return self._result(url, False, 503, "TMDb is rate limiting requests. Please retry this link shortly.")
+        except httpx.HTTPStatusError as e:
+            return self._result(url, False, 400, f"URL returned an error: {e.response.status_code} Not Found")
+        except httpx.RequestError:
+            return self._result(url, False, 400, "Could not connect to the URL. Check the link or network.")
+        except Exception as e:
+            LOGGER.error(f"Error processing DDL {url}: {e}", exc_info=True)
+            return self._result(url, False, 500, "An unexpected server error occurred. Check logs for details.")
+
+    async def run(self, urls: Iterable[str]) -> AsyncIterator[dict]:
+        """Ingests all links concurrently and yields each result as soon as it completes."""
+        unique_urls = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+        tasks = [asyncio.create_task(self.ingest(url)) for url in unique_urls]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _result(url: str, ok: bool, status_code: int, message: str) -> dict:
+        return {"url": url, "ok": ok, "status_code": status_code, "message": message}
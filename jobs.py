@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import uuid
+from typing import Iterable, List, Optional
+
+from cache import TTLCache, MISSING
+from config import settings
+from database import db
+from ingest import IngestPipeline
+
+LOGGER = logging.getLogger(__name__)
+
+# Ingest results worth another attempt: TMDb rate limiting (503) and unexpected errors (500)
+RETRY_STATUS_CODES = {500, 503}
+
+
+class JobQueue:
+    """Durable background ingestion.
+
+    Links are stored as jobs in Mongo (queued -> running -> done/failed) and processed by a pool
+    of asyncio workers, so imports don't depend on the request that submitted them and survive
+    restarts. Jobs of one batch share an `IngestPipeline`, and with it the TMDb lookups.
+    """
+
+    def __init__(self, workers: int = settings.JOB_WORKERS, max_attempts: int = settings.JOB_MAX_ATTEMPTS,
+                 retry_delay: float = settings.JOB_RETRY_DELAY, poll_interval: float = settings.JOB_POLL_INTERVAL):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._pipelines = TTLCache(maxsize=64, ttl=3600)
+
+    async def start(self):
+        # Only the holder of the ingest-jobs lease runs the queue, so jobs still marked running were
+        # left behind by a previous holder
+        requeued = await db.requeue_running_jobs()
+        if requeued:
+            LOGGER.info(f"Resuming {requeued} interrupted ingest jobs")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, urls: Iterable[str]) -> dict:
+        batch_id = uuid.uuid4().hex
+        unique_urls = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+        queued = await db.enqueue_jobs(batch_id, unique_urls)
+        self._wakeup.set()
+        return {"batch_id": batch_id, "queued": queued}
+
+    def _pipeline(self, batch_id: str) -> IngestPipeline:
+        pipeline = self._pipelines.get(batch_id)
+        if pipeline is MISSING:
+            pipeline = IngestPipeline()
+            self._pipelines.set(batch_id, pipeline)
+        return pipeline
+
+    async def _work(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                job = await db.claim_job()
+                if job:
+                    await self._process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f"Ingest worker error: {e}", exc_info=True)
+            # Idle (or Mongo trouble): wait for new jobs, or poll for retries and other processes' jobs
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, job: dict):
+        try:
+            result = await self._pipeline(job["batch_id"]).ingest(job["url"])
+        except asyncio.CancelledError:
+            await db.release_job(job["_id"])
+            raise
+        result.pop("url", None)
+        retry_in: Optional[float] = None
+        if result["ok"]:
+            status = "done"
+        elif result["status_code"] in RETRY_STATUS_CODES and job["attempts"] < self.max_attempts:
+            status, retry_in = "queued", self.retry_delay * job["attempts"]
+        else:
+            status = "failed"
+        await db.finish_job(job["_id"], status, result, retry_in)
+
+
+queue = JobQueue()
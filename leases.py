@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from config import settings
+from database import db
+
+LOGGER = logging.getLogger(__name__)
+
+# Identifies this process among all workers and replicas
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeasedService:
+    """Runs a background service on only one process of a deployment.
+
+    Every process competes for a named lease in Mongo; the holder starts the service and renews the
+    lease every `ttl / 3` seconds. A holder that can't renew stops the service well before the lease
+    expires, and another process takes over once it has. On shutdown the lease is released, so a
+    restarted or remaining process picks the service up on its next attempt.
+    """
+
+    def __init__(self, name: str, start: Callable[[], Awaitable], stop: Callable[[], Awaitable],
+                 ttl: float = settings.LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self._start_service, self._stop_service = start, stop
+        self._task: Optional[asyncio.Task] = None
+        self.held = False
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    acquired = await db.acquire_lease(self.name, OWNER, self.ttl)
+                    if acquired and not self.held:
+                        await self._start_service()
+                        self.held = True
+                        LOGGER.info(f"{OWNER} now runs {self.name}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    LOGGER.error(f"Could not take or renew the {self.name} lease: {e}")
+                    acquired = False
+                if self.held and not acquired:
+                    LOGGER.warning(f"{OWNER} lost the {self.name} lease; stopping it here")
+                    self.held = False
+                    await self._stop_service()
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            if self.held:
+                self.held = False
+                await self._stop_service()
+                try:
+                    await db.release_lease(self.name, OWNER)
+                except Exception as e:
+                    LOGGER.warning(f"Could not release the {self.name} lease: {e}")
+
+    def stats(self) -> dict:
+        return {"owner": OWNER, "held": self.held}
@@ -1,24 +1,71 @@
+import asyncio
 import httpx
-import os
 import hashlib
-from urllib.parse import urlparse, unquote
+import json
+from datetime import datetime
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
 from fastapi import FastAPI, Request, Form, Depends, HTTPException, Body
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from bson import ObjectId
+from pydantic import ValidationError
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
-from database import db
-from metadata import get_metadata, format_tmdb_image, find_tmdb_id_by_imdb_id  # <-- IMPORT NEW FUNCTION
+from modal import (Episode, EpisodeChanges, MediaBase, MediaPatch, MovieSchema, StreamChanges, StreamInfo,
+                   TVShowSchema)
+from serialization import FastJSONResponse
+from database import EditConflict, db
+from http_client import http
+from cache import TTLCache, MISSING
+from stremio import TMDB_IMAGE_BASE, build_catalog_entry, dumps, make_etag, read_play_token, render
+from ingest import IngestPipeline, filename_from_url, probe_link
+from jobs import queue
+from health import checker
+from refresher import CHECKPOINT, refresher
+from leases import LeasedService
+from resolver import resolver
+from backup import DEFAULT_BATCH_SIZE, check_format, export_library, import_library
+from images import FILENAME, IMMUTABLE, VARIANTS, ImageNotFound, image_cache
+import metrics
+from parser import get_parse_stats
+from metadata import format_tmdb_image, find_tmdb_id_by_imdb_id, get_id_map_stats, get_logo, tmdb
 import logging
 
-app = FastAPI(title="DDL Stremio Addon - Premium")
+
+# Background services run on one process at a time, however many workers and replicas serve requests
+BACKGROUND = [LeasedService("ingest-jobs", queue.start, queue.stop),
+              LeasedService("link-checker", checker.start, checker.stop),
+              LeasedService("metadata-refresh", refresher.start, refresher.stop)]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.ensure_indexes()
+    await http.start()
+    for service in BACKGROUND:
+        await service.start()
+    yield
+    for service in reversed(BACKGROUND):
+        await service.stop()
+    await http.close()
+
+
+app = FastAPI(title="DDL Stremio Addon - Premium", lifespan=lifespan, default_response_class=FastJSONResponse)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-app.add_middleware(SessionMiddleware, secret_key="a-super-secret-key-that-you-should-change")
+app.add_middleware(SessionMiddleware, secret_key=settings.SESSION_SECRET)
+app.add_middleware(metrics.MetricsMiddleware)
 templates = Jinja2Templates(directory="templates")
 
 LOGGER = logging.getLogger(__name__)
 
+CATALOG_PAGE_SIZE = 100
+# How long the end of a served catalog page is remembered (in Mongo, so every worker and replica sees the
+# latest one; the order changes with every ingest, so a per-process copy would go stale)
+CATALOG_CURSOR_TTL = 86400
+_genre_cache = TTLCache(maxsize=2, ttl=600)
+
 
 # --- Authentication & Web Routes (No changes here) ---
 def is_authenticated(request: Request) -> bool:
@@ -55,9 +102,7 @@ async def logout(request: Request):
 @app.get("/", response_class=HTMLResponse)
 async def dashboard_page(request: Request, _: None = Depends(require_auth)):
     stats = await db.get_stats()
-    recent_movies, _ = await db.get_media_list('movie', 1, 5)
-    recent_tv, _ = await db.get_media_list('tv', 1, 5)
-    recent_items = sorted(recent_movies + recent_tv, key=lambda x: x['updated_on'], reverse=True)[:5]
+    recent_items = await db.get_recent_media(5)
     return templates.TemplateResponse("dashboard.html", {"request": request, "stats": stats, "recent_items": recent_items})
 
 
@@ -82,27 +127,88 @@ async def api_add_ddl(request: Request, _: None = Depends(require_auth)):
     data = await request.json()
     url = data.get("url")
     if not url: raise HTTPException(status_code=400, detail="URL is required.")
+    result = await IngestPipeline().ingest(url)
+    return JSONResponse({"message": result["message"]}, status_code=result["status_code"])
+
+
+def read_urls(data: dict) -> list:
+    urls = data.get("urls")
+    if not isinstance(urls, list) or not urls: raise HTTPException(status_code=400, detail="URLs are required.")
+    if not all(isinstance(u, str) for u in urls): raise HTTPException(status_code=400, detail="URLs must be strings.")
+    if len(urls) > settings.INGEST_MAX_LINKS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.INGEST_MAX_LINKS} links per request.")
+    return urls
+
+
+@app.post("/api/add-ddl/bulk")
+async def api_add_ddl_bulk(request: Request, _: None = Depends(require_auth)):
+    """Ingests many links concurrently, streaming one NDJSON result line per link as it completes."""
+    urls = read_urls(await request.json())
+
+    async def results():
+        ok = failed = 0
+        async for result in IngestPipeline().run(urls):
+            ok, failed = ok + result["ok"], failed + (not result["ok"])
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "ok": ok, "failed": failed}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.post("/api/jobs", status_code=202)
+async def api_enqueue_jobs(request: Request, _: None = Depends(require_auth)):
+    """Queues links for background ingestion and returns the batch ID to follow them with."""
+    urls = read_urls(await request.json())
+    return await queue.enqueue(urls)
+
+
+def parse_since(since: str | None) -> datetime | None:
+    if not since:
+        return None
     try:
-        filename = os.path.basename(unquote(urlparse(url).path))
-        async with httpx.AsyncClient() as client:
-            resp = await client.head(url, follow_redirects=True, timeout=10)
-            resp.raise_for_status()
-            size_bytes = int(resp.headers.get('content-length', '0'))
-            size_str = f"{round(size_bytes / (1024 ** 3), 2)} GB" if size_bytes > 0 else "N/A"
-        metadata_info = await get_metadata(filename, url)
-        if not metadata_info: return JSONResponse(
-            {"message": f"Failed to get metadata for '{filename}'. Check filename format or TMDb availability."},
-            status_code=400)
-        await db.insert_media(metadata_info, size=size_str, name=filename)
-        return JSONResponse({"message": f"Successfully added '{metadata_info['title']}'"}, status_code=200)
-    except httpx.HTTPStatusError as e:
-        return JSONResponse({"message": f"URL returned an error: {e.response.status_code} Not Found"},
-                              status_code=400)
-    except httpx.RequestError:
-        return JSONResponse({"message": "Could not connect to the URL. Check the link or network."}, status_code=400)
-    except Exception as e:
-        LOGGER.error(f"Error processing DDL {url}: {e}", exc_info=True); return JSONResponse(
-        {"message": "An unexpected server error occurred. Check logs for details."}, status_code=500)
+        return datetime.fromisoformat(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid 'since' timestamp.")
+
+
+def parse_after(after: str | None) -> str | None:
+    if after and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid 'after' job id.")
+    return after or None
+
+
+@app.get("/api/jobs/{batch_id}")
+async def api_get_jobs(batch_id: str, since: str | None = None, after: str | None = None,
+                       _: None = Depends(require_auth)):
+    """Progress of a batch; pass the last seen job's `updated_on` as `since` and its `id` as `after`
+    to only get the jobs that changed since."""
+    batch = await db.get_job_batch(batch_id, parse_since(since), parse_after(after))
+    if not batch["total"]: raise HTTPException(status_code=404, detail="Batch not found.")
+    return batch
+
+
+@app.get("/api/jobs/{batch_id}/events")
+async def api_job_events(request: Request, batch_id: str, _: None = Depends(require_auth)):
+    """Server-sent events with the jobs of a batch as they change, ending once all are finished."""
+    batch = await db.get_job_batch(batch_id)
+    if not batch["total"]: raise HTTPException(status_code=404, detail="Batch not found.")
+
+    async def events(batch):
+        since, after, idle = None, None, 0
+        while True:
+            if batch["jobs"]:
+                yield f"data: {json.dumps(batch)}\n\n"
+                last = batch["jobs"][-1]
+                since, after, idle = parse_since(last["updated_on"]), last["id"], 0
+            elif idle % 15 == 14:
+                yield ": keep-alive\n\n"
+            if batch["finished"] or await request.is_disconnected():
+                break
+            await asyncio.sleep(1)
+            idle += 1
+            batch = await db.get_job_batch(batch_id, since, after)
+
+    return StreamingResponse(events(batch), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @app.post("/api/fetch-ddl-details", response_class=JSONResponse)
@@ -111,12 +217,8 @@ async def api_fetch_ddl_details(request: Request, _: None = Depends(require_auth
     url = data.get("url")
     if not url: raise HTTPException(status_code=400, detail="URL is required.")
     try:
-        filename = os.path.basename(unquote(urlparse(url).path))
-        async with httpx.AsyncClient() as client:
-            resp = await client.head(url, follow_redirects=True, timeout=10)
-            resp.raise_for_status()
-            size_bytes = int(resp.headers.get('content-length', '0'))
-            size_str = f"{round(size_bytes / (1024 ** 3), 2)} GB" if size_bytes > 0 else "N/A"
+        filename = filename_from_url(url)
+        size_str = await probe_link(url)
         return JSONResponse({"name": filename, "size": size_str})
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=400, detail=f"URL returned an error: {e.response.status_code}")
@@ -130,7 +232,6 @@ async def api_fetch_ddl_details(request: Request, _: None = Depends(require_auth
 @app.get("/api/fetch-episode-details/{tmdb_id}/{season_number}/{episode_number}", response_class=JSONResponse)
 async def api_fetch_episode_details(tmdb_id: int, season_number: int, episode_number: int,
                                     _: None = Depends(require_auth)):
-    from metadata import tmdb
     try:
         episode = await tmdb.episode(tmdb_id, season_number, episode_number).details()
         return {"title": episode.name, "episode_backdrop": format_tmdb_image(episode.still_path, "w500")}
@@ -140,7 +241,6 @@ async def api_fetch_episode_details(tmdb_id: int, season_number: int, episode_nu
 
 @app.get("/api/fetch-season-details/{tmdb_id}/{season_number}", response_class=JSONResponse)
 async def api_fetch_season_details(tmdb_id: int, season_number: int, _: None = Depends(require_auth)):
-    from metadata import tmdb
     try:
         season = await tmdb.season(tmdb_id, season_number).details()
         episodes_data = [
@@ -156,17 +256,84 @@ async def api_fetch_season_details(tmdb_id: int, season_number: int, _: None = D
 
 @app.get("/api/media/{media_type}")
 async def api_get_media(media_type: str, page: int = 1, search: str = "", _: None = Depends(require_auth)):
-    items, total = await db.get_media_list(media_type, page, 12, search)
-    return {"items": items, "total": total, "page": page, "page_size": 12}
+    items, total = await db.get_media_list(media_type, page, 12, search, view="list")
+    return FastJSONResponse({"items": items, "total": total, "page": page, "page_size": 12})
+
+
+def _validation_detail(e: ValidationError, prefix: str = "") -> str:
+    return "; ".join(f"{prefix}{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+def validate_media(media_type: str, tmdb_id: int, data: dict) -> dict:
+    # Admin edits are the one write path taking arbitrary input, so they go through the schemas; only the
+    # fields that were sent are written
+    schema = MovieSchema if media_type == 'movie' else TVShowSchema
+    try:
+        media = schema(**{**data, "tmdb_id": tmdb_id, "media_type": media_type})
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=_validation_detail(e))
+    return media.dict(exclude_unset=True)
+
+
+# The model each PATCH operation's `value` must match, and the fields that must address its target
+PATCH_VALUES = {"add_episode": Episode, "set_episode": EpisodeChanges, "add_stream": StreamInfo,
+                "update_stream": StreamChanges}
+PATCH_TARGETS = {"add_season": ("season",), "remove_season": ("season",), "add_episode": ("season",),
+                 "remove_episode": ("season", "episode"), "set_episode": ("season", "episode"),
+                 "add_stream": ("season", "episode"), "update_stream": ("season", "episode", "url"),
+                 "remove_stream": ("season", "episode", "url")}
+
+
+def validate_patch(media_type: str, data: dict) -> tuple:
+    """(expected updated_on, title fields, operations) of an editor PATCH, or a 422 for invalid input."""
+    try:
+        patch = MediaPatch(**data)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=_validation_detail(e))
+    fields = patch.set.dict(exclude_unset=True)
+    cleared = [k for k, v in fields.items() if v is None and MediaBase.model_fields[k].is_required()]
+    if cleared:
+        raise HTTPException(status_code=422, detail=f"{', '.join(cleared)} cannot be empty")
+    ops = []
+    for i, op in enumerate(patch.ops):
+        if media_type == 'movie' and not op.op.endswith("_stream"):
+            raise HTTPException(status_code=422, detail=f"ops.{i}: movies only take stream operations")
+        missing = [k for k in PATCH_TARGETS[op.op] if getattr(op, k) is None and (media_type == 'tv' or k == "url")]
+        if missing:
+            raise HTTPException(status_code=422, detail=f"ops.{i}: {op.op} needs {', '.join(missing)}")
+        op = op.dict(exclude_none=True)
+        if op["op"] in PATCH_VALUES:
+            try:
+                op["value"] = PATCH_VALUES[op["op"]](**op.get("value", {})).dict(exclude_unset=True)
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=_validation_detail(e, f"ops.{i}.value."))
+            if not op["value"]:
+                raise HTTPException(status_code=422, detail=f"ops.{i}: {op['op']} has nothing to set")
+        ops.append(op)
+    return patch.updated_on, fields, ops
 
 
 @app.put("/api/media/{media_type}/{tmdb_id}")
 async def api_update_media(media_type: str, tmdb_id: int, data: dict = Body(...), _: None = Depends(require_auth)):
-    success = await db.update_media_details(media_type, tmdb_id, data)
+    success = await db.update_media_details(media_type, tmdb_id, validate_media(media_type, tmdb_id, data))
     if not success: raise HTTPException(status_code=404, detail="Failed to update or media not found.")
     return {"message": "Media updated successfully"}
 
 
+@app.patch("/api/media/{media_type}/{tmdb_id}")
+async def api_patch_media(media_type: str, tmdb_id: int, data: dict = Body(...), _: None = Depends(require_auth)):
+    if media_type not in ['movie', 'tv']: raise HTTPException(status_code=404, detail="Invalid media type")
+    expected, fields, ops = validate_patch(media_type, data)
+    try:
+        updated_on = await db.patch_media(media_type, tmdb_id, expected, fields, ops)
+    except EditConflict as e:
+        return FastJSONResponse({"detail": "This title changed since the editor was opened (a link may have been "
+                                           "added meanwhile). Reload it and make your changes again.",
+                                 "updated_on": e.updated_on}, status_code=409)
+    if updated_on is None: raise HTTPException(status_code=404, detail="Media not found.")
+    return {"message": "Media updated successfully", "updated_on": updated_on}
+
+
 @app.delete("/api/media/{media_type}/{tmdb_id}")
 async def api_delete_media(media_type: str, tmdb_id: int, _: None = Depends(require_auth)):
     success = await db.delete_media(media_type, tmdb_id)
@@ -174,9 +341,61 @@ async def api_delete_media(media_type: str, tmdb_id: int, _: None = Depends(requ
     return {"message": "Media deleted successfully"}
 
 
+@app.get("/api/export")
+async def api_export(format: str = "ndjson", media_type: str = "", _: None = Depends(require_auth)):
+    try:
+        check_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_types = [media_type] if media_type in ("movie", "tv") else ["movie", "tv"]
+    filename = f"ddl-library-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}.gz"
+    return StreamingResponse(export_library(format, media_types), media_type="application/gzip",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.post("/api/import")
+async def api_import(request: Request, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False,
+                     _: None = Depends(require_auth)):
+    # The body is an export (as written by /api/export), read as it arrives
+    try:
+        return await import_library(request.stream(), batch_size=max(1, batch_size), dry_run=dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/cache-stats")
+async def api_cache_stats(_: None = Depends(require_auth)):
+    return {"id_map": get_id_map_stats(), "tmdb": tmdb.stats(), "parser": get_parse_stats(),
+            "resolver": resolver.stats(), "images": image_cache.stats()}
+
+
+@app.get("/api/link-health")
+async def api_link_health(_: None = Depends(require_auth)):
+    return {**await db.get_link_health_stats(), "checker": checker.stats()}
+
+
+@app.get("/api/metadata-refresh")
+async def api_metadata_refresh(_: None = Depends(require_auth)):
+    # Counters are those of the answering process; the checkpoint is shared
+    return {"checkpoint": await db.get_checkpoint(CHECKPOINT), **refresher.stats()}
+
+
+@app.get("/api/background")
+async def api_background(_: None = Depends(require_auth)):
+    # Which background services this process runs; the other workers/replicas are on standby for them
+    return {service.name: service.stats() for service in BACKGROUND}
+
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    # Prometheus scrape endpoint; protected by a bearer token when METRICS_TOKEN is set
+    if settings.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token.")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/refetch-tmdb/{media_type}/{tmdb_id}")
 async def api_refetch_tmdb(media_type: str, tmdb_id: int, _: None = Depends(require_auth)):
-    from metadata import get_logo, tmdb
     details = await (tmdb.movie(tmdb_id) if media_type == 'movie' else tmdb.tv(tmdb_id)).details()
     logo = await get_logo(tmdb_id, media_type)
     return {"title": details.title if media_type == 'movie' else details.name,
@@ -189,7 +408,6 @@ async def api_refetch_tmdb(media_type: str, tmdb_id: int, _: None = Depends(requ
 
 @app.get("/api/images/{media_type}/{tmdb_id}")
 async def api_get_images(media_type: str, tmdb_id: int, _: None = Depends(require_auth)):
-    from metadata import tmdb
     try:
         images = await (tmdb.movie(tmdb_id) if media_type == 'movie' else tmdb.tv(tmdb_id)).images()
         all_images = images.posters + images.backdrops + images.logos
@@ -206,118 +424,162 @@ async def api_get_images(media_type: str, tmdb_id: int, _: None = Depends(requir
 
 @app.get("/stremio/manifest.json")
 async def get_manifest():
+    movie_genres, tv_genres = await get_catalog_genres("movie"), await get_catalog_genres("tv")
     return {
         "id": "community.ddl.streamer.premium",
-        "version": "4.0.1", # Incremented version
+        "version": "4.1.0",
         "name": "DDL Streamer (Premium)",
         "description": "Stream from your personal DDL library.",
         "logo": "https://i.imgur.com/f33tN3G.png",
         "types": ["movie", "series"],
         "resources": ["catalog", "meta", "stream"],
         "catalogs": [
-            {"type": "movie", "id": "ddl_movies", "name": "DDL Movies"},
-            {"type": "series", "id": "ddl_series", "name": "DDL TV Shows"}
+            {"type": "movie", "id": "ddl_movies", "name": "DDL Movies", "extra": catalog_extra(movie_genres)},
+            {"type": "series", "id": "ddl_series", "name": "DDL TV Shows", "extra": catalog_extra(tv_genres)}
         ]
         # REMOVED "idPrefixes" to respond to all content
     }
 
 
-@app.get("/stremio/catalog/{media_type}/{catalog_id}.json")
-async def get_catalog(media_type: str):
-    stremio_type = "tv" if media_type == "series" else "movie"
-    items, _ = await db.get_media_list(stremio_type, 1, 100)
-    # The catalog will still use the custom ddl- prefix to avoid conflicts
-    metas = [{"id": f"ddl-{i['tmdb_id']}", "type": media_type, "name": i['title'], "poster": i.get('poster'),
-              "year": i.get('release_year'), "logo": i.get('logo')} for i in items]
-    return {"metas": metas}
+def catalog_extra(genres: list) -> list:
+    return [{"name": "search", "isRequired": False},
+            {"name": "genre", "isRequired": False, "options": genres},
+            {"name": "skip", "isRequired": False}]
 
 
-@app.get("/stremio/meta/{media_type}/{stremio_id}.json")
-async def get_meta(media_type: str, stremio_id: str):
-    stremio_type = "tv" if media_type == "series" else "movie"
-    tmdb_id = None
+async def get_catalog_genres(media_type: str) -> list:
+    genres = _genre_cache.get(media_type)
+    if genres is MISSING:
+        genres = await db.get_genres(media_type)
+        _genre_cache.set(media_type, genres)
+    return genres
+
+
+def stremio_response(request: Request, body: str, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={settings.STREMIO_CACHE_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
+async def resolve_tmdb_id(media_id: str, stremio_type: str) -> int | None:
     # Handle both standard IMDb IDs and our custom ddl- IDs
-    if stremio_id.startswith("tt"):
-        tmdb_id = await find_tmdb_id_by_imdb_id(stremio_id, stremio_type)
-    elif stremio_id.startswith("ddl-"):
+    if media_id.startswith("tt"):
+        return await find_tmdb_id_by_imdb_id(media_id, stremio_type)
+    if media_id.startswith("ddl-"):
         try:
-            tmdb_id = int(stremio_id.replace("ddl-", ""))
+            return int(media_id.replace("ddl-", ""))
         except ValueError:
-            tmdb_id = None
+            return None
+    return None
 
-    if not tmdb_id:
-        return {"meta": {}}
 
-    item = await db.get_media_by_tmdb_id(stremio_type, tmdb_id)
-    if not item:
-        return {"meta": {}}
+@app.get("/stremio/catalog/{media_type}/{catalog_id}.json")
+async def get_catalog(request: Request, media_type: str):
+    return await catalog_page(request, media_type, {})
 
-    meta_obj = {
-        "id": stremio_id,  # IMPORTANT: Respond with the ID Stremio requested
-        "type": media_type,
-        "name": item['title'],
-        "poster": item.get('poster'),
-        "background": item.get('backdrop'),
-        "logo": item.get('logo'),
-        "description": item.get('description'),
-        "year": item.get('release_year'),
-        "imdbRating": item.get('rating'),
-        "genres": item.get('genres')
-    }
 
-    if media_type == 'series':
-        meta_obj['videos'] = [
-            {
-                "id": f"{stremio_id}:{s['season_number']}:{e['episode_number']}",
-                "title": e['title'],
-                "season": s['season_number'],
-                "episode": e['episode_number'],
-                "thumbnail": e.get('episode_backdrop')
-            }
-            for s in sorted(item.get('seasons', []), key=lambda x: x['season_number'])
-            for e in sorted(s.get('episodes', []), key=lambda x: x['episode_number'])
-        ]
-    return {"meta": meta_obj}
+@app.get("/stremio/catalog/{media_type}/{catalog_id}/{extra}.json")
+async def get_catalog_with_extra(request: Request, media_type: str, extra: str):
+    # Parse the still-encoded path segment so values containing "&" or "=" (e.g. "Action & Adventure") survive
+    raw_path = request.scope.get("raw_path", b"").decode("latin-1")
+    raw_extra = raw_path.rsplit("/", 1)[-1].removesuffix(".json") if raw_path else extra
+    return await catalog_page(request, media_type, dict(parse_qsl(raw_extra)))
 
 
-@app.get("/stremio/stream/{media_type}/{stremio_id}.json")
-async def get_streams(media_type: str, stremio_id: str):
-    parts = stremio_id.split(':')
-    media_id = parts[0]
+async def catalog_page(request: Request, media_type: str, extra: dict):
     stremio_type = "tv" if media_type == "series" else "movie"
-    tmdb_id = None
+    search, genre = extra.get("search") or None, extra.get("genre") or None
+    try:
+        skip = max(int(extra.get("skip", 0)), 0)
+    except ValueError:
+        skip = 0
+
+    if search:
+        # Search results are ranked by relevance, not recency, so they page by offset
+        items, _ = await db.get_media_list(stremio_type, skip // CATALOG_PAGE_SIZE + 1, CATALOG_PAGE_SIZE,
+                                           search, genre, count=False, view="catalog")
+    else:
+        # Stremio pages by offset; remember where each served page ended so the next one is a keyset query.
+        # Only an offset no process served the page before within CATALOG_CURSOR_TTL is located by skipping
+        after = None
+        if skip:
+            after = await db.get_catalog_cursor(stremio_type, genre, skip) \
+                or await db.get_list_cursor_at(stremio_type, skip, genre)
+            if after is None:
+                body = '{"metas":[]}'
+                return stremio_response(request, body, f'"{make_etag(body)}"')
+        items, _ = await db.get_media_list(stremio_type, 1, CATALOG_PAGE_SIZE, genre=genre, after=after,
+                                           count=False, view="catalog")
+        if items:
+            await db.set_catalog_cursor(stremio_type, genre, skip + len(items), db.list_cursor(items[-1]),
+                                        CATALOG_CURSOR_TTL)
+
+    metas = [i.get('catalog_json') or dumps(build_catalog_entry(i)) for i in items]
+    body = '{"metas":[' + ",".join(metas) + ']}'
+    return stremio_response(request, body, f'"{make_etag(body)}"')
 
-    # Handle both standard IMDb IDs and our custom ddl- IDs
-    if media_id.startswith("tt"):
-        tmdb_id = await find_tmdb_id_by_imdb_id(media_id, stremio_type)
-    elif media_id.startswith("ddl-"):
-        try:
-            tmdb_id = int(media_id.replace("ddl-", ""))
-        except ValueError:
-            tmdb_id = None
 
+@app.get("/stremio/meta/{media_type}/{stremio_id}.json")
+async def get_meta(request: Request, media_type: str, stremio_id: str):
+    stremio_type = "tv" if media_type == "series" else "movie"
+    tmdb_id = await resolve_tmdb_id(stremio_id, stremio_type)
     if not tmdb_id:
-        return {"streams": []}
+        return {"meta": {}}
+
+    doc = await db.get_meta_response(stremio_type, tmdb_id)
+    if not doc:
+        return {"meta": {}}
+    # IMPORTANT: Respond with the ID Stremio requested
+    body, etag = render(doc["body"], doc["etag"], stremio_id)
+    return stremio_response(request, body, etag)
+
 
-    item = await db.get_media_by_tmdb_id(stremio_type, tmdb_id)
-    if not item:
+@app.get("/stremio/stream/{media_type}/{stremio_id}.json")
+async def get_streams(request: Request, media_type: str, stremio_id: str):
+    parts = stremio_id.split(':')
+    stremio_type = "tv" if media_type == "series" else "movie"
+    tmdb_id = await resolve_tmdb_id(parts[0], stremio_type)
+    if not tmdb_id:
         return {"streams": []}
 
-    streams = []
     if media_type == 'movie':
-        streams = [{"name": "DDL", "title": f"{q['quality']} - {q['size']}\n{q['name']}", "url": q['url']} for q in
-                   item.get('streams', [])]
+        doc = await db.get_stream_response(stremio_type, tmdb_id)
     else:
         if len(parts) < 3: return {"streams": []}
-        season_num, episode_num = int(parts[1]), int(parts[2])
-        for s in item.get('seasons', []):
-            if s['season_number'] == season_num:
-                for e in s.get('episodes', []):
-                    if e['episode_number'] == episode_num:
-                        streams = [{"name": "DDL", "title": f"{q['quality']} - {q['size']}\n{q['name']}", "url": q['url']}
-                                   for q in e.get('streams', [])]
-                        break
-                break
-
-    return {"streams": streams}
+        try:
+            season_num, episode_num = int(parts[1]), int(parts[2])
+        except ValueError:
+            return {"streams": []}
+        doc = await db.get_stream_response(stremio_type, tmdb_id, season_num, episode_num)
+    if not doc:
+        return {"streams": []}
+    body, etag = render(doc["body"], doc["etag"], stremio_id)
+    return stremio_response(request, body, etag)
+
+
+@app.api_route("/play/{token}", methods=["GET", "HEAD"])
+@app.api_route("/play/{token}/{filename}", methods=["GET", "HEAD"])
+async def play(token: str):
+    # PLAYBACK_MODE=play: send the player straight to where the stream currently resolves to
+    url = read_play_token(token)
+    if not url:
+        raise HTTPException(status_code=404, detail="Unknown stream.")
+    target = await resolver.resolve(url)
+    return RedirectResponse(target, status_code=302, headers={"Cache-Control": "no-store"})
+
+
+@app.get("/img/{variant}/{filename}")
+async def image(variant: str, filename: str):
+    # IMAGE_PROXY=true: TMDb artwork resized for Stremio and served from the local disk cache
+    if variant not in VARIANTS or not FILENAME.match(filename):
+        raise HTTPException(status_code=404, detail="Unknown image.")
+    try:
+        path, media_type = await image_cache.get(variant, filename)
+    except ImageNotFound:
+        raise HTTPException(status_code=404, detail="Unknown image.")
+    except Exception as e:
+        image_cache.counters["errors"] += 1
+        LOGGER.warning(f"Image proxy failed for {variant}/{filename}: {e}")
+        return RedirectResponse(f"{TMDB_IMAGE_BASE}{VARIANTS[variant][0]}/{filename}", status_code=302)
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": IMMUTABLE})
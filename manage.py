@@ -0,0 +1,99 @@
+"""Maintenance commands, e.g. `python manage.py migrate-episodes`."""
+import argparse
+import asyncio
+import json
+import sys
+
+import backup
+from database import db
+
+
+async def migrate_episodes(args):
+    # Processes still in embedded mode would see migrated shows as empty, so the switch comes first
+    if not db.normalized:
+        sys.exit("Set STORAGE_LAYOUT=normalized (on every instance) before migrating episodes.")
+    await db.ensure_indexes()
+    result = await db.migrate_to_episodes(batch_size=args.batch_size)
+    print(json.dumps(result))
+
+
+async def ensure_indexes(args):
+    await db.ensure_indexes()
+    print("Indexes are up to date.")
+
+
+async def rematerialize(args):
+    # Stored Stremio responses embed playback URLs, so rebuild them after changing PLAYBACK_MODE or BASE_URL
+    titles = 0
+    for media_type, collection in (("movie", db.movie_collection), ("tv", db.tv_collection)):
+        async for doc in collection.find({}, {"tmdb_id": 1}):
+            await db.materialize_media(media_type, doc["tmdb_id"])
+            titles += 1
+    print(json.dumps({"titles": titles}))
+
+
+async def export(args):
+    backup.check_format(args.format)
+    media_types = [args.media_type] if args.media_type else ["movie", "tv"]
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        async for chunk in backup.export_library(args.format, media_types):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+async def _read_chunks(path: str, size: int = 1024 * 1024):
+    source = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while chunk := source.read(size):
+            yield chunk
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+
+
+async def import_(args):
+    if not args.dry_run:
+        await db.ensure_indexes()
+    result = await backup.import_library(_read_chunks(args.input), batch_size=args.batch_size, dry_run=args.dry_run)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DDL Stremio maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate-episodes",
+                                  help="Move embedded seasons into the episodes collection (STORAGE_LAYOUT=normalized)")
+    migrate.add_argument("--batch-size", type=int, default=500)
+    migrate.set_defaults(func=migrate_episodes)
+
+    indexes = commands.add_parser("ensure-indexes", help="Create the Mongo indexes the app relies on")
+    indexes.set_defaults(func=ensure_indexes)
+
+    rebuild = commands.add_parser("rematerialize",
+                                  help="Rebuild the stored Stremio responses "
+                                       "(after changing PLAYBACK_MODE, IMAGE_PROXY or BASE_URL)")
+    rebuild.set_defaults(func=rematerialize)
+
+    dump = commands.add_parser("export", help="Write the library as a gzipped NDJSON or msgpack stream")
+    dump.add_argument("output", help="file to write, or - for stdout")
+    dump.add_argument("--format", choices=backup.FORMATS, default="ndjson")
+    dump.add_argument("--media-type", choices=("movie", "tv"), help="only export movies or shows")
+    dump.set_defaults(func=export)
+
+    load = commands.add_parser("import",
+                               help="Upsert the titles of an export, replacing stored ones with the same tmdb_id")
+    load.add_argument("input", help="export file, or - for stdin")
+    load.add_argument("--batch-size", type=int, default=backup.DEFAULT_BATCH_SIZE)
+    load.add_argument("--dry-run", action="store_true", help="only validate and count what would change")
+    load.set_defaults(func=import_)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
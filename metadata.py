@@ -1,35 +1,92 @@
+import asyncio
 import logging
+import time
+from datetime import datetime
 from themoviedb import aioTMDb
-import PTN
 from config import settings
+from parser import parse
+from database import db
+from cache import TTLCache, MISSING
+from metrics import traced
+from ratelimit import RateLimitExceeded
+from tmdb_cache import CachedTMDb, make_store
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
-tmdb = aioTMDb(key=settings.TMDB_API_KEY, language="en-US", region="US")
+tmdb = CachedTMDb(aioTMDb(key=settings.TMDB_API_KEY, language="en-US", region="US"),
+                  maxsize=settings.TMDB_CACHE_SIZE, store=make_store())
 
 
-# +++ NEW FUNCTION +++
+# Two-tier IMDb -> TMDb mapping cache: in-process LRU in front of the Mongo `id_map` collection.
+# Negative results (IMDb IDs TMDb doesn't know) are cached too, with a shorter TTL.
+_id_map_cache = TTLCache(maxsize=settings.ID_MAP_CACHE_SIZE, ttl=settings.ID_MAP_TTL)
+ID_MAP_STATS = {"memory_hits": 0, "db_hits": 0, "negative_hits": 0, "tmdb_lookups": 0, "tmdb_errors": 0}
+
+
+def get_id_map_stats() -> dict:
+    return {**ID_MAP_STATS, "memory": _id_map_cache.stats()}
+
+
+@traced
+async def _lookup_tmdb_id(imdb_id: str, media_type: str) -> int | None:
+    find_results = await tmdb.find().by_imdb(imdb_id)
+    if media_type == "movie" and find_results.movie_results:
+        return find_results.movie_results[0].id
+    if media_type == "tv" and find_results.tv_results:
+        return find_results.tv_results[0].id
+    return None
+
+
+@traced
 async def find_tmdb_id_by_imdb_id(imdb_id: str, media_type: str) -> int | None:
-    """Finds the TMDb ID for a given IMDb ID using the TMDb API."""
+    """Finds the TMDb ID for a given IMDb ID, consulting the memory and Mongo caches before TMDb."""
+    # Stremio uses "series" but our internal type is "tv"
+    media_type = "tv" if media_type in ["series", "tv"] else "movie"
+    key = (media_type, imdb_id)
+
+    tmdb_id = _id_map_cache.get(key)
+    if tmdb_id is not MISSING:
+        ID_MAP_STATS["memory_hits"] += 1
+        if tmdb_id is None: ID_MAP_STATS["negative_hits"] += 1
+        return tmdb_id
+
     try:
-        find_results = await tmdb.find(imdb_id).by("imdb_id")
-        # Stremio uses "series" but our internal type is "tv"
-        stremio_type = "tv" if media_type in ["series", "tv"] else "movie"
-
-        if stremio_type == "movie" and find_results.movie_results:
-            return find_results.movie_results[0].id
-        if stremio_type == "tv" and find_results.tv_results:
-            return find_results.tv_results[0].id
+        mapping = await db.get_id_mapping(imdb_id, media_type)
     except Exception as e:
+        LOGGER.error(f"Could not read ID mapping for {imdb_id}: {e}")
+        mapping = None
+    if mapping:
+        tmdb_id = mapping.get("tmdb_id")
+        ID_MAP_STATS["db_hits"] += 1
+        if tmdb_id is None: ID_MAP_STATS["negative_hits"] += 1
+        ttl = max((mapping["expires_at"] - datetime.utcnow()).total_seconds(), 1)
+        _id_map_cache.set(key, tmdb_id, ttl=min(ttl, settings.ID_MAP_TTL))
+        return tmdb_id
+
+    ID_MAP_STATS["tmdb_lookups"] += 1
+    try:
+        tmdb_id = await _lookup_tmdb_id(imdb_id, media_type)
+    except Exception as e:
+        # Transient failures are not cached, so the next request retries TMDb
+        ID_MAP_STATS["tmdb_errors"] += 1
         LOGGER.error(f"Could not find TMDb ID for IMDb ID {imdb_id}: {e}")
-    return None
+        return None
+
+    ttl = settings.ID_MAP_TTL if tmdb_id else settings.ID_MAP_NEGATIVE_TTL
+    _id_map_cache.set(key, tmdb_id, ttl=ttl)
+    try:
+        await db.set_id_mapping(imdb_id, media_type, tmdb_id, ttl)
+    except Exception as e:
+        LOGGER.error(f"Could not store ID mapping for {imdb_id}: {e}")
+    return tmdb_id
 
 
 def format_tmdb_image(path: str, size: str = "w500") -> str:
     return f"https://image.tmdb.org/t/p/{size}{path}" if path else ""
 
 
+@traced
 async def get_logo(tmdb_id: int, media_type: str) -> str | None:
     try:
         if media_type == "movie":
@@ -46,58 +103,123 @@ async def get_logo(tmdb_id: int, media_type: str) -> str | None:
     return None
 
 
-async def get_metadata(filename: str, file_url: str) -> dict | None:
+def parse_filename(filename: str) -> dict | None:
+    parsed = parse(filename)
+    title, year, quality, season, episode = (
+        parsed.get("title"), parsed.get("year"), parsed.get("resolution"),
+        parsed.get("season"), parsed.get("episode")
+    )
+
+    if not title or not quality:
+        LOGGER.warning(f"Skipping '{filename}': Missing title or quality.")
+        return None
+
+    if isinstance(season, list) or isinstance(episode, list):
+        LOGGER.warning(f"Skipping season pack '{filename}'.")
+        return None
+
+    return {"title": title, "year": year, "quality": quality, "season": season, "episode": episode}
+
+
+@traced
+async def search_show_id(title: str) -> int | None:
+    search_results = await tmdb.search().tv(query=title)
+    return search_results[0].id if search_results else None
+
+
+@traced
+async def search_movie_id(title: str, year: int | None) -> int | None:
+    search_results = await tmdb.search().movies(query=title, year=year)
+    return search_results[0].id if search_results else None
+
+
+async def _memoized(memo: dict | None, key: tuple, factory):
+    # Lets concurrent lookups of one title (e.g. ten episodes of a show in a bulk import) share a single search
+    if memo is None:
+        return await factory()
+    if key not in memo:
+        memo[key] = asyncio.ensure_future(factory())
+    return await asyncio.shield(memo[key])
+
+
+async def _timed(timings: dict, stage: str, awaitable):
+    start = time.perf_counter()
     try:
-        parsed = PTN.parse(filename)
-        title, year, quality, season, episode = (
-            parsed.get("title"), parsed.get("year"), parsed.get("resolution"),
-            parsed.get("season"), parsed.get("episode")
-        )
+        return await awaitable
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
 
-        if not title or not quality:
-            LOGGER.warning(f"Skipping '{filename}': Missing title or quality.")
-            return None
 
-        if isinstance(season, list) or isinstance(episode, list):
-            LOGGER.warning(f"Skipping season pack '{filename}'.")
+@traced
+async def _fetch_episode(tmdb_id: int, season: int, episode: int) -> dict:
+    # Optional stage: TMDb often lags behind new episodes, which shouldn't block adding the file
+    try:
+        ep = await tmdb.episode(tmdb_id, season, episode).details()
+        return {"episode_number": episode, "title": ep.name,
+                "episode_backdrop": format_tmdb_image(ep.still_path, "original")}
+    except RateLimitExceeded:
+        raise
+    except Exception as e:
+        LOGGER.warning(f"No TMDb details for S{season}E{episode} of TMDB ID {tmdb_id}: {e}")
+        return {"episode_number": episode, "title": f"Episode {episode}", "episode_backdrop": None}
+
+
+@traced
+async def get_metadata(filename: str, file_url: str, memo: dict | None = None) -> dict | None:
+    """Resolves a DDL filename to the metadata stored for it.
+
+    Once the title is found, its details, logo and (for episodes) episode details are fetched
+    concurrently; only the details are required. The result carries a per-stage `timings`
+    breakdown in milliseconds. `memo` is an optional dict shared across calls (e.g. one bulk
+    import) so each title is only searched once. Raises RateLimitExceeded if TMDb keeps
+    throttling us.
+    """
+    timings = {}
+    started = time.perf_counter()
+    try:
+        parsed = parse_filename(filename)
+        timings["parse"] = round((time.perf_counter() - started) * 1000, 1)
+        if not parsed:
             return None
+        title, year, quality, season, episode = (
+            parsed["title"], parsed["year"], parsed["quality"], parsed["season"], parsed["episode"]
+        )
+        is_episode = bool(season and episode)
+        media_type = "tv" if is_episode else "movie"
 
-        if season and episode:
-            search_results = await tmdb.search().tv(query=title)
-            if not search_results: return None
-
-            show = await tmdb.tv(search_results[0].id).details()
-            ep = await tmdb.episode(show.id, season, episode).details()
-            logo = await get_logo(show.id, "tv")
-
-            return {
-                "tmdb_id": show.id, "title": show.name,
-                "release_year": show.first_air_date.year if show.first_air_date else year,
-                "rating": round(show.vote_average, 1), "genres": [g.name for g in show.genres],
-                "poster": format_tmdb_image(show.poster_path),
-                "backdrop": format_tmdb_image(show.backdrop_path, "original"),
-                "logo": logo, "description": show.overview, "media_type": "tv",
-                "seasons": [{"season_number": season, "episodes": [
-                    {"episode_number": episode, "title": ep.name,
-                     "episode_backdrop": format_tmdb_image(ep.still_path, "original")}]}],
-                "quality": quality, "url": file_url,
-            }
+        if is_episode:
+            search = _memoized(memo, ("tv", title.lower()), lambda: search_show_id(title))
         else:
-            search_results = await tmdb.search().movies(query=title, year=year)
-            if not search_results: return None
-
-            movie = await tmdb.movie(search_results[0].id).details()
-            logo = await get_logo(movie.id, "movie")
-
-            return {
-                "tmdb_id": movie.id, "title": movie.title,
-                "release_year": movie.release_date.year if movie.release_date else year,
-                "rating": round(movie.vote_average, 1), "genres": [g.name for g in movie.genres],
-                "poster": format_tmdb_image(movie.poster_path),
-                "backdrop": format_tmdb_image(movie.backdrop_path, "original"),
-                "logo": logo, "description": movie.overview, "media_type": "movie",
-                "quality": quality, "url": file_url,
-            }
+            search = _memoized(memo, ("movie", title.lower(), year), lambda: search_movie_id(title, year))
+        tmdb_id = await _timed(timings, "search", search)
+        if not tmdb_id: return None
+
+        stages = [
+            _timed(timings, "details", (tmdb.tv(tmdb_id) if is_episode else tmdb.movie(tmdb_id)).details()),
+            _timed(timings, "logo", get_logo(tmdb_id, media_type)),
+        ]
+        if is_episode:
+            stages.append(_timed(timings, "episode", _fetch_episode(tmdb_id, season, episode)))
+        details, logo, *episode_data = await asyncio.gather(*stages)
+
+        result = {
+            "tmdb_id": details.id, "title": details.name if is_episode else details.title,
+            "rating": round(details.vote_average, 1), "genres": [g.name for g in details.genres],
+            "poster": format_tmdb_image(details.poster_path),
+            "backdrop": format_tmdb_image(details.backdrop_path, "original"),
+            "logo": logo, "description": details.overview, "media_type": media_type,
+            "quality": quality, "url": file_url,
+        }
+        released = details.first_air_date if is_episode else details.release_date
+        result["release_year"] = released.year if released else year
+        if is_episode:
+            result["seasons"] = [{"season_number": season, "episodes": episode_data}]
+        timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        result["timings"] = timings
+        return result
+    except RateLimitExceeded:
+        # Not a metadata problem: let the caller report it (and retry later) instead of returning "no match"
+        raise
     except Exception as e:
         LOGGER.error(f"Error fetching metadata for '{filename}': {e}")
         return None
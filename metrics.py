@@ -0,0 +1,188 @@
+"""Minimal Prometheus instrumentation: counters, histograms and the text exposition format."""
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Tuple
+
+# Seconds; covers cache hits (sub-millisecond) up to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: Dict[str, str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in (extra or {}).items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[tuple, list] = {}  # label values -> [bucket counts..., sum, count]
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, {'le': '+Inf'})} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self._histogram, self._labels = histogram, labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- Application metrics ---
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status",
+                        ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                         ("method", "route", "group"))
+MONGO_LATENCY = Histogram("mongo_operation_duration_seconds", "Duration of Database methods", ("operation",))
+MONGO_ERRORS = Counter("mongo_operation_errors_total", "Database methods that raised", ("operation",))
+TMDB_REQUESTS = Counter("tmdb_requests_total", "Upstream TMDb requests (cache misses)",
+                        ("resource", "outcome"))
+TMDB_LATENCY = Histogram("tmdb_request_duration_seconds", "Upstream TMDb request latency, including retries",
+                         ("resource",))
+METADATA_CALLS = Counter("metadata_calls_total", "Calls of metadata.py functions", ("function", "outcome"))
+METADATA_LATENCY = Histogram("metadata_call_duration_seconds", "Duration of metadata.py functions", ("function",))
+INGEST_STAGE_LATENCY = Histogram("ingest_stage_duration_seconds", "Duration of ingest pipeline stages", ("stage",))
+LINK_CHECKS = Counter("link_checks_total", "Stream link health checks by result", ("result",))
+LINK_CHECK_LATENCY = Histogram("link_check_duration_seconds", "Duration of stream link health probes")
+METADATA_REFRESHES = Counter("metadata_refreshes_total", "Titles refreshed from TMDb's change feeds by result",
+                             ("media_type", "result"))
+
+
+def instrument(histogram: Histogram, errors: Counter, label: str, exclude: Iterable[str] = ()):
+    """Class decorator timing every public coroutine method into `histogram`, labelled by method name."""
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not inspect.iscoroutinefunction(method):
+                continue
+            setattr(cls, name, timed(histogram, errors, **{label: name})(method))
+        return cls
+    return decorate
+
+
+def timed(histogram: Histogram, errors: Counter, **labels):
+    """Decorator timing a coroutine function; exceptions are counted in `errors` and re-raised."""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorate
+
+
+def traced(func):
+    """Decorator for metadata.py functions: call counts by outcome and latency."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            METADATA_CALLS.inc(function=func.__name__, outcome=outcome)
+            METADATA_LATENCY.observe(time.perf_counter() - start, function=func.__name__)
+    return wrapper
+
+
+def route_group(path: str) -> str:
+    if path.startswith("/stremio/"):
+        return "stremio"
+    if path.startswith("/api/"):
+        return "api"
+    return "web"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts and latency (until the body is fully sent) per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=str(status))
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=route,
+                                 group=route_group(route))
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 # Defines the structure for each available stream/quality
@@ -8,6 +8,13 @@ class StreamInfo(BaseModel):
     url: str
     name: str
     size: str
+    # Link health, maintained by the background checker (health.py): "live", "dead" or "unknown"
+    status: Optional[str] = None
+    size_bytes: Optional[int] = None
+    checked_at: Optional[datetime] = None
+    # Where the URL ended up after redirects when last probed, and until when that holds (None = no expiry)
+    resolved_url: Optional[str] = None
+    resolved_until: Optional[datetime] = None
 
 # Defines the structure for a single episode
 class Episode(BaseModel):
@@ -42,3 +49,41 @@ class MovieSchema(MediaBase):
 # The final schema for a TV show document
 class TVShowSchema(MediaBase):
     seasons: List[Season] = Field(default_factory=list)
+
+# Partial edits sent by the media editor (PATCH /api/media/...): title fields to set, plus targeted
+# operations on seasons, episodes and streams. Only the fields that are sent get written
+class TitleChanges(BaseModel):
+    title: Optional[str] = None
+    genres: Optional[List[str]] = None
+    description: Optional[str] = None
+    rating: Optional[float] = None
+    release_year: Optional[int] = None
+    poster: Optional[str] = None
+    backdrop: Optional[str] = None
+    logo: Optional[str] = None
+
+class EpisodeChanges(BaseModel):
+    title: Optional[str] = None
+    episode_backdrop: Optional[str] = None
+
+# Streams are addressed by URL; a new URL is a remove_stream plus an add_stream
+class StreamChanges(BaseModel):
+    quality: Optional[str] = None
+    name: Optional[str] = None
+    size: Optional[str] = None
+
+class MediaPatchOp(BaseModel):
+    op: Literal["add_season", "remove_season", "add_episode", "remove_episode", "set_episode",
+                "add_stream", "update_stream", "remove_stream"]
+    season: Optional[int] = None
+    episode: Optional[int] = None
+    url: Optional[str] = None
+    # Episode for add_episode, EpisodeChanges for set_episode, StreamInfo for add_stream,
+    # StreamChanges for update_stream
+    value: Optional[Dict[str, Any]] = None
+
+class MediaPatch(BaseModel):
+    # The updated_on the editor loaded; the patch is refused if the title changed since
+    updated_on: datetime
+    set: TitleChanges = Field(default_factory=TitleChanges)
+    ops: List[MediaPatchOp] = Field(default_factory=list)
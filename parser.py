@@ -0,0 +1,104 @@
+import re
+from functools import lru_cache
+
+import PTN
+from PTN.extras import exceptions as PTN_EXCEPTIONS
+from PTN.parse import PTN as PTNParser
+from PTN.patterns import patterns as PTN_PATTERNS, patterns_ordered as PTN_PATTERN_KEYS
+
+from config import settings
+
+FIELDS = ("title", "year", "resolution", "season", "episode")
+PARSE_STATS = {"fast_path": 0, "ptn": 0}
+
+
+def _ptn_regex(key: str) -> re.Pattern:
+    # PTN's own patterns for `key` as one regex, bounded the same way PTN bounds them
+    options = []
+    for pattern, _, _ in PTNParser.normalise_pattern_options(PTN_PATTERNS[key]):
+        if key not in ("season", "episode", "site", "language", "genre"):
+            pattern = rf"\b(?:{pattern})\b"
+        options.append(f"(?:{pattern})")
+    return re.compile("|".join(options), re.IGNORECASE)
+
+
+# Anything PTN could recognize inside the title, or that would change its year/season/episode
+# if it appeared after the resolution, sends the name to PTN instead. One regex per key is
+# several times faster than a single alternation of all of them.
+_TITLE_RESERVED = [_ptn_regex(key) for key in PTN_PATTERN_KEYS]
+_TAIL_RESERVED = [_ptn_regex(key) for key in ("season", "episode", "year", "month", "day")]
+_EXCEPTION_TITLES = {e["parsed_title"] for e in PTN_EXCEPTIONS}
+
+_TOKEN = r"[A-Za-z0-9']+(?:-[A-Za-z0-9']+)*"
+
+
+def _scene_pattern(d: str) -> re.Pattern:
+    # Title.Words[.Year][.SxxEyy].Resolution[.anything], with one delimiter throughout the title part
+    d = re.escape(d)
+    return re.compile(
+        rf"^(?P<title>{_TOKEN}(?:{d}{_TOKEN})*?){d}"
+        rf"(?:(?P<year>(?:19[0-9]|20[0-2])[0-9]){d})?"
+        rf"(?:[Ss](?P<season>[0-9]{{1,2}})[Ee](?P<episode>[0-9]{{1,2}}){d})?"
+        rf"(?P<resolution>[0-9]{{3,4}}[PpIi])"
+        rf"(?P<tail>[-. _\[(].*)?$"
+    )
+
+
+_SCENE_PATTERNS = {d: _scene_pattern(d) for d in ". _"}
+
+
+@lru_cache(maxsize=settings.PARSE_CACHE_SIZE)
+def _is_reserved(raw_title: str) -> bool:
+    # The costly check, but titles repeat a lot (every episode of a show) so it is memoized on its own
+    return any(r.search(raw_title) for r in _TITLE_RESERVED)
+
+
+def _fast_parse(filename: str) -> tuple | None:
+    for d, pattern in _SCENE_PATTERNS.items():
+        if d not in filename:
+            continue
+        m = pattern.match(filename)
+        if not m:
+            continue
+        raw_title = m["title"].replace("_", " ")
+        if _is_reserved(raw_title) or (m["tail"] and any(r.search(m["tail"].replace("_", " "))
+                                                         for r in _TAIL_RESERVED)):
+            return None
+        title = raw_title.replace(".", " ") if d == "." else raw_title
+        if title in _EXCEPTION_TITLES or re.search(r"\d-\d{1,2}$", title):
+            return None
+        return (title, int(m["year"]) if m["year"] else None, m["resolution"].lower(),
+                int(m["season"]) if m["season"] else None, int(m["episode"]) if m["episode"] else None)
+    return None
+
+
+@lru_cache(maxsize=settings.PARSE_CACHE_SIZE)
+def _parse(filename: str) -> tuple:
+    fast = _fast_parse(filename)
+    if fast:
+        PARSE_STATS["fast_path"] += 1
+        return fast
+    PARSE_STATS["ptn"] += 1
+    parsed = PTN.parse(filename)
+    return tuple(parsed.get(field) for field in FIELDS)
+
+
+def parse(filename: str) -> dict:
+    """Parses a release filename into PTN's title/year/resolution/season/episode fields.
+
+    Common scene names are handled by a single compiled regex; anything else (or anything that
+    regex can't be sure about) goes through PTN. Results are memoized.
+    """
+    return dict(zip(FIELDS, _parse(filename.strip())))
+
+
+def parse_ptn(filename: str) -> dict:
+    """PTN alone, for comparing against `parse`."""
+    parsed = PTN.parse(filename.strip())
+    return {field: parsed.get(field) for field in FIELDS}
+
+
+def get_parse_stats() -> dict:
+    info = _parse.cache_info()
+    return {**PARSE_STATS, "memo": {"size": info.currsize, "maxsize": info.maxsize,
+                                    "hits": info.hits, "misses": info.misses}}
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when an upstream keeps throttling us after all retries."""
+
+
+def _status_of(exc: Exception) -> Optional[int]:
+    # aiohttp.ClientResponseError has `.status`; httpx.HTTPStatusError has `.response.status_code`
+    status = getattr(exc, "status", None)
+    if status is None and getattr(exc, "response", None) is not None:
+        status = getattr(exc.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after_of(exc: Exception) -> Optional[float]:
+    headers = getattr(exc, "headers", None) or getattr(getattr(exc, "response", None), "headers", None) or {}
+    value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """Client-side limiter for an API with a request quota.
+
+    Calls are paced by a token bucket and capped by a concurrency limit that grows slowly on
+    success and halves whenever the upstream throttles us (AIMD). 429/5xx responses are retried
+    after `Retry-After` (or exponential backoff), and every caller pauses during that window.
+    """
+
+    def __init__(self, rate: float, burst: int, max_concurrency: int, max_retries: int = 4):
+        self._bucket = TokenBucket(rate, burst)
+        self._max_concurrency = max_concurrency
+        self._limit = float(max_concurrency)
+        self._active = 0
+        self._slots = asyncio.Condition()
+        self._paused_until = 0.0
+        self.max_retries = max_retries
+        self.counters = {"requests": 0, "queued": 0, "throttled": 0, "retried": 0, "failed": 0}
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": self._active, "concurrency_limit": int(self._limit)}
+
+    async def run(self, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            try:
+                self.counters["requests"] += 1
+                result = await fetch()
+            except Exception as e:
+                status = _status_of(e)
+                if status not in RETRY_STATUSES:
+                    raise
+                self._on_throttled(attempt, _retry_after_of(e))
+                if attempt == self.max_retries:
+                    self.counters["failed"] += 1
+                    raise RateLimitExceeded(f"Upstream still throttling after {attempt + 1} attempts "
+                                            f"(HTTP {status})") from e
+                self.counters["retried"] += 1
+                continue
+            finally:
+                await self._release()
+            self._limit = min(self._max_concurrency, self._limit + 1 / self._limit)
+            return result
+
+    async def _acquire(self):
+        self.counters["queued"] += 1
+        try:
+            async with self._slots:
+                await self._slots.wait_for(lambda: self._active < int(self._limit))
+                self._active += 1
+            try:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                await self._bucket.acquire()
+            except BaseException:
+                await self._release()
+                raise
+        finally:
+            self.counters["queued"] -= 1
+
+    async def _release(self):
+        async with self._slots:
+            self._active -= 1
+            self._slots.notify_all()
+
+    def _on_throttled(self, attempt: int, retry_after: Optional[float]):
+        self.counters["throttled"] += 1
+        self._limit = max(1.0, self._limit / 2)
+        delay = retry_after if retry_after is not None else min(2 ** attempt + random.random(), 30)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        LOGGER.warning(f"Throttled by upstream; pausing {delay:.1f}s, concurrency limit now {int(self._limit)}")
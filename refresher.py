@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from config import settings
+from database import db
+from metadata import format_tmdb_image, tmdb
+from metrics import METADATA_REFRESHES
+from ratelimit import RateLimitExceeded
+
+LOGGER = logging.getLogger(__name__)
+
+CHECKPOINT = "tmdb-changes"
+# TMDb's change feeds answer for at most 14 days at a time
+MAX_WINDOW = timedelta(days=14)
+# Changed titles refreshed per batch
+BATCH_SIZE = 100
+# TMDb appends at most 20 sub-requests to one call; one of them fetches the images
+MAX_APPENDED_SEASONS = 19
+
+
+def _title_fields(media_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    # The same fields get_metadata stores at ingest, from a raw TMDb details answer; empty ones are left out
+    # so a gap on TMDb's side doesn't wipe what we have
+    released = data.get("release_date" if media_type == "movie" else "first_air_date") or ""
+    logos = sorted((data.get("images") or {}).get("logos") or [],
+                   key=lambda x: (x.get("iso_639_1") != "en", x.get("iso_639_1") is not None))
+    fields = {
+        "title": data.get("title" if media_type == "movie" else "name"),
+        "rating": round(data["vote_average"], 1) if data.get("vote_average") is not None else None,
+        "genres": [g["name"] for g in data.get("genres") or []] or None,
+        "description": data.get("overview"),
+        "release_year": int(released[:4]) if released[:4].isdigit() else None,
+        "poster": format_tmdb_image(data.get("poster_path")),
+        "backdrop": format_tmdb_image(data.get("backdrop_path"), "original"),
+        "logo": format_tmdb_image(logos[0]["file_path"], "original") if logos else None,
+    }
+    return {k: v for k, v in fields.items() if v not in (None, "")}
+
+
+class MetadataRefresher:
+    """Keeps stored titles in step with TMDb using its change feeds.
+
+    Every `interval` seconds the movie and TV change feeds are read from the last checkpoint on
+    (kept in Mongo, so restarts and other processes carry on where it left off). The changed IDs are
+    intersected with the library, and only those titles are fetched again, a few at a time through
+    the shared TMDb rate limiter: one call per title, including its images and the seasons we store.
+    Fields that differ from TMDb are written and the title's Stremio responses rebuilt.
+    """
+
+    def __init__(self, interval: int = settings.REFRESH_INTERVAL, concurrency: int = settings.REFRESH_CONCURRENCY,
+                 lookback_days: int = settings.REFRESH_LOOKBACK_DAYS, fields: List[str] = settings.REFRESH_FIELDS):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.lookback = timedelta(days=lookback_days)
+        self.fields = set(fields)
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"polls": 0, "feed_calls": 0, "changed": 0, "matched": 0, "updated": 0, "unchanged": 0,
+                         "errors": 0}
+        self.last_poll: Optional[datetime] = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "running": self._task is not None and not self._task.done(),
+                "last_poll": self.last_poll.isoformat() if self.last_poll else None}
+
+    async def start(self):
+        if settings.REFRESH_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            delay = self.interval
+            try:
+                checkpoint = await db.get_checkpoint(CHECKPOINT)
+                # A process taking over the service waits out the interval its predecessor started
+                due = checkpoint + timedelta(seconds=self.interval) if checkpoint else datetime.utcnow()
+                wait = (due - datetime.utcnow()).total_seconds()
+                if wait <= 0:
+                    await self.poll(checkpoint)
+                else:
+                    delay = wait
+            except asyncio.CancelledError:
+                raise
+            except RateLimitExceeded:
+                LOGGER.warning("TMDb kept throttling the metadata refresh; retrying at the next interval")
+            except Exception as e:
+                LOGGER.error(f"Metadata refresh error: {e}", exc_info=True)
+            await asyncio.sleep(delay)
+
+    async def poll(self, since: Optional[datetime] = None) -> Dict[str, int]:
+        """Refreshes every stored title that changed on TMDb since `since`, then moves the checkpoint to now."""
+        now = datetime.utcnow()
+        since = since or now - self.lookback
+        result = {}
+        for media_type in ("movie", "tv"):
+            changed = await self.changed_ids(media_type, since, now)
+            stored = await db.filter_stored_ids(media_type, changed)
+            self.counters["changed"] += len(changed)
+            self.counters["matched"] += len(stored)
+            updated = await self.refresh_many(media_type, stored)
+            result[media_type] = updated
+            LOGGER.info(f"TMDb reports {len(changed)} changed {media_type} titles since {since:%Y-%m-%d %H:%M}; "
+                        f"{len(stored)} are in the library, {updated} updated")
+        await db.set_checkpoint(CHECKPOINT, now)
+        self.counters["polls"] += 1
+        self.last_poll = now
+        return result
+
+    async def changed_ids(self, media_type: str, since: datetime, until: datetime) -> Set[int]:
+        # The feeds work in whole days, so the day of the checkpoint is read again; that only repeats
+        # refreshes of titles that changed on it
+        ids, start = set(), since
+        while True:
+            end = min(start + MAX_WINDOW, until)
+            page, pages = 1, 1
+            while page <= pages:
+                data = await tmdb.request(f"{media_type}/changes", start_date=f"{start:%Y-%m-%d}",
+                                          end_date=f"{end:%Y-%m-%d}", page=page)
+                self.counters["feed_calls"] += 1
+                ids.update(item["id"] for item in data.get("results") or [])
+                pages = data.get("total_pages") or 1
+                page += 1
+            if end >= until:
+                return ids
+            start = end
+
+    async def refresh_many(self, media_type: str, tmdb_ids: List[int]) -> int:
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def one(tmdb_id: int) -> bool:
+            async with slots:
+                try:
+                    updated = await self.refresh(media_type, tmdb_id)
+                except (asyncio.CancelledError, RateLimitExceeded):
+                    raise
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    METADATA_REFRESHES.inc(media_type=media_type, result="error")
+                    LOGGER.warning(f"Could not refresh {media_type} {tmdb_id} from TMDb: {e}")
+                    return False
+            result = "updated" if updated else "unchanged"
+            self.counters[result] += 1
+            METADATA_REFRESHES.inc(media_type=media_type, result=result)
+            return updated
+
+        updated = 0
+        for i in range(0, len(tmdb_ids), BATCH_SIZE):
+            updated += sum(await asyncio.gather(*(one(t) for t in tmdb_ids[i:i + BATCH_SIZE])))
+        return updated
+
+    async def refresh(self, media_type: str, tmdb_id: int) -> bool:
+        """Fetches one title from TMDb (bypassing the response cache) and stores what changed."""
+        current = await db.get_title_outline(media_type, tmdb_id)
+        if not current:
+            return False
+        seasons = sorted(s["season_number"] for s in current.get("seasons") or []) \
+            if media_type == "tv" and "episodes" in self.fields else []
+        appended = ["images"] + [f"season/{n}" for n in seasons[:MAX_APPENDED_SEASONS]]
+        data = await tmdb.request(f"{media_type}/{tmdb_id}", append_to_response=",".join(appended),
+                                  include_image_language="en,null")
+        for n in seasons[MAX_APPENDED_SEASONS:]:
+            data[f"season/{n}"] = await tmdb.request(f"tv/{tmdb_id}/season/{n}")
+
+        fields = {k: v for k, v in _title_fields(media_type, data).items()
+                  if k in self.fields and current.get(k) != v}
+        episodes = {}
+        for season in current.get("seasons") or []:
+            fresh = {e["episode_number"]: e for e in (data.get(f"season/{season['season_number']}") or {})
+                     .get("episodes") or []}
+            for episode in season.get("episodes", []):
+                tmdb_episode = fresh.get(episode["episode_number"])
+                if not tmdb_episode:
+                    continue
+                changes = {"title": tmdb_episode.get("name"),
+                           "episode_backdrop": format_tmdb_image(tmdb_episode.get("still_path"), "original")}
+                changes = {k: v for k, v in changes.items() if v and episode.get(k) != v}
+                if changes:
+                    episodes[(season["season_number"], episode["episode_number"])] = changes
+        if not fields and not episodes:
+            return False
+        return await db.update_title_metadata(media_type, tmdb_id, fields, episodes)
+
+
+refresher = MetadataRefresher()
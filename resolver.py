@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlparse
+
+import httpx
+
+from cache import TTLCache, MISSING
+from config import settings
+from database import db
+from http_client import ProbeResult, http
+
+LOGGER = logging.getLogger(__name__)
+
+PERMANENT_REDIRECTS = {301, 308}
+# A resolution is dropped this long (seconds) before its URL expires, so players never start on a dying URL
+EXPIRY_MARGIN = 60
+# How long a failed resolution falls back to the stored URL before trying again (seconds)
+FAILURE_TTL = 60
+
+# Query parameters signed URLs use for an absolute expiry (Unix time), e.g. CloudFront, B2, most CDNs
+_EPOCH_PARAMS = {"expires", "expire", "expiry", "exp", "e", "validto", "deadline"}
+_MAX_AGE = re.compile(r"(?:s-)?max-age=(\d+)")
+
+
+def _signed_url_expiry(url: str) -> Optional[datetime]:
+    params = {k.lower(): v for k, v in parse_qsl(urlparse(url).query)}
+    for prefix in ("x-amz-", "x-goog-"):
+        # S3 / GCS v4 signatures: signing time plus a lifetime in seconds
+        date, lifetime = params.get(f"{prefix}date"), params.get(f"{prefix}expires")
+        if date and lifetime and lifetime.isdigit():
+            try:
+                return datetime.strptime(date, "%Y%m%dT%H%M%SZ") + timedelta(seconds=int(lifetime))
+            except ValueError:
+                pass
+    if params.get("se"):
+        # Azure SAS: ISO 8601 signed expiry
+        try:
+            return datetime.fromisoformat(params["se"].replace("Z", "+00:00")).replace(tzinfo=None)
+        except ValueError:
+            pass
+    for key in _EPOCH_PARAMS & params.keys():
+        value = params[key]
+        if value.isdigit() and len(value) in (10, 13):
+            return datetime.utcfromtimestamp(int(value[:10]))
+    return None
+
+
+def _redirect_expiry(headers: Dict[str, str], now: datetime) -> Optional[datetime]:
+    # How long the host allows the redirect itself to be cached
+    headers = {k.lower(): v for k, v in headers.items()}
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return now
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        return now + timedelta(seconds=int(match.group(1)))
+    if headers.get("expires"):
+        try:
+            return parsedate_to_datetime(headers["expires"]).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return now
+    return None
+
+
+def resolution_from_probe(result: ProbeResult) -> Dict[str, Any]:
+    """Stream fields recording where a probed URL ended up and until when that holds.
+
+    `resolved_until` is None when the answer doesn't expire: no redirect at all, or only permanent
+    ones without expiry hints.
+    """
+    resolution = {"resolved_url": result.final_url, "resolved_until": None}
+    if not result.history:
+        return resolution
+    now = datetime.utcnow()
+    hints = [_signed_url_expiry(result.final_url)] + [_redirect_expiry(headers, now) for _, headers in result.history]
+    hints = [hint for hint in hints if hint is not None]
+    if hints:
+        resolution["resolved_until"] = min(hints)
+    elif not all(status in PERMANENT_REDIRECTS for status, _ in result.history):
+        resolution["resolved_until"] = now + timedelta(seconds=settings.RESOLVE_TTL)
+    return resolution
+
+
+class Resolver:
+    """Answers "where does this stream URL lead right now" for the /play endpoint.
+
+    Resolutions are looked up in memory, then in what ingest and the link checker stored, and only
+    then by following the redirects again. Each is trusted until shortly before its URL expires, so a
+    rotating signed URL is simply re-resolved on the next play. Concurrent plays of one URL share a
+    single resolution, and when resolving fails the stored URL is used, so playback never gets worse
+    than without the resolver.
+    """
+
+    def __init__(self, maxsize: int = settings.RESOLVE_CACHE_SIZE, ttl: int = settings.RESOLVE_TTL):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"db_hits": 0, "resolved": 0, "failed": 0, "coalesced": 0}
+
+    def stats(self) -> dict:
+        return {**self.counters, "memory": self._cache.stats()}
+
+    async def resolve(self, url: str) -> str:
+        target = self._cache.get(url)
+        if target is not MISSING:
+            return target
+        if url in self._inflight:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(self._inflight[url])
+        future = asyncio.ensure_future(self._resolve(url))
+        self._inflight[url] = future
+        future.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(future)
+
+    def _remember(self, url: str, resolution: Dict[str, Any]) -> Optional[str]:
+        until = resolution.get("resolved_until")
+        ttl = self.ttl if until is None else min(self.ttl, (until - datetime.utcnow()).total_seconds() - EXPIRY_MARGIN)
+        if ttl <= 0:
+            return None
+        self._cache.set(url, resolution["resolved_url"], ttl)
+        return resolution["resolved_url"]
+
+    async def _resolve(self, url: str) -> str:
+        try:
+            stored = await db.get_link_resolution(url)
+            if stored and stored.get("resolved_url"):
+                target = self._remember(url, stored)
+                if target:
+                    self.counters["db_hits"] += 1
+                    return target
+        except Exception as e:
+            LOGGER.warning(f"Could not read the stored resolution of {url}: {e}")
+
+        try:
+            resolution = resolution_from_probe(await http.probe(url))
+        except (httpx.HTTPError, ValueError) as e:
+            self.counters["failed"] += 1
+            LOGGER.warning(f"Could not resolve {url}: {e}")
+            self._cache.set(url, url, FAILURE_TTL)
+            return url
+        self.counters["resolved"] += 1
+        target = self._remember(url, resolution) or resolution["resolved_url"]
+        try:
+            await db.save_link_resolution(url, resolution)
+        except Exception as e:
+            LOGGER.warning(f"Could not store the resolution of {url}: {e}")
+        return target
+
+
+resolver = Resolver()
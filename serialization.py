@@ -0,0 +1,33 @@
+"""JSON rendering for the hot paths.
+
+orjson serializes `datetime` natively and `ObjectId` through `_default`. Documents read from Mongo
+can therefore be rendered as they come, without a per-key sanitizing pass or FastAPI's
+`jsonable_encoder`.
+"""
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumpb(obj: Any) -> bytes:
+    """Compact UTF-8 JSON; datetimes become ISO 8601 strings and ObjectIds hex strings."""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dumps(obj: Any) -> str:
+    return dumpb(obj).decode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson. Return it directly to also skip `jsonable_encoder`."""
+
+    def render(self, content: Any) -> bytes:
+        return dumpb(content)
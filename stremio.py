@@ -0,0 +1,159 @@
+import base64
+import hashlib
+import hmac
+import json
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from config import settings
+from serialization import dumps
+
+TMDB_IMAGE_BASE = "https://image.tmdb.org/t/p/"
+
+# Stored meta bodies use this in place of the Stremio ID; it is swapped for the ID
+# Stremio actually requested (tt... or ddl-...) when the response is served.
+ID_PLACEHOLDER = "__STREMIO_ID__"
+
+
+def stremio_type(media_type: str) -> str:
+    return "series" if media_type == "tv" else "movie"
+
+
+def make_etag(body: str) -> str:
+    return hashlib.blake2b(body.encode(), digest_size=10).hexdigest()
+
+
+def meta_key(media_type: str, tmdb_id: int) -> str:
+    return f"meta:{media_type}:{tmdb_id}"
+
+
+def stream_key(media_type: str, tmdb_id: int, season: Optional[int] = None, episode: Optional[int] = None) -> str:
+    if season is None:
+        return f"stream:{media_type}:{tmdb_id}"
+    return f"stream:{media_type}:{tmdb_id}:{season}:{episode}"
+
+
+def image_url(url: Optional[str], variant: str) -> Optional[str]:
+    """A TMDb image through the resizing proxy (images.py) when IMAGE_PROXY is on; anything else as stored."""
+    if not settings.IMAGE_PROXY or not url or not url.startswith(TMDB_IMAGE_BASE):
+        return url
+    return f"{settings.BASE_URL}/img/{variant}/{url.rsplit('/', 1)[-1]}"
+
+
+def build_catalog_entry(item: Dict[str, Any]) -> Dict[str, Any]:
+    # The catalog uses the custom ddl- prefix to avoid conflicts
+    return {"id": f"ddl-{item['tmdb_id']}", "type": stremio_type(item['media_type']), "name": item['title'],
+            "poster": image_url(item.get('poster'), "poster"), "year": item.get('release_year'),
+            "logo": image_url(item.get('logo'), "logo")}
+
+
+def build_meta(item: Dict[str, Any]) -> Dict[str, Any]:
+    meta_obj = {
+        "id": ID_PLACEHOLDER,
+        "type": stremio_type(item['media_type']),
+        "name": item['title'],
+        "poster": image_url(item.get('poster'), "poster"),
+        "background": image_url(item.get('backdrop'), "backdrop"),
+        "logo": image_url(item.get('logo'), "logo"),
+        "description": item.get('description'),
+        "year": item.get('release_year'),
+        "imdbRating": item.get('rating'),
+        "genres": item.get('genres')
+    }
+    if item['media_type'] == 'tv':
+        meta_obj['videos'] = [
+            {
+                "id": f"{ID_PLACEHOLDER}:{s['season_number']}:{e['episode_number']}",
+                "title": e['title'],
+                "season": s['season_number'],
+                "episode": e['episode_number'],
+                "thumbnail": image_url(e.get('episode_backdrop'), "still")
+            }
+            for s in sorted(item.get('seasons', []), key=lambda x: x['season_number'])
+            for e in sorted(s.get('episodes', []), key=lambda x: x['episode_number'])
+        ]
+    return meta_obj
+
+
+_PLAY_KEY = hashlib.sha256(f"play:{settings.SESSION_SECRET}".encode()).digest()
+
+
+def play_token(url: str) -> str:
+    """Signed, self-contained token for /play/<token>; only URLs we issued tokens for can be redirected to."""
+    signature = hmac.new(_PLAY_KEY, url.encode(), hashlib.sha256).digest()[:12]
+    return base64.urlsafe_b64encode(signature + url.encode()).decode().rstrip("=")
+
+
+def read_play_token(token: str) -> Optional[str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except ValueError:
+        return None
+    signature, url = raw[:12], raw[12:]
+    if not hmac.compare_digest(signature, hmac.new(_PLAY_KEY, url, hashlib.sha256).digest()[:12]):
+        return None
+    return url.decode(errors="replace")
+
+
+def playback_url(stream: Dict[str, Any]) -> str:
+    """The URL handed to Stremio for a stored stream (see PLAYBACK_MODE)."""
+    url, resolved = stream['url'], stream.get('resolved_url')
+    if resolved and stream.get('resolved_until') is None:
+        # No redirect at all, or only permanent ones: the final URL is as good as the stored one, minus the hops
+        return resolved
+    if settings.PLAYBACK_MODE == "play":
+        return f"{settings.BASE_URL}/play/{play_token(url)}/{quote(stream.get('name') or 'video', safe='')}"
+    return url
+
+
+def build_streams(streams: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Links the health checker found dead are hidden; verified live ones come before unchecked ones
+    alive = [q for q in streams if q.get('status') != "dead"]
+    alive.sort(key=lambda q: q.get('status') != "live")
+    return [{"name": "DDL", "title": f"{q['quality']} - {q['size']}\n{q['name']}", "url": playback_url(q)}
+            for q in alive]
+
+
+def _response_doc(key: str, item: Dict[str, Any], kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    body = dumps(payload)
+    return {"_id": key, "media_type": item['media_type'], "tmdb_id": item['tmdb_id'], "kind": kind,
+            "body": body, "etag": make_etag(body)}
+
+
+def materialize_meta(item: Dict[str, Any]) -> Dict[str, Any]:
+    return _response_doc(meta_key(item['media_type'], item['tmdb_id']), item, "meta", {"meta": build_meta(item)})
+
+
+def materialize_streams(media_type: str, tmdb_id: int, streams: List[Dict[str, Any]],
+                        season: Optional[int] = None, episode: Optional[int] = None) -> Dict[str, Any]:
+    item = {"media_type": media_type, "tmdb_id": tmdb_id}
+    return _response_doc(stream_key(media_type, tmdb_id, season, episode), item, "stream",
+                         {"streams": build_streams(streams)})
+
+
+def materialize(item: Dict[str, Any], episode: Optional[tuple] = None) -> List[Dict[str, Any]]:
+    """Builds the pre-serialized meta and stream responses for a title.
+
+    When `episode` is a (season, episode) pair only the meta and that episode's stream
+    response are built, which is all a single added stream can change.
+    """
+    media_type, tmdb_id = item['media_type'], item['tmdb_id']
+    docs = [materialize_meta(item)]
+    if media_type == 'movie':
+        docs.append(materialize_streams(media_type, tmdb_id, item.get('streams', [])))
+        return docs
+    for s in item.get('seasons', []):
+        for e in s.get('episodes', []):
+            if episode and (s['season_number'], e['episode_number']) != tuple(episode):
+                continue
+            docs.append(materialize_streams(media_type, tmdb_id, e.get('streams', []),
+                                            s['season_number'], e['episode_number']))
+    return docs
+
+
+def render(body: str, etag: str, stremio_id: str) -> tuple:
+    """Substitutes the requested Stremio ID into a stored body and derives a matching ETag."""
+    if ID_PLACEHOLDER not in body:
+        return body, f'"{etag}"'
+    body = body.replace(ID_PLACEHOLDER, json.dumps(stremio_id)[1:-1])
+    return body, f'"{etag}-{hashlib.blake2b(stremio_id.encode(), digest_size=4).hexdigest()}"'
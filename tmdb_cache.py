@@ -0,0 +1,205 @@
+import asyncio
+import importlib.util
+import inspect
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from cache import TTLCache, MISSING
+from config import settings
+from database import db
+from metrics import TMDB_LATENCY, TMDB_REQUESTS
+from ratelimit import AdaptiveLimiter
+
+LOGGER = logging.getLogger(__name__)
+
+# CACHE_BACKEND=redis needs the optional `redis` package (pip install redis)
+REDIS_AVAILABLE = importlib.util.find_spec("redis") is not None
+
+
+def ttl_for(resource: str, method: str) -> int:
+    """Cache lifetime of a TMDb call, by endpoint type."""
+    if resource == "search":
+        return settings.TMDB_CACHE_TTL_SEARCH
+    if resource == "find":
+        return settings.TMDB_CACHE_TTL_FIND
+    if method == "images":
+        return settings.TMDB_CACHE_TTL_IMAGES
+    return settings.TMDB_CACHE_TTL_DETAILS
+
+
+class SQLiteStore:
+    """Optional on-disk backing for the TMDb cache so it survives restarts."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tmdb_cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+        self._conn.execute("DELETE FROM tmdb_cache WHERE expires_at <= ?", (time.time(),))
+        self._conn.commit()
+
+    def _get(self, key: str) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM tmdb_cache WHERE key = ?", (key,)).fetchone()
+        if not row or row[1] <= time.time():
+            return MISSING
+        return pickle.loads(row[0])
+
+    def _set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO tmdb_cache VALUES (?, ?, ?)",
+                               (key, pickle.dumps(value), time.time() + ttl))
+            self._conn.commit()
+
+    async def get(self, key: str) -> Any:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+
+class MongoStore:
+    """Cache tier shared by every process, in a Mongo collection with a TTL index."""
+
+    async def get(self, key: str) -> Any:
+        value = await db.cache_get(f"tmdb:{key}")
+        return MISSING if value is None else pickle.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await db.cache_set(f"tmdb:{key}", pickle.dumps(value), ttl)
+
+
+class RedisStore:
+    """Cache tier shared by every process, on a Redis-compatible server (Redis, Valkey, KeyDB, ...)."""
+
+    def __init__(self, url: str):
+        import redis.asyncio
+        self._redis = redis.asyncio.from_url(url)
+
+    async def get(self, key: str) -> Any:
+        value = await self._redis.get(f"tmdb:{key}")
+        return MISSING if value is None else pickle.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._redis.set(f"tmdb:{key}", pickle.dumps(value), ex=max(1, int(ttl)))
+
+
+def make_store():
+    """The second cache tier configured by CACHE_BACKEND / TMDB_CACHE_SQLITE_PATH, or None."""
+    if settings.CACHE_BACKEND == "mongo":
+        return MongoStore()
+    if settings.CACHE_BACKEND == "redis":
+        if REDIS_AVAILABLE:
+            return RedisStore(settings.REDIS_URL)
+        LOGGER.error("CACHE_BACKEND=redis needs the `redis` package; falling back to the per-process cache")
+    elif settings.CACHE_BACKEND:
+        LOGGER.error(f"Unknown CACHE_BACKEND '{settings.CACHE_BACKEND}'; use 'mongo' or 'redis'")
+    return SQLiteStore(settings.TMDB_CACHE_SQLITE_PATH) if settings.TMDB_CACHE_SQLITE_PATH else None
+
+
+class CachedTMDb:
+    """Drop-in wrapper around an `aioTMDb` client that caches and coalesces its calls.
+
+    `tmdb.tv(1399).details()` goes through the wrapper unchanged: results are kept in a bounded
+    LRU for a per-endpoint TTL (optionally backed by a SQLite, Mongo or Redis `store`), and
+    concurrent identical calls share one upstream request. Errors are never cached. Every
+    upstream call goes through the shared rate limiter.
+    """
+
+    def __init__(self, client, maxsize: int = 5000, sqlite_path: str = "", limiter: Optional[AdaptiveLimiter] = None,
+                 store=None):
+        self._client = client
+        self.limiter = limiter or AdaptiveLimiter(settings.TMDB_RATE_LIMIT, settings.TMDB_RATE_BURST,
+                                                  settings.TMDB_MAX_CONCURRENCY, settings.TMDB_MAX_RETRIES)
+        self._memory = TTLCache(maxsize=maxsize, ttl=settings.TMDB_CACHE_TTL_DETAILS)
+        self._store = store or (SQLiteStore(sqlite_path) if sqlite_path else None)
+        self._inflight: dict = {}
+        self.counters = {"upstream_calls": 0, "coalesced": 0, "store_hits": 0}
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        if inspect.iscoroutinefunction(attr):
+            # Raw `request()` calls are rate limited but not cached
+            async def raw(*args, **kwargs):
+                return await self._upstream(name, lambda: attr(*args, **kwargs))
+            return raw
+
+        def resource(*args, **kwargs):
+            return _CachedResource(self, name, (args, tuple(sorted(kwargs.items()))), attr(*args, **kwargs))
+        return resource
+
+    def stats(self) -> dict:
+        return {**self.counters, "inflight": len(self._inflight), "memory": self._memory.stats(),
+                "rate_limit": self.limiter.stats()}
+
+    async def call(self, key: Hashable, ttl: int, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = self._memory.get(key)
+        if value is not MISSING:
+            return value
+        if key in self._inflight:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.ensure_future(self._load(key, ttl, fetch))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, key: Hashable, ttl: int, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if self._store:
+            try:
+                value = await self._store.get(repr(key))
+            except Exception as e:
+                LOGGER.error(f"TMDb cache store read failed: {e}")
+                value = MISSING
+            if value is not MISSING:
+                self.counters["store_hits"] += 1
+                self._memory.set(key, value, ttl)
+                return value
+
+        self.counters["upstream_calls"] += 1
+        value = await self._upstream(self._resource_label(key), fetch)
+        self._memory.set(key, value, ttl)
+        if self._store:
+            try:
+                await self._store.set(repr(key), value, ttl)
+            except Exception as e:
+                LOGGER.error(f"TMDb cache store write failed: {e}")
+        return value
+
+    @staticmethod
+    def _resource_label(key: Hashable) -> str:
+        # e.g. "tv.details" or "search.movies"; keys built by _CachedResource are (name, args, method, ...)
+        return f"{key[0]}.{key[2]}" if isinstance(key, tuple) and len(key) > 2 else "other"
+
+    async def _upstream(self, resource: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await self.limiter.run(fetch)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            TMDB_REQUESTS.inc(resource=resource, outcome=outcome)
+            TMDB_LATENCY.observe(time.perf_counter() - start, resource=resource)
+
+
+class _CachedResource:
+    def __init__(self, owner: CachedTMDb, name: str, args: tuple, resource):
+        self._owner, self._name, self._args, self._resource = owner, name, args, resource
+
+    def __getattr__(self, method: str):
+        attr = getattr(self._resource, method)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            key = (self._name, self._args, method, args, tuple(sorted(kwargs.items())))
+            return await self._owner.call(key, ttl_for(self._name, method), lambda: attr(*args, **kwargs))
+        return call